@@ -1,206 +1,138 @@
 # ============================================
-# BLUEPRINT: MRF AGGREGATOR & RESOLVER
+# BLUEPRINT: MRF AGGREGATOR
 # ============================================
-# 1. Rebuilds Provider Map (Reference -> NPI) from source
-# 2. Joins with Extracted Rates
-# 3. Aggregates stats per (CPT, Provider)
+# 1. Loads rates already resolved to NPIs by the
+#    single-pass extractor (no second parse of the MRF)
+# 2. Aggregates stats per (CPT, Provider)
 # ============================================
 
-!pip install ijson
+!pip install pyarrow
 
 from google.colab import drive
-import ijson
-import gzip
 import json
 import os
-from collections import defaultdict
-from statistics import median, mean
-import gc
+import sys
 from datetime import datetime
+import numpy as np
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_aggregate import group_prices, iter_price_stats, select_top, spread_count_score, take_groups
+from mrf_columnar import load_rate_store, read_meta
+from mrf_memory import configure_gc, freeze_long_lived, restore_gc
+from mrf_profile import RunProfiler
+
 # ============================================
 # CONFIGURATION
 # ============================================
 
 BASE_DIR = '/content/drive/MyDrive/uhc-ny/medical'
 SOURCE_FILE = f"{BASE_DIR}/uhc-ny-choice-plus-medical.json.gz"
-EXTRACTED_FILE = f"{BASE_DIR}/extracted_rates_uhc-ny-choice-plus-medical.json"
+EXTRACTED_DATASET = f"{BASE_DIR}/extracted_rates_uhc-ny-choice-plus-medical"  # Columnar dataset dir
 OUTPUT_FILE = f"{BASE_DIR}/aggregated_rates_75.json"
 
 PROVIDER_LIMIT_PER_CPT = 100  # Keep top N providers per CPT to control file size
+# Ranks providers within a CPT from the columnar group stats (arrays of
+# min/max/median/mean/count); swap in another function to change the ranking
+PROVIDER_SCORE = spread_count_score
+RUN_REPORT = OUTPUT_FILE.replace('.json', '.run_report.json')  # Per-phase time, throughput, memory, GC
+PROFILE_SAMPLE = None  # 'cprofile' or 'stack': per-phase profiles next to RUN_REPORT
+GC_MODE = 'managed'    # Fewer collections, long-lived data frozen (mrf_memory.py); 'default' to compare
 
 print(f"📂 Source MRF: {SOURCE_FILE}")
-print(f"📂 Extracted Rates: {EXTRACTED_FILE}")
+print(f"📂 Extracted Rates: {EXTRACTED_DATASET}")
 print(f"🎯 Output: {OUTPUT_FILE}")
 
-# ============================================
-# PHASE 1: Rebuild Provider Map
-# ============================================
-
-print("\n" + "="*60)
-print("🔍 PHASE 1: Rebuilding Provider Map (Ref ID -> NPI)...")
-print("="*60)
-
-# Map: reference_id -> {npi: [...], tin: ...}
-provider_map = {}
-count = 0
-
-with gzip.open(SOURCE_FILE, 'rb') as f:
-    # Stream only provider_references
-    provider_refs = ijson.items(f, 'provider_references.item')
-    
-    for group_idx, group_list in enumerate(provider_refs):
-        # The index in the array is the reference ID used in rates
-        # Note: In some MRFs, it's 'provider_group_id', in others it's array index
-        # UHC usually uses array index as the implicit ID referenced in rate objects
-        
-        # Structure is typically:
-        # { "provider_group_id": 123, "provider_groups": [...] }
-        
-        ref_id = group_list.get('provider_group_id', group_idx)
-        
-        npis = set()
-        tins = set()
-        
-        for group in group_list.get('provider_groups', []):
-            for npi in group.get('npi', []):
-                npis.add(str(npi))
-            
-            tin = group.get('tin', {}).get('value')
-            if tin:
-                tins.add(tin)
-        
-        if npis:
-            provider_map[str(ref_id)] = {
-                'npis': list(npis),
-                'tins': list(tins)
-            }
-            
-        count += 1
-        if count % 10000 == 0:
-            print(f"  ...mapped {count:,} provider groups")
-
-print(f"✅ Mapped {len(provider_map):,} provider groups")
-gc.collect()
-
-# ============================================
-# PHASE 2: Load Extracted Rates
-# ============================================
-
-print("\n" + "="*60)
-print("📥 PHASE 2: Loading Extracted Rates...")
-print("="*60)
-
-with open(EXTRACTED_FILE, 'r') as f:
-    data = json.load(f)
-    raw_rates = data['records']
-
-print(f"✅ Loaded {len(raw_rates):,} raw rate records")
+profiler = RunProfiler('aggregate_blueprint', RUN_REPORT, sample=PROFILE_SAMPLE)
+configure_gc(GC_MODE)
 
 # ============================================
-# PHASE 3: Join & Aggregate
+# PHASE 1: Load Resolved Rates & Group
 # ============================================
+# colab_extract_mrf.py resolves provider_references in the same pass
+# as in_network, so every record already carries its providerNpi.
+# The needed columns are loaded into a compact RateStore (int codes +
+# float64 rates) and grouped in one vectorized pass, instead of millions
+# of dicts and per-provider lists.
 
 print("\n" + "="*60)
-print("🔄 PHASE 3: Joining & Aggregating...")
+print("📥 PHASE 1: Loading Resolved Rates & Grouping by CPT/Provider...")
 print("="*60)
 
-# Dictionary: CPT -> NPI -> List of Rates
-# aggregated[cpt][npi] = [rate1, rate2...]
-cpt_npi_rates = defaultdict(lambda: defaultdict(list))
-
-matched = 0
-unmatched = 0
-
-for record in raw_rates:
-    cpt = record['procedureCpt']
-    rate = record['negotiatedRate']
-    ref_id = str(record['providerRef'])
-    
-    # Resolve Provider
-    provider_info = provider_map.get(ref_id)
-    
-    if not provider_info:
-        unmatched += 1
-        continue
-        
-    matched += 1
+with profiler.stage('PHASE 1: Load & Group') as stage:
+    extract_meta = read_meta(EXTRACTED_DATASET)
+    store = load_rate_store(EXTRACTED_DATASET, ['procedureCpt', 'providerNpi', 'negotiatedRate'])
+    loaded = len(store)
+    print(f"  ...loaded {loaded:,} / {extract_meta['rows']:,} records ({store.nbytes() / 1024 / 1024:.1f} MB in memory)")
     
-    # Distribute rate to all NPIs in the group
-    # (A negotiated rate typically applies to all providers in the group)
-    for npi in provider_info['npis']:
-        cpt_npi_rates[cpt][npi].append(rate)
-
-print(f"✅ Matched {matched:,} records (Unmatched: {unmatched:,})")
-print(f"   CPTs processed: {len(cpt_npi_rates)}")
-
-del raw_rates
-del provider_map
-gc.collect()
+    # One vectorized group-by over (CPT code, NPI) — see mrf_aggregate.group_prices
+    cpt_codes = store.column('procedureCpt')
+    npis = store.column('providerNpi')
+    groups = group_prices([cpt_codes, npis], store.column('negotiatedRate'), positive_only=False)
+    group_cpts = cpt_codes[groups['rows']]
+    group_npis = npis[groups['rows']]
+    cpt_values = store.dictionaries['procedureCpt'].values
+    stage.records = loaded
+
+print(f"✅ Grouped {loaded:,} records (Unresolved refs at extraction: {extract_meta.get('unresolvedRefs', 0):,})")
+print(f"   CPTs processed: {len(np.unique(group_cpts))}")
+
+# Freed by refcounting as soon as they're deleted; the group arrays and
+# dictionaries kept for PHASE 2 are frozen out of the collector's scans
+del store, cpt_codes, npis
+freeze_long_lived()
 
 # ============================================
-# PHASE 4: Calculate Statistics & Filter
+# PHASE 2: Calculate Statistics & Filter
 # ============================================
 
 print("\n" + "="*60)
-print("📊 PHASE 4: Calculating Statistics...")
+print("📊 PHASE 2: Calculating Statistics...")
 print("="*60)
 
 final_output = []
-
-for cpt, providers in cpt_npi_rates.items():
-    
-    # Calculate variance for ranking
-    # We want providers with meaningful pricing data
-    provider_stats = []
+aggregated_at = datetime.now().strftime("%Y-%m-%d")
+
+# Scoring for selection:
+# Prioritize providers with variation (more interesting) or volume.
+# Scores are computed for every provider at once on the stat arrays, the top
+# N per CPT are picked with argpartition, and output records are built only
+# for those survivors (best first, same order as sorting the full list).
+with profiler.stage('PHASE 2: Statistics') as stage:
+    scores = PROVIDER_SCORE(groups)
+    selected = select_top(group_cpts, scores, PROVIDER_LIMIT_PER_CPT)
     
-    for npi, rates in providers.items():
-        if not rates: continue
-        
-        min_price = min(rates)
-        max_price = max(rates)
-        
-        stat = {
-            "procedureCpt": cpt,
-            "providerNpi": npi,
-            "planSlug": "uhc-choice-plus-ny",
-            "priceStats": {
-                "min": round(min_price, 2),
-                "max": round(max_price, 2),
-                "median": round(median(rates), 2),
-                "mean": round(mean(rates), 2),
-                "count": len(rates)
-            },
-            "aggregatedAt": datetime.now().strftime("%Y-%m-%d"),
-            "dataSource": "uhc-mrf-blueprint"
-        }
-        
-        # Scoring for selection:
-        # Prioritize providers with variation (more interesting) or volume
-        variance = max_price - min_price
-        score = variance + (len(rates) * 1) 
-        
-        provider_stats.append((score, stat))
-    
-    # Sort by score and keep top N
-    provider_stats.sort(key=lambda x: x[0], reverse=True)
-    top_providers = [x[1] for x in provider_stats[:PROVIDER_LIMIT_PER_CPT]]
-    
-    final_output.extend(top_providers)
-    print(f"  CPT {cpt}: Kept {len(top_providers)} providers (from {len(providers)} total)")
+    kept = np.concatenate([positions for _, positions, _ in selected]) if selected else np.empty(0, dtype=np.int64)
+    kept_stats = iter_price_stats(take_groups(groups, kept))
+    for cpt_code, positions, total in selected:
+        cpt = cpt_values[cpt_code]
+        for position, (row, price_stats) in zip(positions.tolist(), kept_stats):
+            final_output.append({
+                "procedureCpt": cpt,
+                "providerNpi": str(group_npis[position]),
+                "planSlug": "uhc-choice-plus-ny",
+                "priceStats": price_stats,
+                "aggregatedAt": aggregated_at,
+                "dataSource": "uhc-mrf-blueprint"
+            })
+        print(f"  CPT {cpt}: Kept {len(positions)} providers (from {total} total)")
+    stage.records = len(scores)
 
 # ============================================
-# PHASE 5: Save
+# PHASE 3: Save
 # ============================================
 
 print("\n" + "="*60)
-print("💾 PHASE 5: Saving Aggregated Data...")
+print("💾 PHASE 3: Saving Aggregated Data...")
 print("="*60)
 
-with open(OUTPUT_FILE, 'w') as f:
-    json.dump(final_output, f, separators=(',', ':'))
+with profiler.stage('PHASE 3: Save') as stage:
+    with open(OUTPUT_FILE, 'w') as f:
+        json.dump(final_output, f, separators=(',', ':'))
+    stage.records = len(final_output)
 
 file_size_mb = os.path.getsize(OUTPUT_FILE) / (1024 * 1024)
 
@@ -210,5 +142,12 @@ print(f"""
 Output: {OUTPUT_FILE}
 Size:   {file_size_mb:.2f} MB
 Records: {len(final_output):,}
-CPTs:    {len(cpt_npi_rates)}
+CPTs:    {len(selected)}
 """)
+
+profiler.save()
+profiler.close()
+restore_gc()
+print(f"\n⏱️  Run report → {RUN_REPORT}")
+for line in profiler.summary_lines():
+    print(f"   {line}")
@@ -1,15 +1,12 @@
 # ============================================
-# MEMORY-EFFICIENT AGGREGATION (Chunked)
+# MEMORY-EFFICIENT AGGREGATION (Single Pass)
 # Filtered to 75 High-Value CPT Codes
 # ============================================
 
 from google.colab import drive
 import os
 import json
-from collections import defaultdict
-from statistics import median
-from datetime import datetime
-import gc
+import sys
 
 # ============================================
 # CONFIGURATION: 75 Curated High-Value CPTs
@@ -47,125 +44,99 @@ print(f"🎯 Targeting {len(TARGET_CPTS)} high-value CPT codes")
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_aggregate import StreamingAggregator
+from mrf_memory import configure_gc, freeze_long_lived, restore_gc
+from mrf_profile import RunProfiler
+from mrf_sketch import sketch_metadata
+from mrf_split import iter_rate_lines, probe_rate
+
 input_dir = '/content/drive/MyDrive/health-insurance-data/raw-extracts'
 output_dir = '/content/drive/MyDrive/health-insurance-data/aggregated'
 os.makedirs(output_dir, exist_ok=True)
 
 INPUT_FILE = f"{input_dir}/negotiated_rates.json"
 OUTPUT_FILE = f"{output_dir}/aggregated_rates_75.json"  # Renamed for 75 CPTs
-TEMP_DIR = f"{output_dir}/temp_chunks"
-os.makedirs(TEMP_DIR, exist_ok=True)
+SPILL_DIR = f"{output_dir}/temp_chunks"   # Only used if the buffer outgrows MAX_MEMORY_MB
+MAX_MEMORY_MB = 1024                      # Buffered rates (16 bytes each) before spilling
+STATS_MODE = 'exact'                      # 'sketch': approximate median + p10/p25/p75/p90, bounded memory
+META_FILE = OUTPUT_FILE.replace('.json', '.meta.json')  # Error bound, written in sketch mode
+RUN_REPORT = OUTPUT_FILE.replace('.json', '.run_report.json')  # Per-step time, throughput, memory, GC
+PROFILE_SAMPLE = None                     # 'cprofile' or 'stack': per-step profiles next to RUN_REPORT
+GC_MODE = 'managed'                       # Fewer collections, long-lived data frozen (mrf_memory.py); 'default' to compare
+
+profiler = RunProfiler('aggregation_75', RUN_REPORT, sample=PROFILE_SAMPLE)
+configure_gc(GC_MODE)
 
 # ============================================
-# PASS 1: Chunk by CPT code (FILTERED)
+# SINGLE PASS: Stream & accumulate (FILTERED)
 # ============================================
+# Every target-CPT rate goes straight into a compact in-memory buffer
+# (CPT code, NPI/plan key code, price) instead of a temp JSONL file that is
+# written, read back and deleted. Lines are routed on bytes probed from the
+# raw line (see mrf_split.py); only kept lines have their rate read.
 
-print("🚀 PASS 1: Splitting by CPT code (filtered to target CPTs)...")
+print("🚀 SINGLE PASS: Streaming rates (filtered to target CPTs)...")
 
-cpt_files = {}
-record_count = 0
+aggregator = StreamingAggregator(SPILL_DIR, max_memory_bytes=MAX_MEMORY_MB * 1024 * 1024,
+                                 stats_mode=STATS_MODE)
+line_stats = {}
 kept_count = 0
 skipped_count = 0
 
-with open(INPUT_FILE, 'r') as f:
-    f.readline()  # Skip [
-    
-    for line in f:
-        line = line.strip().rstrip(',')
-        if not line or line == ']':
-            continue
-        
-        try:
-            record = json.loads(line)
-            cpt = record['procedureCpt']
-            record_count += 1
-            
-            # ⚡ KEY FILTER: Only process target CPTs
-            if cpt not in TARGET_CPTS:
-                skipped_count += 1
-                if record_count % 500000 == 0:
-                    print(f"  ...{record_count:,} scanned, {kept_count:,} kept, {skipped_count:,} skipped")
-                continue
-            
+with profiler.stage('Single pass: Stream') as stage:
+    for cpt, npi, plan, line in iter_rate_lines(INPUT_FILE, line_stats):
+        # ⚡ KEY FILTER: Only process target CPTs
+        if cpt not in TARGET_CPTS:
+            skipped_count += 1
+        else:
             kept_count += 1
-            
-            # Write to CPT-specific temp file
-            if cpt not in cpt_files:
-                cpt_files[cpt] = open(f"{TEMP_DIR}/{cpt}.jsonl", 'w')
+            if cpt not in aggregator.cpt_codes:
                 print(f"  📁 Found target CPT: {cpt}")
-            
-            cpt_files[cpt].write(line + '\n')
-            
-            if record_count % 500000 == 0:
-                print(f"  ...{record_count:,} scanned, {kept_count:,} kept, {skipped_count:,} skipped")
-                gc.collect()
-                
-        except:
-            continue
-
-# Close all temp files
-for f in cpt_files.values():
-    f.close()
-
-print(f"\n✅ PASS 1 Complete!")
+            aggregator.add(cpt, npi, plan, probe_rate(line))
+        
+        if line_stats['records'] % 500000 == 0:
+            print(f"  ...{line_stats['records']:,} scanned, {kept_count:,} kept, {skipped_count:,} skipped "
+                  f"({stage.progress(line_stats['records'])})")
+    stage.records = line_stats['records']
+    stage.decompressed_bytes = line_stats['offset']
+
+record_count = line_stats['records']
+found_cpts = set(aggregator.cpt_codes)
+agg_stats = aggregator.stats()
+
+print(f"\n✅ SINGLE PASS Complete!")
 print(f"   Scanned:  {record_count:,} total records")
-print(f"   Kept:     {kept_count:,} records ({len(cpt_files)} CPTs found)")
+print(f"   Kept:     {kept_count:,} records ({len(found_cpts)} CPTs found)")
 print(f"   Skipped:  {skipped_count:,} records (non-target CPTs)")
-print(f"   Missing:  {len(TARGET_CPTS) - len(cpt_files)} CPTs not found in data")
+print(f"   Dropped:  {line_stats['errors'] + line_stats['missingKeys']:,} unreadable or keyless lines")
+print(f"   Missing:  {len(TARGET_CPTS) - len(found_cpts)} CPTs not found in data")
+print(f"   Buffer:   {agg_stats['peakBufferBytes'] / (1024 * 1024):.1f} MB peak, "
+      f"{agg_stats['spills']} spills ({agg_stats['spilledRows']:,} rows), "
+      f"{agg_stats['sketchFolds']} sketch folds")
 
 # Show which target CPTs were found
-found_cpts = set(cpt_files.keys())
 missing_cpts = TARGET_CPTS - found_cpts
 if missing_cpts:
     print(f"\n⚠️  Missing CPTs: {sorted(missing_cpts)}")
 
 # ============================================
-# PASS 2: Aggregate each CPT file separately
+# AGGREGATE: Stats per CPT (exact, or sketched)
 # ============================================
 
-print("\n🚀 PASS 2: Aggregating each CPT...")
+print(f"\n🚀 Aggregating each CPT ({STATS_MODE} stats)...")
 
 all_aggregated = []
 
-for cpt in sorted(cpt_files.keys()):
-    temp_file = f"{TEMP_DIR}/{cpt}.jsonl"
-    
-    # Aggregate this CPT
-    aggregated = defaultdict(list)
-    
-    with open(temp_file, 'r') as f:
-        for line in f:
-            record = json.loads(line.strip())
-            key = (record['providerNpi'], record['planSlug'])
-            price = record.get('negotiatedRate', 0)
-            if price > 0:
-                aggregated[key].append(price)
-    
-    # Build output for this CPT
-    cpt_record_count = 0
-    for (npi, plan), prices in aggregated.items():
-        sorted_prices = sorted(prices)
-        all_aggregated.append({
-            "procedureCpt": cpt,
-            "providerNpi": npi,
-            "planSlug": plan,
-            "priceStats": {
-                "min": round(sorted_prices[0], 2),
-                "max": round(sorted_prices[-1], 2),
-                "median": round(median(sorted_prices), 2),
-                "mean": round(sum(sorted_prices) / len(sorted_prices), 2),
-                "count": len(sorted_prices)
-            },
-            "aggregatedAt": datetime.now().strftime("%Y-%m-%d"),
-            "dataSource": "cms-mrf-uhc-ny"
-        })
-        cpt_record_count += 1
-    
-    print(f"  CPT {cpt}: {cpt_record_count:,} provider-plan combinations")
-    
-    # Clean up temp file
-    os.remove(temp_file)
-    gc.collect()
+with profiler.stage('Aggregate') as stage:
+    for cpt, cpt_records in aggregator.results("cms-mrf-uhc-ny"):
+        all_aggregated.extend(cpt_records)
+        print(f"  CPT {cpt}: {len(cpt_records):,} provider-plan combinations")
+        # Kept until the save: out of the collector's way from now on
+        freeze_long_lived()
+    stage.records = kept_count
 
 # ============================================
 # SAVE FINAL OUTPUT
@@ -173,8 +144,15 @@ for cpt in sorted(cpt_files.keys()):
 
 print(f"\n💾 Saving {len(all_aggregated):,} aggregated records...")
 
-with open(OUTPUT_FILE, 'w') as f:
-    json.dump(all_aggregated, f, separators=(',', ':'))  # Compact JSON
+with profiler.stage('Save') as stage:
+    with open(OUTPUT_FILE, 'w') as f:
+        json.dump(all_aggregated, f, separators=(',', ':'))  # Compact JSON
+    stage.records = len(all_aggregated)
+
+if STATS_MODE == 'sketch':
+    with open(META_FILE, 'w') as f:
+        json.dump(sketch_metadata(aggregator.sketch_k), f, indent=2)
+    print(f"📝 Sketch error bound → {META_FILE}")
 
 file_size_mb = os.path.getsize(OUTPUT_FILE) / (1024 * 1024)
 
@@ -182,14 +160,14 @@ print(f"\n{'='*50}")
 print(f"✅ AGGREGATION COMPLETE!")
 print(f"{'='*50}")
 print(f"Target CPTs:    {len(TARGET_CPTS)}")
-print(f"CPTs Found:     {len(cpt_files)}")
+print(f"CPTs Found:     {len(found_cpts)}")
 print(f"Total Records:  {len(all_aggregated):,}")
 print(f"File Size:      {file_size_mb:.2f} MB")
 print(f"Output:         {OUTPUT_FILE}")
 
-# Cleanup temp directory
+# Cleanup spill directory (only created if the buffer spilled)
 try:
-    os.rmdir(TEMP_DIR)
+    os.rmdir(SPILL_DIR)
 except:
     pass
 
@@ -204,3 +182,10 @@ for cpt, count in sorted(cpt_counts.items(), key=lambda x: -x[1])[:20]:
     print(f"   {cpt}: {count:,}")
 if len(cpt_counts) > 20:
     print(f"   ... and {len(cpt_counts) - 20} more")
+
+profiler.save()
+profiler.close()
+restore_gc()
+print(f"\n⏱️  Run report → {RUN_REPORT}")
+for line in profiler.summary_lines():
+    print(f"   {line}")
@@ -4,12 +4,18 @@
 # ============================================
 
 from google.colab import drive
-import json
 import os
+import sys
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_probe import probe_files, probe_metadata
+
 FILE_PATH = '/content/drive/MyDrive/health-insurance-data/raw-extracts/negotiated_rates.json'
+SCAN_DIR = '/content/drive/MyDrive/health-insurance-data/mrf-downloads'   # Every MRF here is probed too
 
 print(f"📂 File: {FILE_PATH}")
 print(f"📊 Size: {os.path.getsize(FILE_PATH) / (1024**3):.2f} GB")
@@ -17,58 +23,45 @@ print("\n" + "="*60)
 print("🔍 Reading file header to identify source...")
 print("="*60 + "\n")
 
-# Method 1: Read first few KB to get metadata
-with open(FILE_PATH, 'r') as f:
-    # Read first 10KB - should contain all header metadata
-    header = f.read(10000)
-    
-print("📋 RAW HEADER (first 10KB):")
-print("-" * 40)
-print(header[:5000])  # Print first 5KB for readability
-print("-" * 40)
+# The header is parsed as a stream and the read stops at the first bulk
+# section (in_network / provider_references), so this reads a few KB of the
+# file however large it is — even when the whole file is one line of JSON.
+meta = probe_metadata(FILE_PATH)
 
-# Method 2: Try to parse as JSON and extract top-level keys
-print("\n\n🔑 Attempting to extract metadata fields...")
+print("🔑 Metadata fields:")
 print("-" * 40)
+for label, field in (("Reporting Entity", 'reportingEntityName'), ("Entity Type", 'reportingEntityType'),
+                     ("Plan Name", 'planName'), ("Plan ID", 'planId'), ("Plan ID Type", 'planIdType'),
+                     ("Market Type", 'planMarketType'), ("Last Updated", 'lastUpdatedOn'),
+                     ("Version", 'version')):
+    if meta[field] is not None:
+        print(f"✅ {label}: {meta[field]}")
+for key, value in meta['otherFields'].items():
+    print(f"   {key}: {value}")
+print(f"\n📄 File kind: {meta['kind'] or 'unknown'} (first section: {meta['firstSection']}, "
+      f"{meta['bytesRead'] / 1024:.0f} KB read)")
+if not meta['complete']:
+    print("⚠️ No MRF section key found in the probed bytes — not an MRF object, or an unusual header")
+
+# ============================================
+# PROBE EVERY DOWNLOADED MRF
+# ============================================
 
-try:
-    with open(FILE_PATH, 'r') as f:
-        # Read incrementally to find metadata
-        content = ""
-        for i, line in enumerate(f):
-            content += line
-            if i > 50:  # First 50 lines should have metadata
-                break
-        
-        # Try to find key fields
-        import re
-        
-        # Look for reporting_entity_name
-        match = re.search(r'"reporting_entity_name"\s*:\s*"([^"]+)"', content)
-        if match:
-            print(f"✅ Reporting Entity: {match.group(1)}")
-        
-        # Look for last_updated_on
-        match = re.search(r'"last_updated_on"\s*:\s*"([^"]+)"', content)
-        if match:
-            print(f"✅ Last Updated: {match.group(1)}")
-        
-        # Look for version
-        match = re.search(r'"version"\s*:\s*"([^"]+)"', content)
-        if match:
-            print(f"✅ Version: {match.group(1)}")
-            
-        # Look for plan info
-        match = re.search(r'"plan_name"\s*:\s*"([^"]+)"', content)
-        if match:
-            print(f"✅ Plan Name: {match.group(1)}")
-            
-        match = re.search(r'"plan_id"\s*:\s*"([^"]+)"', content)
-        if match:
-            print(f"✅ Plan ID: {match.group(1)}")
+mrf_paths = sorted(
+    os.path.join(SCAN_DIR, name) for name in os.listdir(SCAN_DIR)
+    if name.endswith(('.json', '.json.gz'))
+) if os.path.isdir(SCAN_DIR) else []
 
-except Exception as e:
-    print(f"⚠️ Error parsing: {e}")
+if mrf_paths:
+    print(f"\n\n🔍 Probing {len(mrf_paths)} files in {SCAN_DIR}...")
+    print("-" * 40)
+    for result in probe_files(mrf_paths):
+        name = os.path.basename(result['source'])
+        if 'error' in result:
+            print(f"❌ {name}: {result['error']}")
+        else:
+            print(f"✅ {name}: {result['reportingEntityName']} | {result['planName'] or '-'} "
+                  f"| {result['kind'] or 'unknown'} | updated {result['lastUpdatedOn'] or '?'}")
 
 print("\n" + "="*60)
 print("💡 Compare the 'Reporting Entity' and 'Plan Name' above")
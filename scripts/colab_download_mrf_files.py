@@ -4,14 +4,18 @@
 # ============================================
 
 from google.colab import drive
-import requests
-import gzip
 import os
-import shutil
+import sys
+import threading
 from datetime import datetime
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_download import download_files
+
 # ============================================
 # CONFIGURATION
 # ============================================
@@ -52,50 +56,17 @@ FILES_TO_DOWNLOAD = [
 # },
 
 # ============================================
-# DOWNLOAD FUNCTION
+# PARALLEL DOWNLOAD
 # ============================================
+# mrf_download.py fetches up to MAX_FILES files at once, each in parallel
+# 64 MB HTTP Range segments written in place into <name>.part. Segment
+# progress is saved next to it (<name>.part.json), so rerunning this cell
+# after a disconnect resumes every file where it stopped. A file only gets
+# its final name once its size and the server's Content-MD5 check out; one
+# that fails them is deleted and downloaded again on the next run.
 
-def download_mrf_file(url, output_name, description):
-    """Download a MRF file with progress tracking"""
-    output_path = os.path.join(OUTPUT_DIR, output_name)
-    
-    print(f"\n{'='*60}")
-    print(f"📥 Downloading: {description}")
-    print(f"   URL: {url[:80]}...")
-    print(f"   Saving as: {output_name}")
-    print(f"{'='*60}")
-    
-    try:
-        # Stream download with progress
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192 * 100):  # 800KB chunks
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    
-                    if total_size > 0:
-                        pct = (downloaded / total_size) * 100
-                        mb_done = downloaded / (1024 * 1024)
-                        mb_total = total_size / (1024 * 1024)
-                        print(f"\r   Progress: {pct:.1f}% ({mb_done:.1f} / {mb_total:.1f} MB)", end='')
-        
-        file_size = os.path.getsize(output_path) / (1024 * 1024)
-        print(f"\n   ✅ Downloaded: {file_size:.1f} MB (compressed)")
-        return True
-        
-    except requests.exceptions.RequestException as e:
-        print(f"   ❌ Failed: {e}")
-        return False
-
-# ============================================
-# MAIN DOWNLOAD LOOP
-# ============================================
+MAX_FILES = 4        # Files downloaded at once
+MAX_SEGMENTS = 8     # Range requests per file at once
 
 print(f"""
 {'='*60}
@@ -106,18 +77,40 @@ print(f"""
 ⏰ Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 ⚠️  NOTE: These files are LARGE (often 1-10 GB compressed)
-    Full download may take 30-60 minutes depending on connection
+    Downloads run in parallel; an interrupted run resumes on rerun
 {'='*60}
 """)
 
+for file_info in FILES_TO_DOWNLOAD:
+    print(f"📥 {file_info['name']}: {file_info['description']}")
+
+progress_lock = threading.Lock()
+received = {'bytes': 0, 'printed': 0}
+
+def report_progress(name, nbytes):
+    with progress_lock:
+        received['bytes'] += nbytes
+        if received['bytes'] - received['printed'] >= 256 * 1024 * 1024:
+            received['printed'] = received['bytes']
+            print(f"   ...{received['bytes'] / (1024 * 1024):,.0f} MB received")
+
+results = download_files([(f['url'], f['name']) for f in FILES_TO_DOWNLOAD], OUTPUT_DIR,
+                         max_files=MAX_FILES, max_segments=MAX_SEGMENTS, progress=report_progress)
+
 successful = 0
 failed = 0
-
-for file_info in FILES_TO_DOWNLOAD:
-    if download_mrf_file(file_info['url'], file_info['name'], file_info['description']):
+for result in results:
+    if 'error' in result:
+        failed += 1
+        print(f"   ❌ {result['name']}: {result['error']}"
+              f"{' (partial download kept for resume)' if result['partialKept'] else ''}")
+    elif result.get('skipped'):
         successful += 1
+        print(f"   ✓ {result['name']}: already downloaded")
     else:
-        failed += 1
+        successful += 1
+        print(f"   ✅ {result['name']}: {result['bytes'] / (1024 * 1024):.1f} MB in {result['seconds']:.0f}s "
+              f"({result['MBps']} MB/s, checked {', '.join(result['checked'])})")
 
 # ============================================
 # SUMMARY
@@ -145,11 +138,11 @@ print(f"""
 {'='*60}
 📝 NEXT STEPS:
 {'='*60}
-1. Run the extraction script on each downloaded file
+1. Run colab_parallel_extract.py (one worker process per file)
 2. Filter for your 75 target CPT codes
-3. Aggregate the results
+3. Aggregate the results (shards are merged automatically)
 
 Note: Each .gz file may expand to 10-50 GB when parsed!
-Consider processing one at a time to manage memory.
+Extraction streams each file, so memory per worker stays bounded.
 {'='*60}
 """)
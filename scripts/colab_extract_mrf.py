@@ -6,20 +6,26 @@
 # Filters to target CPT codes for efficiency
 # ============================================
 
-!pip install ijson
+!pip install ijson pyarrow
 
 from google.colab import drive
 import ijson
-import gzip
-import json
 import os
-from collections import defaultdict
+import sys
 from datetime import datetime
-from statistics import median
-import gc
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_columnar import ColumnarRateWriter
+from mrf_memory import configure_gc, freeze_long_lived, restore_gc
+from mrf_probe import probe_metadata
+from mrf_profile import RunProfiler
+from mrf_refs import RefIndexCache
+from mrf_stream import checkpoint_state, extract_resolved_batches, new_stats
+
 # ============================================
 # CONFIGURATION
 # ============================================
@@ -27,6 +33,17 @@ drive.mount('/content/drive')
 BASE_DIR = '/content/drive/MyDrive/health-insurance-data'
 INPUT_FILE = f"{BASE_DIR}/mrf-downloads/uhc-ny-choice-plus-medical.json.gz"
 OUTPUT_DIR = f"{BASE_DIR}/extracted"
+OUTPUT_DATASET = f"{OUTPUT_DIR}/extracted_rates_raw"   # Columnar dataset directory
+BATCH_ROWS = 500_000                                    # Rows buffered per flushed batch
+REFS_CACHE_DIR = f"{BASE_DIR}/cache/provider-refs"      # Parsed provider_references per MRF
+RESUME = True                                           # Continue from the dataset's last checkpoint, if any
+# Payer URL of the MRF: when set and INPUT_FILE isn't on Drive yet, the file is
+# parsed while it downloads and the compressed bytes are saved to INPUT_FILE
+INPUT_URL = None
+SOURCE = INPUT_URL if INPUT_URL and not os.path.exists(INPUT_FILE) else INPUT_FILE
+RUN_REPORT = f"{OUTPUT_DIR}/extract_run_report.json"      # Per-phase time, throughput, memory, GC
+PROFILE_SAMPLE = None                                   # 'cprofile' or 'stack': per-phase profiles next to RUN_REPORT
+GC_MODE = 'managed'                                     # Fewer collections, long-lived data frozen (mrf_memory.py)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # 75 Curated High-Value CPT Codes
@@ -57,10 +74,23 @@ TARGET_CPTS = {
 # Set to None to extract ALL CPTs (for discovery)
 # TARGET_CPTS = None
 
+# 'events' skips non-target in_network items without building their
+# negotiated_rates; 'items' builds every item (see mrf_bench.py)
+EXTRACT_MODE = 'events'
+
+# 'thread' inflates gzip on a second core while ijson parses on the first;
+# 'external' pipes through pigz/gzip; 'inline' is plain gzip.open
+DECOMPRESS_MODE = 'thread'
+
 print(f"🎯 Target CPTs: {len(TARGET_CPTS) if TARGET_CPTS else 'ALL'}")
-print(f"📂 Input: {INPUT_FILE}")
+print(f"📂 Input: {SOURCE}")
+if SOURCE != INPUT_FILE:
+    print(f"   Streaming while downloading, archive copy → {INPUT_FILE}")
 print(f"📂 Output: {OUTPUT_DIR}")
 
+profiler = RunProfiler('extract_mrf', RUN_REPORT, sample=PROFILE_SAMPLE)
+configure_gc(GC_MODE)
+
 # ============================================
 # PHASE 1: Explore file structure
 # ============================================
@@ -69,126 +99,116 @@ print("\n" + "="*60)
 print("🔍 PHASE 1: Exploring MRF file structure...")
 print("="*60)
 
-# Read first 50KB to understand structure
-with gzip.open(INPUT_FILE, 'rt', encoding='utf-8') as f:
-    sample = f.read(50000)
-    print("\n📋 First 2000 characters:")
-    print("-" * 40)
-    print(sample[:2000])
-    print("-" * 40)
+# Header fields only: the parse stops at the first in_network /
+# provider_references key, so this reads a few KB whatever the file size
+with profiler.stage('PHASE 1: Explore') as stage:
+    header = probe_metadata(SOURCE)
+    stage.decompressed_bytes = header['bytesRead']
+print(f"\n📋 {header['reportingEntityName']} ({header['reportingEntityType']})")
+print(f"   Plan: {header['planName'] or '-'} {header['planId'] or ''}")
+print(f"   Last updated: {header['lastUpdatedOn']}, schema version {header['version']}")
+print(f"   Kind: {header['kind']}, first section: {header['firstSection']}")
+if header['firstSection'] == 'in_network':
+    print("   ℹ️  in_network comes first: rates are buffered until provider_references arrive")
 
 # ============================================
-# PHASE 2: Extract provider references
+# PHASE 2: Single-pass extraction
 # ============================================
+# provider_references and in_network are parsed from ONE read of the gzip.
+# Whichever section arrives first is buffered (or spilled to disk) so every
+# rate is emitted already resolved to its NPI/TIN.
 
 print("\n" + "="*60)
-print("🔍 PHASE 2: Building provider reference map...")
+print("🔍 PHASE 2: Extracting & resolving negotiated rates (single pass)...")
 print("="*60)
 
-provider_map = {}
-provider_count = 0
-
-with gzip.open(INPUT_FILE, 'rb') as f:
+# Rows are interned into a compact RateStore (~36 bytes/rate instead of a
+# few hundred for a dict) and stream to disk in bounded batches (Parquet, or
+# .npy per column without pyarrow), so memory stays flat however many rates
+#
+# Every flushed batch is also a checkpoint (_checkpoint.json in the dataset:
+# parts written, in_network items done, counters). After a disconnect, the
+# rerun keeps those parts and fast-forwards past the finished items without
+# building them, and the finished dataset is identical to an uninterrupted run.
+writer = ColumnarRateWriter(OUTPUT_DATASET, batch_rows=BATCH_ROWS, metadata={'sourceFile': INPUT_FILE},
+                            resume=RESUME)
+extract_stats = new_stats()
+if writer.resume_state:
+    print(f"  ♻️  Resuming after {writer.resume_state['netItems']:,} in_network items "
+          f"({writer.rows:,} records in {writer.batches} batches already saved)")
+
+# provider_references of an unchanged MRF are loaded from the cache (and
+# skipped in the stream) instead of being parsed again
+refs_cache = RefIndexCache(REFS_CACHE_DIR)
+
+next_progress = 1000000
+refs_frozen = False
+parse_error = None
+
+with profiler.stage('PHASE 2: Extract') as stage:
     try:
-        # Try to find provider_references array
-        parser = ijson.items(f, 'provider_references.item')
-        for provider in parser:
-            provider_count += 1
-            # Store NPI to provider info mapping
-            provider_groups = provider.get('provider_groups', [])
-            for group in provider_groups:
-                npis = group.get('npi', [])
-                for npi in npis:
-                    provider_map[str(npi)] = {
-                        'tin': group.get('tin', {}).get('value', ''),
-                        'tin_type': group.get('tin', {}).get('type', '')
-                    }
-            
-            if provider_count % 10000 == 0:
-                print(f"  ...processed {provider_count:,} provider references")
-                
-    except ijson.JSONError as e:
-        print(f"  ⚠️ Provider references not found or different format: {e}")
-
-print(f"✅ Found {len(provider_map):,} unique NPIs from {provider_count:,} provider references")
+        # Each batch is already fanned out to NPIs and dictionary-encoded
+        for batch in extract_resolved_batches(SOURCE, TARGET_CPTS, stats=extract_stats, mode=EXTRACT_MODE,
+                                              decompress=DECOMPRESS_MODE, refs_cache=refs_cache,
+                                              resume=writer.resume_state,
+                                              tee_path=INPUT_FILE if SOURCE != INPUT_FILE else None):
+            if not refs_frozen:
+                # Batches only start once provider_references are fully read:
+                # freeze the reference index out of the collector's scans
+                freeze_long_lived()
+                refs_frozen = True
+            flushed = writer.batches
+            writer.write_batch(batch)
+            if writer.batches > flushed and checkpoint_state(extract_stats):
+                writer.checkpoint(checkpoint_state(extract_stats))
+
+            if extract_stats['rateRecords'] >= next_progress:
+                next_progress += 1000000
+                print(f"  ...scanned {extract_stats['codesScanned']:,} codes, kept {extract_stats['targetCodesFound']:,}, extracted {extract_stats['rateRecords']:,} rate records ({writer.batches} batches flushed; {stage.progress(extract_stats['rateRecords'])})")
 
-gc.collect()
-
-# ============================================
-# PHASE 3: Extract negotiated rates
-# ============================================
-
-print("\n" + "="*60)
-print("🔍 PHASE 3: Extracting negotiated rates...")
-print("="*60)
-
-extracted_records = []
-cpt_stats = defaultdict(int)
-total_rates = 0
-kept_rates = 0
-
-with gzip.open(INPUT_FILE, 'rb') as f:
-    try:
-        # Parse in_network array
-        parser = ijson.items(f, 'in_network.item')
-        
-        for item in parser:
-            billing_code = str(item.get('billing_code', ''))
-            billing_code_type = item.get('billing_code_type', '')
-            
-            # Only process CPT/HCPCS codes
-            if billing_code_type not in ['CPT', 'HCPCS']:
-                continue
-            
-            total_rates += 1
-            
-            # Filter to target CPTs if specified
-            if TARGET_CPTS and billing_code not in TARGET_CPTS:
-                continue
-            
-            kept_rates += 1
-            cpt_stats[billing_code] += 1
-            
-            # Extract negotiated prices
-            negotiated_rates = item.get('negotiated_rates', [])
-            
-            for rate_obj in negotiated_rates:
-                provider_refs = rate_obj.get('provider_references', [])
-                prices = rate_obj.get('negotiated_prices', [])
-                
-                for price_obj in prices:
-                    negotiated_rate = price_obj.get('negotiated_rate', 0)
-                    billing_class = price_obj.get('billing_class', 'unknown')
-                    service_codes = price_obj.get('service_code', [])
-                    
-                    # Create record for each provider reference
-                    for provider_ref in provider_refs:
-                        extracted_records.append({
-                            'procedureCpt': billing_code,
-                            'providerRef': provider_ref,  # Reference ID, will resolve later
-                            'negotiatedRate': float(negotiated_rate),
-                            'billingClass': billing_class,
-                            'serviceCodes': service_codes,
-                        })
-            
-            if total_rates % 1000 == 0:
-                print(f"  ...scanned {total_rates:,} codes, kept {kept_rates:,}, extracted {len(extracted_records):,} rate records")
-                
-                # Memory management
-                if len(extracted_records) > 5000000:
-                    print("  ⚠️ Memory limit approaching, saving checkpoint...")
-                    break
-                    
     except ijson.JSONError as e:
         print(f"  ❌ JSON parsing error: {e}")
-
+        parse_error = e
+    stage.records = extract_stats['rateRecords']
+    stage.io(extract_stats.get('io'))
+
+if parse_error is not None:
+    # Don't finalize a truncated dataset: stop before writer.close() so
+    # _checkpoint.json survives and a rerun (RESUME = True) picks up after the
+    # last saved batch
+    print(f"  💾 Not finalized: {writer.batches} saved batches kept for a resumed rerun")
+    profiler.save()
+    profiler.close()
+    restore_gc()
+    raise parse_error
+
+cpt_stats = extract_stats['cptCounts']
+total_rates = extract_stats['codesScanned']
+kept_rates = extract_stats['targetCodesFound']
+
+print(f"✅ Parsed with ijson backend: {extract_stats['ijsonBackend']} ({EXTRACT_MODE} mode)")
+print(f"   Resolved against {extract_stats['providerReferences']:,} provider references"
+      f"{' (from cache)' if extract_stats['refsCached'] else ''}")
+print(f"   Unresolved references: {extract_stats['unresolvedRefs']:,}")
+print(f"   Bad NPIs skipped: {extract_stats['badNpis']:,}")
+print(f"   Rows buffered until refs arrived: {extract_stats['spilledRows']:,}")
+
+# Per-stage throughput: the stage that waits least is the bottleneck
+io_stats = extract_stats.get('io')
+if io_stats:
+    print(f"\n⏱️  Stages ({io_stats['decompressMode']}):")
+    if 'downloadMBps' in io_stats:
+        print(f"   Download:   {io_stats['downloadMBps']:.1f} MB/s compressed, overlapped with parsing")
+    if 'decompressMBps' in io_stats:
+        print(f"   Decompress: {io_stats['decompressMBps']:.1f} MB/s busy, waited {io_stats['decompressorWaitSeconds']:.1f}s on a full queue")
+    print(f"   Parse:      {io_stats['parseMBps']:.1f} MB/s busy, waited {io_stats['parserWaitSeconds']:.1f}s for input")
 print(f"\n✅ Extraction complete!")
 print(f"   Total codes scanned: {total_rates:,}")
 print(f"   Target codes found: {kept_rates:,}")
-print(f"   Rate records extracted: {len(extracted_records):,}")
+print(f"   Rate records extracted: {extract_stats['rateRecords']:,}")
 
 # ============================================
-# PHASE 4: Summary by CPT
+# PHASE 3: Summary by CPT
 # ============================================
 
 print("\n" + "="*60)
@@ -203,31 +223,41 @@ if len(cpt_stats) > 30:
     print(f"  ... and {len(cpt_stats) - 30} more")
 
 # ============================================
-# PHASE 5: Save extracted data
+# PHASE 4: Finalize extracted data
 # ============================================
 
 print("\n" + "="*60)
-print("💾 PHASE 5: Saving extracted data...")
+print("💾 PHASE 4: Finalizing extracted data...")
 print("="*60)
 
-output_file = f"{OUTPUT_DIR}/extracted_rates_raw.json"
-
-with open(output_file, 'w') as f:
-    json.dump({
-        'metadata': {
-            'sourceFile': INPUT_FILE,
-            'extractedAt': datetime.now().isoformat(),
-            'totalCodesScanned': total_rates,
-            'targetCodesFound': kept_rates,
-            'recordsExtracted': len(extracted_records),
-            'uniqueCpts': list(cpt_stats.keys()),
-        },
-        'records': extracted_records
-    }, f, separators=(',', ':'))
-
-file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
-print(f"✅ Saved to: {output_file}")
-print(f"   File size: {file_size_mb:.1f} MB")
+writer.metadata.update({
+    'sourceFile': INPUT_FILE,
+    'extractedAt': datetime.now().isoformat(),
+    'totalCodesScanned': total_rates,
+    'targetCodesFound': kept_rates,
+    'recordsExtracted': extract_stats['rateRecords'],
+    'providerReferences': extract_stats['providerReferences'],
+    'unresolvedRefs': extract_stats['unresolvedRefs'],
+    'badNpis': extract_stats['badNpis'],
+    'uniqueCpts': list(cpt_stats.keys()),
+})
+with profiler.stage('PHASE 4: Finalize') as stage:
+    meta = writer.close()
+    stage.records = meta['rows']
+
+file_size_mb = sum(
+    os.path.getsize(os.path.join(root, name))
+    for root, _, names in os.walk(OUTPUT_DATASET) for name in names
+) / (1024 * 1024)
+print(f"✅ Saved to: {OUTPUT_DATASET}/ ({meta['format']}, {meta['batches']} batches)")
+print(f"   Dataset size: {file_size_mb:.1f} MB")
+
+profiler.save()
+profiler.close()
+restore_gc()
+print(f"\n⏱️  Run report → {RUN_REPORT}")
+for line in profiler.summary_lines():
+    print(f"   {line}")
 
 # ============================================
 # SUMMARY
@@ -241,12 +271,12 @@ print(f"""
 
 📊 RESULTS:
    • CPT codes found: {len(cpt_stats)}
-   • Rate records: {len(extracted_records):,}
-   • Output file: {file_size_mb:.1f} MB
+   • Rate records: {meta['rows']:,}
+   • Output dataset: {file_size_mb:.1f} MB
 
 📋 NEXT STEPS:
    1. Review the extracted CPT codes
-   2. Run aggregation script to group by provider
+   2. Run aggregation script to group by provider (NPIs already resolved)
    3. Enrich with provider NPI data
    4. Load into app data layer
 
@@ -0,0 +1,99 @@
+# ============================================
+# PARALLEL MULTI-FILE MRF EXTRACTION
+# ============================================
+# Runs the single-pass extractor over every
+# downloaded MRF at once (one process per file),
+# writes a shard per file, then merges the
+# shards into one aggregated output.
+# ============================================
+
+!pip install ijson pyarrow
+
+from google.colab import drive
+import os
+import sys
+
+drive.mount('/content/drive')
+
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_parallel import run_parallel_extraction
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+BASE_DIR = '/content/drive/MyDrive/health-insurance-data'
+DOWNLOAD_DIR = f"{BASE_DIR}/mrf-downloads"
+OUTPUT_DIR = f"{BASE_DIR}/parallel-extract"
+REFS_CACHE_DIR = f"{BASE_DIR}/cache/provider-refs"   # Shared with colab_extract_mrf.py
+
+# (planSlug, file name in DOWNLOAD_DIR) — see colab_download_mrf_files.py
+MRF_FILES = [
+    ("uhc-choice-plus-ny", "uhc-ny-choice-plus-medical.json.gz"),
+    ("uhc-choice-epo-ny", "uhc-ny-choice-epo-medical.json.gz"),
+    ("uhc-dental-ny", "uhc-ny-dental.json.gz"),
+    ("uhc-vision-ny", "uhc-ny-vision.json.gz"),
+    ("uhc-transplant-ny", "uhc-ny-transplant-surgical.json.gz"),
+]
+
+# 75 Curated High-Value CPT Codes
+TARGET_CPTS = {
+    # Orthopedic (14)
+    '27130', '27447', '27446', '23472', '24363', '27702', '29881', '29827',
+    '27236', '23430', '29880', '27570', '27125', '29806',
+    # Spine (10)
+    '22612', '22630', '22633', '63030', '63047', '22551', '22552', '63075',
+    '22853', '22840',
+    # GI / Endoscopy (8)
+    '45378', '45380', '45385', '43239', '43235', '43249', '47562', '44970',
+    # Cardiac (8)
+    '33533', '33534', '92928', '93306', '93000', '33249', '33264', '33208',
+    # Imaging (12)
+    '70551', '70553', '71250', '72148', '72141', '74177', '73721', '73221',
+    '76830', '77067', '77063', '76700',
+    # Eye (6)
+    '66984', '66821', '67028', '66982', '65855', '67210',
+    # Women's Health (7)
+    '59400', '59510', '58150', '58262', '58571', '58661', '58558',
+    # General Surgery (5)
+    '49505', '49650', '19120', '11042', '17000',
+    # Pain Management (5)
+    '64483', '64493', '64635', '64479', '62322',
+}
+
+# Only files that have actually been downloaded
+mrf_files = [
+    (plan_slug, f"{DOWNLOAD_DIR}/{name}")
+    for plan_slug, name in MRF_FILES
+    if os.path.exists(f"{DOWNLOAD_DIR}/{name}")
+]
+
+print(f"📂 Files found: {len(mrf_files)}/{len(MRF_FILES)}")
+print(f"🧮 CPU cores: {os.cpu_count()}")
+print(f"🎯 Target CPTs: {len(TARGET_CPTS)}")
+
+# ============================================
+# EXTRACT (one worker per file) & MERGE
+# ============================================
+
+summary = run_parallel_extraction(
+    mrf_files,
+    OUTPUT_DIR,
+    target_cpts=TARGET_CPTS,
+    data_source='cms-mrf-uhc-ny',
+    refs_cache_dir=REFS_CACHE_DIR,
+)
+
+print(f"""
+
+{'='*60}
+✅ PARALLEL EXTRACTION COMPLETE!
+{'='*60}
+   Files extracted: {len(summary['files'])}
+   Files failed:    {len(summary['failed'])}
+   Aggregated recs: {summary['aggregatedRecords']:,}
+   Output file:     {summary['outputFile']}
+{'='*60}
+""")
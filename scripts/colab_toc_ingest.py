@@ -0,0 +1,107 @@
+# ============================================
+# TABLE-OF-CONTENTS DRIVEN MRF INGESTION
+# ============================================
+# Reads a payer's CMS table-of-contents file,
+# finds every in-network file and the plans it
+# covers, then downloads, extracts and
+# aggregates each unique file exactly once.
+# ============================================
+
+!pip install ijson pyarrow
+
+from google.colab import drive
+import os
+import sys
+
+drive.mount('/content/drive')
+
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_ingest import run_ingestion
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+BASE_DIR = '/content/drive/MyDrive/health-insurance-data'
+# Payer table-of-contents (index) file: URL or a path on Drive, .json or .json.gz
+TOC_SOURCE = f"{BASE_DIR}/toc/uhc-ny-index.json"
+WORK_DIR = f"{BASE_DIR}/toc-ingest/uhc-ny"             # Manifest, downloads, shards, output
+REFS_CACHE_DIR = f"{BASE_DIR}/cache/provider-refs"      # Shared with colab_extract_mrf.py
+DATA_SOURCE = 'cms-mrf-uhc-ny'
+MAX_DOWNLOADS = 4              # Files downloading at once
+MAX_WORKERS = os.cpu_count()   # Files extracting at once
+KEEP_DOWNLOADS = False         # Delete each raw MRF once its shard is written (Drive space)
+STATS_MODE = 'exact'           # 'sketch': approximate median + p10/p25/p75/p90, bounded memory
+
+# Which plan/file pairs to ingest (raw TOC dicts). Keeps everything; narrow
+# it while a new payer is being onboarded, e.g. by plan_market_type
+def include(plan, in_network_file):
+    return True
+
+# 75 Curated High-Value CPT Codes
+TARGET_CPTS = {
+    # Orthopedic (14)
+    '27130', '27447', '27446', '23472', '24363', '27702', '29881', '29827',
+    '27236', '23430', '29880', '27570', '27125', '29806',
+    # Spine (10)
+    '22612', '22630', '22633', '63030', '63047', '22551', '22552', '63075',
+    '22853', '22840',
+    # GI / Endoscopy (8)
+    '45378', '45380', '45385', '43239', '43235', '43249', '47562', '44970',
+    # Cardiac (8)
+    '33533', '33534', '92928', '93306', '93000', '33249', '33264', '33208',
+    # Imaging (12)
+    '70551', '70553', '71250', '72148', '72141', '74177', '73721', '73221',
+    '76830', '77067', '77063', '76700',
+    # Eye (6)
+    '66984', '66821', '67028', '66982', '65855', '67210',
+    # Women's Health (7)
+    '59400', '59510', '58150', '58262', '58571', '58661', '58558',
+    # General Surgery (5)
+    '49505', '49650', '19120', '11042', '17000',
+    # Pain Management (5)
+    '64483', '64493', '64635', '64479', '62322',
+}
+
+print(f"📑 TOC: {TOC_SOURCE}")
+print(f"📂 Work dir: {WORK_DIR}")
+print(f"🧮 {MAX_DOWNLOADS} downloads / {MAX_WORKERS} extractions at once")
+
+# ============================================
+# DISCOVER → DOWNLOAD → EXTRACT → AGGREGATE
+# ============================================
+# ingest_manifest.json in WORK_DIR records every file by URL with the plans
+# that list it and how far it got. Rerunning this cell after a disconnect
+# skips finished files and resumes partial downloads and extractions.
+
+summary = run_ingestion(
+    TOC_SOURCE,
+    WORK_DIR,
+    target_cpts=TARGET_CPTS,
+    data_source=DATA_SOURCE,
+    include=include,
+    max_downloads=MAX_DOWNLOADS,
+    max_workers=MAX_WORKERS,
+    refs_cache_dir=REFS_CACHE_DIR,
+    stats_mode=STATS_MODE,
+    keep_downloads=KEEP_DOWNLOADS,
+)
+
+for failure in summary['failed']:
+    print(f"   ❌ {failure['name']}: {failure['error']}")
+
+print(f"""
+
+{'='*60}
+✅ TOC INGESTION COMPLETE!
+{'='*60}
+   Unique files:     {summary['files']:,} ({summary['planFileReferences']:,} plan/file references)
+   Extracted:        {summary['extracted']:,} ({summary['cached']:,} from earlier runs)
+   Failed:           {len(summary['failed']):,} (retried on the next run)
+   Aggregated recs:  {summary['aggregatedRecords']:,}
+   Output file:      {summary['outputFile']}
+   Wall time:        {summary['seconds'] / 60:.1f} min
+{'='*60}
+""")
@@ -8,10 +8,9 @@
 from google.colab import drive
 import os
 import json
-from collections import defaultdict
-from statistics import median
 from datetime import datetime
-import gc
+import sys
+import time
 
 # ============================================
 # CONFIGURATION
@@ -48,6 +47,13 @@ TARGET_CPTS = {
 
 drive.mount('/content/drive')
 
+# Shared pipeline modules (copy of the repo's scripts/ folder on Drive)
+PIPELINE_DIR = '/content/drive/MyDrive/health-insurance-data/scripts'
+sys.path.insert(0, PIPELINE_DIR)
+from mrf_memory import configure_gc, freeze_long_lived, restore_gc
+from mrf_profile import RunProfiler
+from mrf_split import CptSplitter, aggregate_shard, iter_rate_lines
+
 BASE_DIR = '/content/drive/MyDrive/health-insurance-data'
 INPUT_FILE = f"{BASE_DIR}/raw-extracts/negotiated_rates.json"
 
@@ -55,6 +61,12 @@ INPUT_FILE = f"{BASE_DIR}/raw-extracts/negotiated_rates.json"
 RAW_BY_CPT_DIR = f"{BASE_DIR}/raw-by-cpt"      # Per-CPT raw files
 AGGREGATED_DIR = f"{BASE_DIR}/aggregated"      # Aggregated outputs
 
+RESUME = True               # Continue PASS 1 from its last checkpoint, if any
+CHECKPOINT_SECONDS = 300    # Checkpoint PASS 1 at most this often
+RUN_REPORT = f"{AGGREGATED_DIR}/two_tier_run_report.json"  # Per-pass time, throughput, memory, GC
+PROFILE_SAMPLE = None       # 'cprofile' or 'stack': per-pass profiles next to RUN_REPORT
+GC_MODE = 'managed'         # Fewer collections, long-lived data frozen (mrf_memory.py); 'default' to compare
+
 os.makedirs(RAW_BY_CPT_DIR, exist_ok=True)
 os.makedirs(AGGREGATED_DIR, exist_ok=True)
 
@@ -63,6 +75,9 @@ print(f"📂 Output: {RAW_BY_CPT_DIR} (per-CPT files)")
 print(f"📂 Output: {AGGREGATED_DIR} (aggregated)")
 print(f"🎯 Target: {len(TARGET_CPTS)} CPTs for aggregation")
 
+profiler = RunProfiler('two_tier_extraction', RUN_REPORT, sample=PROFILE_SAMPLE)
+configure_gc(GC_MODE)
+
 # ============================================
 # PASS 1: Split into per-CPT files
 # ============================================
@@ -71,51 +86,50 @@ print("\n" + "="*60)
 print("🚀 PASS 1: Splitting 7.7GB into per-CPT files...")
 print("="*60)
 
-cpt_files = {}       # File handles
-cpt_counts = {}      # Record counts per CPT
-total_records = 0
-errors = 0
-
-with open(INPUT_FILE, 'r') as f:
-    # Skip opening bracket
-    first_line = f.readline().strip()
-    if first_line != '[':
-        # File might not start with [, seek back
-        f.seek(0)
-    
-    for line in f:
-        line = line.strip().rstrip(',')
-        if not line or line == '[' or line == ']':
-            continue
+# Writes raw-by-cpt/{cpt}.jsonl plus a {cpt}.idx.npz byte-offset index per
+# file (line offsets grouped by providerNpi/planSlug), see mrf_split.py.
+# Lines are buffered per CPT and flushed in 1 MB blocks through an LRU pool
+# of at most 256 open files, so thousands of CPT/HCPCS codes stay under the
+# fd limit.
+#
+# Every CHECKPOINT_SECONDS the shards are flushed and the input byte offset,
+# counters, shard sizes and index entries so far are saved to raw-by-cpt/.
+# A rerun after a disconnect truncates the shards back to that point and
+# seeks straight to the saved offset.
+splitter = CptSplitter(RAW_BY_CPT_DIR, resume=RESUME)
+line_stats = dict(splitter.resume_state or {})
+if line_stats:
+    print(f"  ♻️  Resuming at byte {line_stats['offset']:,} ({line_stats['records']:,} records already split)")
+last_checkpoint = time.time()
+resumed_records, resumed_offset = line_stats.get('records', 0), line_stats.get('offset', 0)
+
+with profiler.stage('PASS 1: Split') as stage:
+    # Lines are read in 16 MB binary blocks and routed on procedureCpt /
+    # providerNpi / planSlug probed from the raw bytes; each record is written
+    # out unchanged (no json.loads + json.dumps per line)
+    for cpt, npi, plan, line in iter_rate_lines(INPUT_FILE, line_stats):
+        if cpt not in splitter.counts:
+            print(f"  📁 New CPT: {cpt}")
         
-        try:
-            record = json.loads(line)
-            cpt = record.get('procedureCpt', 'UNKNOWN')
-            
-            # Open file handle if first time seeing this CPT
-            if cpt not in cpt_files:
-                filepath = f"{RAW_BY_CPT_DIR}/{cpt}.jsonl"
-                cpt_files[cpt] = open(filepath, 'w')
-                cpt_counts[cpt] = 0
-                print(f"  📁 New CPT: {cpt}")
-            
-            # Write record to CPT-specific file
-            cpt_files[cpt].write(json.dumps(record, separators=(',', ':')) + '\n')
-            cpt_counts[cpt] += 1
-            total_records += 1
-            
-            # Progress update
-            if total_records % 500000 == 0:
-                print(f"  ...{total_records:,} records → {len(cpt_files)} CPTs")
-                gc.collect()
-                
-        except json.JSONDecodeError:
-            errors += 1
-            continue
-
-# Close all file handles
-for f in cpt_files.values():
-    f.close()
+        # Write record to CPT-specific file (and its index)
+        splitter.write(cpt, npi, plan, line)
+        
+        # Progress update
+        if line_stats['records'] % 500000 == 0:
+            print(f"  ...{line_stats['records']:,} records → {len(splitter.counts)} CPTs "
+                  f"({stage.progress(line_stats['records'] - resumed_records)})")
+            if time.time() - last_checkpoint > CHECKPOINT_SECONDS:
+                splitter.checkpoint(line_stats)
+                last_checkpoint = time.time()
+    
+    total_records = line_stats['records']
+    errors = line_stats['errors']
+    
+    # Flush all buffers, close the pool and write the shard indexes
+    cpt_counts = splitter.close()
+    split_stats = splitter.stats()
+    stage.records = total_records - resumed_records
+    stage.decompressed_bytes = line_stats['offset'] - resumed_offset
 
 # ============================================
 # Save Manifest (all CPTs found)
@@ -130,6 +144,7 @@ manifest = {
     "targetCPTs": list(TARGET_CPTS),
     "targetCPTsFound": [cpt for cpt in TARGET_CPTS if cpt in cpt_counts],
     "targetCPTsMissing": [cpt for cpt in TARGET_CPTS if cpt not in cpt_counts],
+    "splitStats": split_stats,
 }
 
 manifest_path = f"{AGGREGATED_DIR}/manifest.json"
@@ -140,6 +155,10 @@ print(f"\n✅ PASS 1 COMPLETE!")
 print(f"   Total records:  {total_records:,}")
 print(f"   Total CPTs:     {len(cpt_counts)}")
 print(f"   Parse errors:   {errors}")
+print(f"   Missing keys:   {line_stats['missingKeys']}  (no providerNpi/planSlug, skipped)")
+print(f"   Full parses:    {line_stats['fallbacks']:,} (lines the byte probe couldn't read)")
+print(f"   File opens:     {split_stats['fileOpens']:,} (max {split_stats['maxOpenFiles']} open at once)")
+print(f"   Block flushes:  {split_stats['flushes']:,} ({split_stats['writeMBps']} MB/s written)")
 print(f"   Manifest:       {manifest_path}")
 
 # Show top 20 CPTs by volume
@@ -155,8 +174,6 @@ print(f"\n🎯 Target CPTs: {len(found_targets)}/{len(TARGET_CPTS)} found")
 if missing_targets:
     print(f"   ⚠️  Missing: {missing_targets[:10]}{'...' if len(missing_targets) > 10 else ''}")
 
-gc.collect()
-
 # ============================================
 # PASS 2: Aggregate target CPTs only
 # ============================================
@@ -167,49 +184,26 @@ print("="*60)
 
 all_aggregated = []
 
-for cpt in sorted(found_targets):
-    cpt_file = f"{RAW_BY_CPT_DIR}/{cpt}.jsonl"
-    
-    if not os.path.exists(cpt_file):
-        print(f"  ⚠️  Skipping {cpt}: file not found")
-        continue
-    
-    # Aggregate: group by (providerNpi, planSlug)
-    aggregated = defaultdict(list)
-    
-    with open(cpt_file, 'r') as f:
-        for line in f:
-            try:
-                record = json.loads(line.strip())
-                key = (record['providerNpi'], record['planSlug'])
-                price = record.get('negotiatedRate', 0)
-                if price > 0:
-                    aggregated[key].append(price)
-            except:
-                continue
-    
-    # Build aggregated records
-    cpt_record_count = 0
-    for (npi, plan), prices in aggregated.items():
-        sorted_prices = sorted(prices)
-        all_aggregated.append({
-            "procedureCpt": cpt,
-            "providerNpi": npi,
-            "planSlug": plan,
-            "priceStats": {
-                "min": round(sorted_prices[0], 2),
-                "max": round(sorted_prices[-1], 2),
-                "median": round(median(sorted_prices), 2),
-                "mean": round(sum(sorted_prices) / len(sorted_prices), 2),
-                "count": len(sorted_prices)
-            },
-            "aggregatedAt": datetime.now().strftime("%Y-%m-%d"),
-            "dataSource": "cms-mrf-uhc-ny"
-        })
-        cpt_record_count += 1
-    
-    print(f"  ✓ CPT {cpt}: {cpt_record_count:,} provider-plan combinations")
-    gc.collect()
+with profiler.stage('PASS 2: Aggregate') as stage:
+    for cpt in sorted(found_targets):
+        cpt_file = f"{RAW_BY_CPT_DIR}/{cpt}.jsonl"
+        
+        if not os.path.exists(cpt_file):
+            print(f"  ⚠️  Skipping {cpt}: file not found")
+            continue
+        
+        # Group by (providerNpi, planSlug) in one vectorized pass: keys come
+        # from the shard index and each rate is probed from the raw line, so
+        # no dict is built per record (non-positive prices are dropped)
+        cpt_records = aggregate_shard(cpt_file, "cms-mrf-uhc-ny")
+        all_aggregated.extend(cpt_records)
+        cpt_record_count = len(cpt_records)
+        stage.records += cpt_counts[cpt]
+        stage.decompressed_bytes += os.path.getsize(cpt_file)
+        
+        print(f"  ✓ CPT {cpt}: {cpt_record_count:,} provider-plan combinations")
+        # Kept until the save: out of the collector's way from now on
+        freeze_long_lived()
 
 # ============================================
 # Save Aggregated Output
@@ -219,8 +213,10 @@ output_path = f"{AGGREGATED_DIR}/aggregated_75.json"
 
 print(f"\n💾 Saving {len(all_aggregated):,} aggregated records...")
 
-with open(output_path, 'w') as f:
-    json.dump(all_aggregated, f, separators=(',', ':'))
+with profiler.stage('Save') as stage:
+    with open(output_path, 'w') as f:
+        json.dump(all_aggregated, f, separators=(',', ':'))
+    stage.records = len(all_aggregated)
 
 file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
 
@@ -251,6 +247,7 @@ print(f"""
    {BASE_DIR}/
    ├── raw-by-cpt/           # {len(cpt_counts)} per-CPT files
    │   ├── 27130.jsonl
+   │   ├── 27130.idx.npz     # Line offsets by provider/plan
    │   ├── 22612.jsonl
    │   └── ...
    ├── aggregated/
@@ -263,5 +260,13 @@ if missing_targets:
     for cpt in sorted(missing_targets):
         print(f"   • {cpt}")
 
+profiler.save()
+profiler.close()
+restore_gc()
+print(f"\n⏱️  Run report → {RUN_REPORT}")
+for line in profiler.summary_lines():
+    print(f"   {line}")
+
 print("\n🎉 You can now download aggregated_75.json for your app!")
 print("   Future expansion: Just aggregate any CPT from raw-by-cpt/")
+print("   Refresh a few providers: mrf_split.reaggregate_groups(cpt_file, [(npi, plan), ...], ...)")
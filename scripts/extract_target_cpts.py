@@ -5,19 +5,26 @@ This script extracts negotiated rates for a target list of high-value
 shoppable procedures from a UnitedHealthcare Machine-Readable File (MRF).
 
 Usage:
-    python extract_target_cpts.py <path_to_mrf.json.gz> <output_directory>
+    python extract_target_cpts.py <path_to_mrf.json.gz> <output_directory> [cprofile|stack]
 
 Output:
-    - aggregated_rates.json: Rates aggregated by procedure+provider with price stats
+    - rates.json: Rates aggregated by procedure+provider with price stats
     - unique_npis.txt: List of unique provider NPIs for NPPES enrichment
+    - run_report.json: Per-stage timing, throughput, memory and GC (mrf_profile.py),
+      plus per-stage profiles when a sample mode is given
 """
 
 import json
-import gzip
 import sys
 import os
 from collections import defaultdict
-from statistics import mean, median
+
+import numpy as np
+
+from mrf_aggregate import group_prices, iter_price_stats
+from mrf_memory import freeze_long_lived, managed_gc
+from mrf_profile import RunProfiler
+from mrf_stream import extract_resolved_batches
 
 # ============================================================================
 # TARGET CPT CODES - High-Value Shoppable Procedures
@@ -102,90 +109,93 @@ print(f"Target CPT codes: {len(TARGET_CPT_CODES)}")
 # EXTRACTION LOGIC
 # ============================================================================
 
-def extract_rates(mrf_path: str, output_dir: str):
-    """Extract rates for target CPT codes from MRF file."""
+NEGOTIATED_TYPES = ("negotiated", "fee schedule")
+
+
+def extract_rates(mrf_path: str, output_dir: str, sample: str = None):
+    """
+    Extract rates for target CPT codes from MRF file.
+
+    The MRF is streamed (mrf_stream.py), never loaded whole: non-target
+    in_network items are skipped by the parser, and `provider_references`
+    are resolved to NPIs in the same pass as inline `provider_groups`. Only
+    the kept rates are held, as compact (CPT, NPI, price) columns, so peak
+    memory follows the target-CPT working set rather than the file size.
+
+    Each step is timed as a stage of `run_report.json` in `output_dir`;
+    `sample` ('cprofile' or 'stack') also profiles each one (mrf_profile.py).
+    """
     
     print(f"Reading MRF from: {mrf_path}")
-    
-    # Data structures
-    rates_by_proc_prov = defaultdict(list)
-    unique_npis = set()
-    
-    # Open MRF (gzipped JSON)
-    opener = gzip.open if mrf_path.endswith('.gz') else open
-    
-    with opener(mrf_path, 'rt', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Navigate MRF structure (UHC format)
-    in_network_files = data.get("in_network_files", data.get("in_network", []))
-    
-    for item in in_network_files:
-        billing_code = str(item.get("billing_code", ""))
-        billing_code_type = item.get("billing_code_type", "")
-        
-        # Only process target CPT codes
-        if billing_code_type != "CPT" or billing_code not in TARGET_CPT_CODES:
-            continue
-        
-        print(f"Processing CPT {billing_code}: {TARGET_CPT_CODES[billing_code]['name']}")
+    os.makedirs(output_dir, exist_ok=True)
+    profiler = RunProfiler("extract_target_cpts", os.path.join(output_dir, "run_report.json"), sample)
+    
+    # Data structures: one compact column chunk per streamed batch
+    cpt_index = {}
+    cpt_chunks, npi_chunks, price_chunks = [], [], []
+    stats = {}
+    
+    with profiler.stage("extract") as stage:
+        for batch in extract_resolved_batches(mrf_path, set(TARGET_CPT_CODES), stats=stats,
+                                              billing_code_types=("CPT",), decompress='thread',
+                                              negotiated_types=NEGOTIATED_TYPES):
+            codes, values = batch["procedureCpt"]
+            for billing_code in values:
+                if billing_code not in cpt_index:
+                    cpt_index[billing_code] = len(cpt_index)
+                    print(f"Processing CPT {billing_code}: {TARGET_CPT_CODES[billing_code]['name']}")
+            remap = np.array([cpt_index[v] for v in values], dtype=np.int32)
+            cpt_chunks.append(remap[codes] if len(codes) else np.empty(0, dtype=np.int32))
+            npi_chunks.append(batch["providerNpi"])
+            price_chunks.append(batch["negotiatedRate"])
+        stage.records = stats["rateRecords"]
+        stage.io(stats.get("io"))
+    # Column chunks and CPT names live until the end of the run
+    freeze_long_lived()
+    
+    with profiler.stage("aggregate") as stage:
+        cpt_values = np.array(list(cpt_index), dtype=object)
+        cpts = np.concatenate(cpt_chunks) if cpt_chunks else np.empty(0, dtype=np.int32)
+        npis = np.concatenate(npi_chunks) if npi_chunks else np.empty(0, dtype=np.int64)
+        prices = np.concatenate(price_chunks) if price_chunks else np.empty(0)
         
-        negotiated_rates = item.get("negotiated_rates", [])
+        # Non-positive prices are dropped, as are the NPIs only they reference
+        positive = prices > 0
+        unique_npis = [str(npi) for npi in np.unique(npis[positive]).tolist()]
+        # Means round like statistics.mean (exact), as this script always has
+        groups = group_prices([cpts, npis], prices, exact_mean=True)
         
-        for rate_obj in negotiated_rates:
-            negotiated_type = rate_obj.get("negotiated_type", "")
-            if negotiated_type not in ["negotiated", "fee schedule"]:
-                continue
-            
-            negotiated_price = rate_obj.get("negotiated_price")
-            if not negotiated_price or negotiated_price <= 0:
-                continue
-            
-            provider_groups = rate_obj.get("provider_groups", [])
-            for group in provider_groups:
-                npis = group.get("npi", [])
-                for npi in npis:
-                    npi_str = str(npi)
-                    unique_npis.add(npi_str)
-                    rates_by_proc_prov[(billing_code, npi_str)].append({
-                        "price": negotiated_price,
-                        "type": negotiated_type
-                    })
-    
-    print(f"\nUnique procedure+provider combinations: {len(rates_by_proc_prov)}")
-    print(f"Unique provider NPIs: {len(unique_npis)}")
-    
-    # Aggregate rates
-    aggregated_rates = []
-    for (cpt, npi), prices in rates_by_proc_prov.items():
-        price_values = [p["price"] for p in prices]
-        aggregated_rates.append({
-            "procedureCpt": cpt,
-            "providerNpi": npi,
-            "priceStats": {
-                "min": min(price_values),
-                "max": max(price_values),
-                "median": round(median(price_values), 2),
-                "mean": round(mean(price_values), 2),
-                "count": len(price_values)
+        # Aggregate rates
+        aggregated_rates = [
+            {
+                "procedureCpt": cpt_values[cpts[row]],
+                "providerNpi": str(npis[row]),
+                "priceStats": price_stats
             }
-        })
+            for row, price_stats in iter_price_stats(groups)
+        ]
+        
+        # Sort by CPT, then by median price
+        aggregated_rates.sort(key=lambda x: (x["procedureCpt"], x["priceStats"]["median"]))
+        stage.records = len(prices)
     
-    # Sort by CPT, then by median price
-    aggregated_rates.sort(key=lambda x: (x["procedureCpt"], x["priceStats"]["median"]))
+    print(f"\nResolved against {stats['providerReferences']:,} provider references "
+          f"({stats['unresolvedRefs']:,} unresolved)")
+    print(f"Unique procedure+provider combinations: {len(groups['count'])}")
+    print(f"Unique provider NPIs: {len(unique_npis)}")
     
     # Write outputs
-    os.makedirs(output_dir, exist_ok=True)
-    
-    rates_path = os.path.join(output_dir, "rates.json")
-    with open(rates_path, 'w') as f:
-        json.dump(aggregated_rates, f, indent=2)
-    print(f"\nWrote {len(aggregated_rates)} aggregated rates to {rates_path}")
-    
-    npis_path = os.path.join(output_dir, "unique_npis.txt")
-    with open(npis_path, 'w') as f:
-        f.write('\n'.join(sorted(unique_npis)))
-    print(f"Wrote {len(unique_npis)} unique NPIs to {npis_path}")
+    with profiler.stage("write") as stage:
+        rates_path = os.path.join(output_dir, "rates.json")
+        with open(rates_path, 'w') as f:
+            json.dump(aggregated_rates, f, indent=2)
+        print(f"\nWrote {len(aggregated_rates)} aggregated rates to {rates_path}")
+        
+        npis_path = os.path.join(output_dir, "unique_npis.txt")
+        with open(npis_path, 'w') as f:
+            f.write('\n'.join(sorted(unique_npis)))
+        print(f"Wrote {len(unique_npis)} unique NPIs to {npis_path}")
+        stage.records = len(aggregated_rates)
     
     # Print summary by CPT code
     print("\n" + "="*60)
@@ -200,11 +210,20 @@ def extract_rates(mrf_path: str, output_dir: str):
         print(f"{cpt}: {info.get('name', 'Unknown'):40s} - {count:5d} providers")
     
     print(f"\nTotal: {len(aggregated_rates)} rates across {len(cpt_counts)} procedures")
+    
+    profiler.save()
+    profiler.close()
+    print("\nStages:")
+    for line in profiler.summary_lines():
+        print(f"  {line}")
+    print(f"Run report: {profiler.report_path}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python extract_target_cpts.py <mrf_path> <output_dir>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python extract_target_cpts.py <mrf_path> <output_dir> [cprofile|stack]")
         print("Example: python extract_target_cpts.py uhc_ny_mrf.json.gz ./data/uhc_ny")
         sys.exit(1)
     
-    extract_rates(sys.argv[1], sys.argv[2])
+    # Fewer collections, long-lived data frozen (mrf_memory.py)
+    with managed_gc():
+        extract_rates(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
@@ -0,0 +1,544 @@
+"""
+Shared price aggregation helpers.
+
+Builds the `priceStats` records consumed by the app (aggregated_rates_75.json)
+from per-(CPT, NPI, plan) price lists, so every pipeline script produces
+byte-identical output for the same input rates.
+
+`group_prices` / `aggregate_columns` are the vectorized engine: they take
+columnar (cpt, npi, plan, rate) arrays, sort once, and compute every group's
+stats with NumPy instead of a dict of Python lists per key. Results match
+`price_stats` exactly (same median arithmetic, same left-to-right mean sum,
+same Python `round`).
+
+`select_top` keeps the best N groups per key (e.g. providers per CPT) by a
+pluggable score over the columnar stats, without sorting or building
+records for the rest.
+
+`StreamingAggregator` feeds the same engine from a single pass over a rate
+stream, buffering 16 bytes per rate and spilling to disk only past a memory
+threshold.
+
+With `stats_mode='sketch'`, prices are folded into one mergeable KLL sketch
+per key (mrf_sketch.py) instead of being kept: memory per key is bounded,
+priceStats gain p10/p25/p75/p90, and partial sketches from different files
+or workers merge without the raw prices. `sketch_metadata()` describes the
+error bound for the output metadata.
+"""
+
+import os
+import tempfile
+from array import array
+from datetime import datetime
+from statistics import mean, median
+
+import numpy as np
+
+from mrf_columnar import iter_column_batches, read_meta
+from mrf_sketch import DEFAULT_K, KllSketch, sketch_price_stats
+
+# Groups longer than this get their mean sum from one accumulate() each;
+# shorter ones are summed together, one vectorized add per position.
+LONG_GROUP = 256
+
+
+def price_stats(prices) -> dict:
+    """Min/max/median/mean/count of a non-empty price list, rounded to cents."""
+    sorted_prices = sorted(prices)
+    return {
+        "min": round(sorted_prices[0], 2),
+        "max": round(sorted_prices[-1], 2),
+        "median": round(median(sorted_prices), 2),
+        "mean": round(sum(sorted_prices) / len(sorted_prices), 2),
+        "count": len(sorted_prices)
+    }
+
+
+def aggregate_record(cpt: str, npi: str, plan: str, prices, data_source: str,
+                     aggregated_at: str = None) -> dict:
+    """One output row in the aggregated_rates_75.json format."""
+    return {
+        "procedureCpt": cpt,
+        "providerNpi": npi,
+        "planSlug": plan,
+        "priceStats": price_stats(prices),
+        "aggregatedAt": aggregated_at or datetime.now().strftime("%Y-%m-%d"),
+        "dataSource": data_source
+    }
+
+
+def _key_codes(column) -> np.ndarray:
+    """Dense int codes for a key column (strings or numbers)."""
+    column = np.asarray(column)
+    if column.dtype.kind in 'iu':
+        return column
+    if column.dtype.kind == 'O':
+        # np.unique on object arrays is slow; a dict lookup per row is not
+        seen = {}
+        return np.fromiter((seen.setdefault(v, len(seen)) for v in column.tolist()),
+                           dtype=np.int64, count=len(column))
+    return np.unique(column, return_inverse=True)[1].reshape(-1)
+
+
+def round_cents(values: np.ndarray) -> list:
+    """
+    Python's `round(v, 2)` for a whole array, as a list of floats.
+
+    rint(v * 100) / 100 gives the same result except where v * 100 lands
+    within rounding error of a half cent; those few are redone with round().
+    """
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    rounded[near_half] = [round(v, 2) for v in values[near_half].tolist()]
+    return rounded.tolist()
+
+
+def _sequential_sums(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Per-group sums added strictly left to right, like Python's `sum()`.
+
+    NumPy's sum/reduceat use pairwise summation, which can differ from
+    `sum(sorted_prices)` in the last bit — enough to flip a rounded mean.
+    """
+    sums = np.zeros(len(starts))
+    long_groups = np.flatnonzero(counts > LONG_GROUP)
+    for g in long_groups.tolist():
+        sums[g] = np.add.accumulate(values[starts[g]:starts[g] + counts[g]])[-1]
+
+    short = np.flatnonzero(counts <= LONG_GROUP)
+    short = short[np.argsort(-counts[short], kind='stable')]   # longest first
+    short_starts, short_counts = starts[short], counts[short]
+    acc = np.zeros(len(short))
+    for k in range(int(short_counts[0]) if len(short) else 0):
+        active = np.searchsorted(-short_counts, -k, side='left')   # groups with count > k
+        acc[:active] += values[short_starts[:active] + k]
+    sums[short] = acc
+    return sums
+
+
+def group_prices(key_columns, rates, positive_only: bool = True, exact_mean: bool = False) -> dict:
+    """
+    Vectorized min/max/median/mean/count of `rates` grouped by `key_columns`.
+
+    `key_columns` is a sequence of equal-length arrays (e.g. cpt, npi, plan).
+    Rows with a non-positive rate are dropped when `positive_only`. Returns a
+    dict of per-group NumPy arrays plus 'rows' — the index of each group's
+    first input row, for looking up its key values. Groups are ordered by
+    first appearance, matching a dict-of-lists built over the same rows.
+
+    The mean is `sum(sorted_prices) / count`, as in `price_stats`. With
+    `exact_mean` it rounds to cents like `statistics.mean` (exact) instead:
+    the two differ by far less than a cent, so only means within rounding
+    error of a half cent are recomputed with `statistics.mean`.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    rows = np.arange(len(rates))
+    codes = [_key_codes(column) for column in key_columns]
+    if positive_only:
+        keep = rates > 0
+        rates, rows, codes = rates[keep], rows[keep], [c[keep] for c in codes]
+
+    # Sort by key, then rate, so each group is one contiguous, sorted run
+    order = np.lexsort([rates] + codes[::-1])
+    rates, rows = rates[order], rows[order]
+    codes = [c[order] for c in codes]
+
+    changed = np.zeros(len(rates), dtype=bool)
+    if len(rates):
+        changed[0] = True
+    for c in codes:
+        changed[1:] |= c[1:] != c[:-1]
+    starts = np.flatnonzero(changed)
+    counts = np.diff(np.append(starts, len(rates)))
+    ends = starts + counts - 1
+
+    lower = rates[starts + (counts - 1) // 2]
+    upper = rates[starts + counts // 2]
+    means = _sequential_sums(rates, starts, counts) / counts
+    if exact_mean:
+        scaled = means * 100
+        for g in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6).tolist():
+            means[g] = mean(rates[starts[g]:starts[g] + counts[g]].tolist())
+    groups = {
+        'rows': np.minimum.reduceat(rows, starts) if len(starts) else rows[:0],
+        'min': rates[starts],
+        'max': rates[ends],
+        'median': np.where(counts % 2 == 1, lower, (lower + upper) / 2),
+        'mean': means,
+        'count': counts,
+    }
+    first = np.argsort(groups['rows'], kind='stable')
+    return {name: values[first] for name, values in groups.items()}
+
+
+def iter_price_stats(groups: dict):
+    """Yield (first_row, priceStats dict) per group from `group_prices`."""
+    columns = [groups['rows'].tolist()]
+    columns += [round_cents(groups[name]) for name in ('min', 'max', 'median', 'mean')]
+    columns.append(groups['count'].tolist())
+    for row, lo, hi, mid, avg, count in zip(*columns):
+        yield row, {"min": lo, "max": hi, "median": mid, "mean": avg, "count": count}
+
+
+def spread_count_score(groups: dict) -> np.ndarray:
+    """Default selection score: price spread plus volume, so varied or busy providers rank first."""
+    return (groups['max'] - groups['min']) + groups['count']
+
+
+def take_groups(groups: dict, index) -> dict:
+    """The `group_prices` arrays of the groups at `index` only."""
+    return {name: values[index] for name, values in groups.items()}
+
+
+def _top_positions(scores: np.ndarray, positions: np.ndarray, limit: int) -> np.ndarray:
+    """The `limit` best of `positions`, highest score first, earlier position first on ties."""
+    segment = scores[positions]
+    if len(positions) > limit:
+        # argpartition finds the cut-off score in linear time; ties at the
+        # cut-off go to the earliest positions, as a stable sort would
+        cutoff = segment[np.argpartition(-segment, limit - 1)[limit - 1]]
+        above = np.flatnonzero(segment > cutoff)
+        tied = np.flatnonzero(segment == cutoff)[:limit - len(above)]
+        keep = np.concatenate([above, tied])
+        positions, segment = positions[keep], segment[keep]
+    return positions[np.lexsort([positions, -segment])]
+
+
+def select_top(keys, scores, limit: int) -> list:
+    """
+    Top `limit` entries of `scores` within each value of `keys`.
+
+    Returns [(key, positions, total)] in first-appearance order of the keys,
+    with `positions` (indices into `scores`) best first — the same selection
+    and order as stable-sorting each key's entries by descending score and
+    cutting at `limit`, but linear per key: only the survivors are sorted,
+    so nothing per entry is built for the ones that are dropped.
+    """
+    keys = np.asarray(keys)
+    scores = np.asarray(scores, dtype=np.float64)
+    codes = _key_codes(keys)
+    order = np.argsort(codes, kind='stable')
+    changed = np.ones(len(order), dtype=bool)
+    changed[1:] = codes[order[1:]] != codes[order[:-1]]
+    starts = np.flatnonzero(changed)
+    ends = np.append(starts[1:], len(order))
+    # A stable sort leaves each key's first appearance at the start of its run
+    starts, ends = [bounds[np.argsort(order[starts])].tolist() for bounds in (starts, ends)]
+    return [(keys[order[start]], _top_positions(scores, order[start:end], limit), end - start)
+            for start, end in zip(starts, ends)]
+
+
+def aggregate_columns(cpts, npis, plans, rates, data_source: str,
+                      aggregated_at: str = None) -> list:
+    """
+    Aggregated records for columnar rates, grouped by (CPT, NPI, plan).
+
+    Same output as `aggregate_record` over a dict of price lists built from
+    the same rows (non-positive prices dropped), in first-appearance order.
+    """
+    aggregated_at = aggregated_at or datetime.now().strftime("%Y-%m-%d")
+    cpts, npis, plans = np.asarray(cpts), np.asarray(npis), np.asarray(plans)
+    return [
+        {
+            "procedureCpt": str(cpts[row]),
+            "providerNpi": str(npis[row]),
+            "planSlug": str(plans[row]),
+            "priceStats": stats,
+            "aggregatedAt": aggregated_at,
+            "dataSource": data_source
+        }
+        for row, stats in iter_price_stats(group_prices([cpts, npis, plans], rates))
+    ]
+
+
+def _sorted_groups(key_columns, rates):
+    """(order, starts, counts) of `rates` sorted by key then rate, one run per key."""
+    codes = [_key_codes(column) for column in key_columns]
+    order = np.lexsort([rates] + codes[::-1])
+    changed = np.zeros(len(rates), dtype=bool)
+    if len(rates):
+        changed[0] = True
+    for c in codes:
+        c = c[order]
+        changed[1:] |= c[1:] != c[:-1]
+    starts = np.flatnonzero(changed)
+    return order, starts, np.diff(np.append(starts, len(rates)))
+
+
+def sketch_prices(key_columns, rates, sketches: dict = None, k: int = DEFAULT_K) -> dict:
+    """
+    Fold `rates` into one KllSketch per key tuple of `key_columns`.
+
+    Updates and returns `sketches` ({key tuple: KllSketch}); non-positive
+    rates are dropped. Each key's prices go in as one sorted run.
+    """
+    sketches = {} if sketches is None else sketches
+    rates = np.asarray(rates, dtype=np.float64)
+    keep = rates > 0
+    rates = rates[keep]
+    key_columns = [np.asarray(column)[keep] for column in key_columns]
+    order, starts, counts = _sorted_groups(key_columns, rates)
+    rates = rates[order]
+    key_values = [column[order][starts].tolist() for column in key_columns]
+    for key, start, count in zip(zip(*key_values), starts.tolist(), counts.tolist()):
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = KllSketch(k)
+        sketch.update_many(rates[start:start + count])
+    return sketches
+
+
+def merge_sketches(sketches: dict, partial: dict) -> dict:
+    """Merge a {key: KllSketch} partial result into `sketches` (in place)."""
+    for key, sketch in partial.items():
+        if key in sketches:
+            sketches[key].merge(sketch)
+        else:
+            sketches[key] = sketch
+    return sketches
+
+
+def sketch_records(sketches: dict, data_source: str, aggregated_at: str = None) -> list:
+    """Aggregated records from {(cpt, npi, plan): KllSketch}, sorted by key."""
+    aggregated_at = aggregated_at or datetime.now().strftime("%Y-%m-%d")
+    return [
+        {
+            "procedureCpt": str(cpt),
+            "providerNpi": str(npi),
+            "planSlug": str(plan),
+            "priceStats": sketch_price_stats(sketches[(cpt, npi, plan)]),
+            "aggregatedAt": aggregated_at,
+            "dataSource": data_source
+        }
+        for cpt, npi, plan in sorted(sketches, key=lambda key: tuple(str(v) for v in key))
+    ]
+
+
+def _iter_shard_columns(shard_path: str, target_cpts=None):
+    """(cpts, npis, rates) arrays per batch of one shard, filtered to `target_cpts`."""
+    for batch in iter_column_batches(shard_path, ['procedureCpt', 'providerNpi', 'negotiatedRate']):
+        keep = np.isin(batch['procedureCpt'], list(target_cpts)) if target_cpts else slice(None)
+        yield batch['procedureCpt'][keep], batch['providerNpi'][keep], batch['negotiatedRate'][keep]
+
+
+def sketch_shard(shard_path: str, target_cpts=None, k: int = DEFAULT_K, plan_slug: str = None) -> dict:
+    """
+    {(cpt, npi, plan): KllSketch} for one columnar shard.
+
+    Runs in a worker process; the sketches (a few KB per key at most) are all
+    that travels back to be merged, never the shard's prices. `plan_slug`
+    overrides the shard's own `planSlug`.
+    """
+    plan = plan_slug or read_meta(shard_path)['planSlug']
+    sketches = {}
+    for cpts, npis, rates in _iter_shard_columns(shard_path, target_cpts):
+        plans = np.full(len(rates), plan, dtype=object)
+        sketch_prices([cpts, npis.astype(str), plans], rates, sketches, k)
+    return sketches
+
+
+def aggregate_shards(shard_paths, data_source: str, target_cpts=None,
+                     stats_mode: str = 'exact', sketch_k: int = DEFAULT_K, plan_slug: str = None) -> list:
+    """
+    Merge per-file columnar rate shards (see mrf_columnar.py) into aggregated records.
+
+    Each shard's plan comes from its `planSlug` metadata, or is `plan_slug`
+    for all of them when given (shards of one plan's files). Rates are grouped by
+    (procedureCpt, providerNpi, planSlug) across all shards; non-positive
+    prices are ignored. Output is sorted by CPT. With `stats_mode='sketch'`
+    each shard is reduced to per-key sketches that are merged, so memory is
+    bounded by the number of keys rather than the number of rates.
+    """
+    if stats_mode == 'sketch':
+        sketches = {}
+        for shard_path in shard_paths:
+            merge_sketches(sketches, sketch_shard(shard_path, target_cpts, sketch_k, plan_slug))
+        return sketch_records(sketches, data_source)
+
+    cpts, npis, plans, rates = [], [], [], []
+    for shard_path in shard_paths:
+        plan = plan_slug or read_meta(shard_path)['planSlug']
+        for batch_cpts, batch_npis, batch_rates in _iter_shard_columns(shard_path, target_cpts):
+            cpts.append(batch_cpts)
+            npis.append(batch_npis)
+            rates.append(batch_rates)
+            plans.append(np.full(len(rates[-1]), plan, dtype=object))
+
+    if not rates:
+        return []
+    aggregated = aggregate_columns(np.concatenate(cpts), np.concatenate(npis), np.concatenate(plans),
+                                   np.concatenate(rates), data_source)
+    return sorted(aggregated, key=lambda record: record['procedureCpt'])
+
+
+# ============================================================================
+# SINGLE-PASS STREAMING AGGREGATION
+# ============================================================================
+
+MAX_AGGREGATE_MEMORY = 1024 * 1024 * 1024     # Bytes of buffered rates before spilling
+ROW_BYTES = 16                                  # cpt code + key code + price per buffered rate
+KEY_BYTES = 160                                 # Rough cost of one interned (npi, plan) key
+SPILL_DTYPE = np.dtype([('key', '<i4'), ('price', '<f8')])
+
+
+class StreamingAggregator:
+    """
+    Aggregate (CPT, NPI, plan) prices from one pass over a rate stream.
+
+    Each kept rate is buffered as 16 bytes (CPT code, interned (npi, plan)
+    key code, price) instead of a JSON line in a temp file, and `results()`
+    computes exact stats per CPT with `group_prices`. Only if the buffer
+    outgrows `max_memory_bytes` is it spilled, per CPT, to compact binary
+    files in `spill_dir`, which are read back once at the end. Output equals
+    `aggregate_record` over per-key price lists (non-positive prices
+    dropped), ordered by CPT then first appearance.
+
+    With `stats_mode='sketch'` nothing is spilled: a full buffer is folded
+    into one KllSketch per (CPT, key) and cleared, so memory stays bounded
+    by the number of keys, and `results()` reports sketched percentiles.
+    """
+
+    def __init__(self, spill_dir: str = None, max_memory_bytes: int = MAX_AGGREGATE_MEMORY,
+                 stats_mode: str = 'exact', sketch_k: int = DEFAULT_K):
+        if stats_mode not in ('exact', 'sketch'):
+            raise ValueError(f"Unknown stats_mode: {stats_mode}")
+        self.spill_dir = spill_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.stats_mode = stats_mode
+        self.sketch_k = sketch_k
+        self.sketches = {}          # (cpt code, key code) -> KllSketch, in sketch mode
+        self.cpt_codes = {}
+        self.key_codes = {}         # (npi, plan) -> code
+        self.keys = []
+        self._reset_buffer()
+        self.spill_paths = {}       # cpt -> spill file
+        self.counters = {'rows': 0, 'spills': 0, 'spilledRows': 0, 'sketchFolds': 0,
+                         'peakBufferBytes': 0}
+
+    def _reset_buffer(self):
+        self.cpts = array('i')
+        self.key_column = array('i')
+        self.prices = array('d')
+
+    def buffer_bytes(self) -> int:
+        return ROW_BYTES * len(self.prices) + KEY_BYTES * len(self.keys)
+
+    def sketch_bytes(self) -> int:
+        return 8 * sum(sum(len(level) for level in sketch.levels) for sketch in self.sketches.values())
+
+    def add(self, cpt: str, npi: str, plan: str, price: float):
+        if not price > 0:
+            return
+        cpt_code = self.cpt_codes.get(cpt)
+        if cpt_code is None:
+            cpt_code = self.cpt_codes[cpt] = len(self.cpt_codes)
+        key = (npi, plan)
+        key_code = self.key_codes.get(key)
+        if key_code is None:
+            key_code = self.key_codes[key] = len(self.keys)
+            self.keys.append(key)
+        self.cpts.append(cpt_code)
+        self.key_column.append(key_code)
+        self.prices.append(price)
+        self.counters['rows'] += 1
+
+        if not len(self.prices) % 65536:
+            used = self.buffer_bytes()
+            self.counters['peakBufferBytes'] = max(self.counters['peakBufferBytes'], used)
+            if used > self.max_memory_bytes:
+                if self.stats_mode == 'sketch':
+                    self.fold()
+                else:
+                    self.spill()
+
+    def _buffered(self, cpt_code: int) -> np.ndarray:
+        """Buffered rows of one CPT as a SPILL_DTYPE array, in arrival order."""
+        rows = np.flatnonzero(np.asarray(self.cpts, dtype=np.int32) == cpt_code)
+        part = np.empty(len(rows), dtype=SPILL_DTYPE)
+        part['key'] = np.asarray(self.key_column, dtype=np.int32)[rows]
+        part['price'] = np.asarray(self.prices, dtype=np.float64)[rows]
+        return part
+
+    def spill(self):
+        """Append every CPT's buffered rows to its spill file and clear the buffer."""
+        if not len(self.prices):
+            return
+        os.makedirs(self.spill_dir or tempfile.gettempdir(), exist_ok=True)
+        for cpt, cpt_code in self.cpt_codes.items():
+            part = self._buffered(cpt_code)
+            if not len(part):
+                continue
+            if cpt not in self.spill_paths:
+                fd, self.spill_paths[cpt] = tempfile.mkstemp(suffix=f"-{cpt}.bin", dir=self.spill_dir)
+                os.close(fd)
+            with open(self.spill_paths[cpt], 'ab') as f:
+                part.tofile(f)
+        self.counters['spills'] += 1
+        self.counters['spilledRows'] += len(self.prices)
+        self._reset_buffer()
+
+    def fold(self):
+        """Fold the buffered rows into the per-(CPT, key) sketches and clear the buffer."""
+        if not len(self.prices):
+            return
+        sketch_prices([np.asarray(self.cpts, dtype=np.int32), np.asarray(self.key_column, dtype=np.int32)],
+                      np.asarray(self.prices, dtype=np.float64), self.sketches, self.sketch_k)
+        self.counters['sketchFolds'] += 1
+        self._reset_buffer()
+
+    def stats(self) -> dict:
+        stats = {**self.counters, 'keys': len(self.keys), 'cpts': len(self.cpt_codes),
+                 'bufferBytes': self.buffer_bytes()}
+        if self.stats_mode == 'sketch':
+            stats['sketchBytes'] = self.sketch_bytes()
+        return stats
+
+    def _sketch_results(self, data_source: str, aggregated_at: str):
+        self.fold()
+        by_cpt = {}
+        for (cpt_code, key_code), sketch in self.sketches.items():
+            by_cpt.setdefault(cpt_code, []).append((key_code, sketch))
+        for cpt in sorted(self.cpt_codes):
+            records = []
+            for key_code, sketch in sorted(by_cpt.get(self.cpt_codes[cpt], [])):
+                npi, plan = self.keys[key_code]
+                records.append({
+                    "procedureCpt": cpt,
+                    "providerNpi": npi,
+                    "planSlug": plan,
+                    "priceStats": sketch_price_stats(sketch),
+                    "aggregatedAt": aggregated_at,
+                    "dataSource": data_source
+                })
+            yield cpt, records
+
+    def results(self, data_source: str, aggregated_at: str = None):
+        """Yield (cpt, aggregated records) per CPT in sorted order; removes spill files."""
+        aggregated_at = aggregated_at or datetime.now().strftime("%Y-%m-%d")
+        if self.stats_mode == 'sketch':
+            yield from self._sketch_results(data_source, aggregated_at)
+            return
+        for cpt in sorted(self.cpt_codes):
+            parts = []
+            spill_path = self.spill_paths.pop(cpt, None)
+            if spill_path:
+                parts.append(np.fromfile(spill_path, dtype=SPILL_DTYPE))
+                os.remove(spill_path)
+            parts.append(self._buffered(self.cpt_codes[cpt]))
+            rows = np.concatenate(parts)
+
+            records = []
+            key_column = rows['key']
+            groups = group_prices([key_column], rows['price'], positive_only=False)
+            for row, stats in iter_price_stats(groups):
+                npi, plan = self.keys[key_column[row]]
+                records.append({
+                    "procedureCpt": cpt,
+                    "providerNpi": npi,
+                    "planSlug": plan,
+                    "priceStats": stats,
+                    "aggregatedAt": aggregated_at,
+                    "dataSource": data_source
+                })
+            yield cpt, records
@@ -0,0 +1,155 @@
+"""
+MRF Extraction Benchmark
+
+Generates a synthetic in-network MRF locally (see mrf_synth.py) and times
+each extraction engine against it, reporting decompressed MB/s and
+in_network items/s.
+
+Engines:
+    - legacy:        the original two ijson.items passes (refs, then in_network)
+    - items/<b>:     single-pass engine, full item builds on backend <b>
+    - events/<b>:    single-pass engine, event-level skip of non-target items
+
+The events engine is then re-run under each gzip decompression mode
+(inline / thread / external, see mrf_io.py) with per-stage throughput.
+
+Usage:
+    python mrf_bench.py [n_items] [output_json]
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+import ijson
+
+from mrf_io import DECOMPRESS_MODES, open_mrf
+from mrf_stream import extract_resolved_rates, provider_pairs
+from mrf_synth import DEFAULT_TARGET_CODES, write_synthetic_mrf
+
+
+def legacy_extract(path: str, target_cpts) -> int:
+    """Original colab_extract_mrf.py flow: one parse per section. Returns record count."""
+    provider_map = {}
+    with open_mrf(path) as f:
+        for index, ref_item in enumerate(ijson.items(f, 'provider_references.item')):
+            provider_map[str(ref_item.get('provider_group_id', index))] = \
+                provider_pairs(ref_item.get('provider_groups'))
+
+    records = 0
+    with open_mrf(path) as f:
+        for item in ijson.items(f, 'in_network.item'):
+            if item.get('billing_code_type', '') not in ('CPT', 'HCPCS'):
+                continue
+            if target_cpts and str(item.get('billing_code', '')) not in target_cpts:
+                continue
+            for rate_obj in item.get('negotiated_rates', []):
+                for price_obj in rate_obj.get('negotiated_prices', []):
+                    float(price_obj.get('negotiated_rate', 0))
+                    for ref in rate_obj.get('provider_references', []):
+                        records += len(provider_map.get(str(ref), ()))
+    return records
+
+
+def decompressed_size(path: str) -> int:
+    """Size of the JSON payload the parser actually has to read."""
+    if not path.endswith('.gz'):
+        return os.path.getsize(path)
+    size = 0
+    with gzip.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                return size
+            size += len(chunk)
+
+
+def available_backends() -> list:
+    backends = []
+    for name in ('yajl2_c', 'python'):
+        try:
+            ijson.get_backend(name)
+            backends.append(name)
+        except ImportError:
+            pass
+    return backends
+
+
+def run_extract_benchmark(path: str, n_items: int, target_cpts) -> list:
+    """Time every engine on `path`; each result is a flat, JSON-ready dict."""
+    payload_mb = decompressed_size(path) / (1024 * 1024)
+    engines = [('legacy', lambda: legacy_extract(path, target_cpts))]
+    for backend in available_backends():
+        for mode in ('items', 'events'):
+            engines.append((f"{mode}/{backend}", lambda m=mode, b=backend: sum(
+                1 for _ in extract_resolved_rates(path, target_cpts, mode=m, backend=b))))
+
+    results = []
+    for name, run in engines:
+        start = time.perf_counter()
+        records = run()
+        seconds = time.perf_counter() - start
+        results.append({
+            'engine': name,
+            'seconds': round(seconds, 3),
+            'mbPerSec': round(payload_mb / seconds, 2),
+            'itemsPerSec': round(n_items / seconds, 1),
+            'records': records,
+        })
+        print(f"  {name:<16} {seconds:8.2f}s  {payload_mb / seconds:8.1f} MB/s  "
+              f"{n_items / seconds:10,.0f} items/s  {records:,} records")
+    return results
+
+
+def run_decompress_benchmark(path: str, target_cpts) -> list:
+    """Time the events engine under each gzip decompression mode, with per-stage stats."""
+    results = []
+    for decompress in DECOMPRESS_MODES:
+        stats = {}
+        start = time.perf_counter()
+        records = sum(1 for _ in extract_resolved_rates(path, target_cpts, stats=stats,
+                                                        decompress=decompress))
+        seconds = time.perf_counter() - start
+        stage = stats.get('io', {})
+        results.append({
+            'decompress': decompress,
+            'seconds': round(seconds, 3),
+            'records': records,
+            **stage,
+        })
+        print(f"  {decompress:<9} {seconds:8.2f}s  "
+              f"inflate {stage.get('decompressMBps', '-'):>8} MB/s  "
+              f"parse {stage.get('parseMBps', '-'):>8} MB/s  "
+              f"parser waited {stage.get('parserWaitSeconds', '-')}s  "
+              f"inflater waited {stage.get('decompressorWaitSeconds', '-')}s")
+    return results
+
+
+if __name__ == "__main__":
+    n_items = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    output_json = sys.argv[2] if len(sys.argv) > 2 else None
+    target_cpts = set(DEFAULT_TARGET_CODES)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic-in-network.json.gz')
+        summary = write_synthetic_mrf(path, n_items=n_items)
+        print(f"📂 Synthetic MRF: {n_items:,} items, {summary['targetItems']:,} targets, "
+              f"{os.path.getsize(path) / (1024 * 1024):.1f} MB gz")
+        print("\n⏱️  Extraction engines:")
+        results = run_extract_benchmark(path, n_items, target_cpts)
+        print("\n⏱️  Decompression stages (events engine):")
+        decompress_results = run_decompress_benchmark(path, target_cpts)
+
+    # Every engine must agree on the output before its speed means anything
+    if len({r['records'] for r in results + decompress_results}) != 1:
+        print("❌ Engines disagree on record count!")
+        sys.exit(1)
+
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump({'synthetic': summary, 'results': results,
+                       'decompress': decompress_results}, f, indent=2)
+        print(f"💾 Results: {output_json}")
@@ -0,0 +1,314 @@
+"""
+End-to-end MRF pipeline benchmark suite.
+
+Generates synthetic in-network MRFs (mrf_synth.py) at several sizes and runs
+every pipeline stage against them:
+
+    - probe:      header metadata probe (mrf_probe.py), repeated PROBE_REPEATS times
+    - extract:    single-pass extraction to a columnar dataset, gz and plain input
+    - join:       fan-out of raw rate rows to NPIs against provider_references
+    - split:      PASS 1 per-CPT split of the raw-extract JSONL (mrf_split.py)
+    - pass2:      PASS 2 aggregation of every split shard (mrf_split.aggregate_shard)
+    - aggregate:  single-pass target-CPT aggregation of that JSONL (StreamingAggregator)
+
+Each stage runs in a fresh process, so its peak RSS is its own, once per GC
+mode (mrf_memory.py). Per stage the report records wall and CPU seconds,
+records/s, input MB/s, peak RSS, output size and GC collections and pause
+seconds, as JSON, plus the GC and wall seconds the managed mode saved over
+the default one. Given a baseline report, stages whose records/s fell by
+more than REGRESSION_THRESHOLD are listed and the exit code is 1.
+
+Usage:
+    python mrf_bench_suite.py [sizes] [output_json] [baseline_json]
+    python mrf_bench_suite.py 2000,20000,100000 bench.json previous-bench.json
+"""
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from mrf_memory import GC_MODES, managed_gc
+from mrf_profile import GcTimer, peak_rss_mb
+from mrf_synth import DEFAULT_TARGET_CODES, write_synthetic_mrf
+
+DEFAULT_SIZES = (2000, 20000)          # in_network items per synthetic file
+PROBE_REPEATS = 200
+REGRESSION_THRESHOLD = 0.2             # Fraction of records/s a stage may lose vs the baseline
+STAGES = ('probe', 'extract', 'join', 'split', 'pass2', 'aggregate')
+
+
+def _tree_bytes(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def _stage_probe(paths: dict):
+    from mrf_probe import probe_metadata
+
+    def run():
+        read = sum(probe_metadata(paths['gz'])['bytesRead'] for _ in range(PROBE_REPEATS))
+        return {'records': PROBE_REPEATS, 'inputBytes': read, 'outputBytes': 0}
+    return run
+
+
+def _stage_extract(paths: dict, source: str):
+    from mrf_columnar import ColumnarRateWriter
+    from mrf_stream import extract_resolved_batches
+
+    def run():
+        stats = {}
+        output = os.path.join(paths['work'], f"extract-{os.path.basename(source)}")
+        with ColumnarRateWriter(output) as writer:
+            for batch in extract_resolved_batches(source, set(DEFAULT_TARGET_CODES), stats=stats,
+                                                  decompress='thread'):
+                writer.write_batch(batch)
+        return {'records': stats['rateRecords'], 'inputBytes': os.path.getsize(paths['json']),
+                'outputBytes': _tree_bytes(output)}
+    return run
+
+
+def _stage_join(paths: dict):
+    from mrf_refs import ProviderRefIndex
+    from mrf_stream import (SECTION_READERS, add_provider_reference, get_ijson_backend,
+                            iter_raw_rates, new_stats, resolve_batches)
+
+    # Setup (not timed): the reference index and raw rows the join consumes
+    target_cpts = set(DEFAULT_TARGET_CODES)
+    refs, rows = ProviderRefIndex(), []
+    with open(paths['json'], 'rb') as f:
+        for section, item in SECTION_READERS['events'](f, get_ijson_backend(), target_cpts=target_cpts):
+            if section == 'ref':
+                add_provider_reference(refs, item, len(refs))
+            elif section == 'net' and str(item.get('billing_code', '')) in target_cpts:
+                rows.extend(iter_raw_rates(item))
+
+    def run():
+        stats = new_stats()
+        records = sum(len(batch['negotiatedRate']) for batch in resolve_batches(rows, refs, stats))
+        return {'records': records, 'inputBytes': 0, 'outputBytes': 0}
+    return run
+
+
+def _stage_split(paths: dict):
+    from mrf_split import CptSplitter, iter_rate_lines
+
+    def run():
+        stats = {}
+        output = os.path.join(paths['work'], 'raw-by-cpt')
+        shutil.rmtree(output, ignore_errors=True)
+        splitter = CptSplitter(output)
+        for cpt, npi, plan, line in iter_rate_lines(paths['jsonl'], stats):
+            splitter.write(cpt, npi, plan, line)
+        splitter.close()
+        return {'records': stats['records'], 'inputBytes': os.path.getsize(paths['jsonl']),
+                'outputBytes': _tree_bytes(output)}
+    return run
+
+
+def _stage_pass2(paths: dict):
+    from mrf_split import ShardIndex, aggregate_shard
+
+    shard_dir = os.path.join(paths['work'], 'raw-by-cpt')
+    shards = sorted(os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith('.jsonl'))
+    lines = sum(len(ShardIndex.load(shard)) for shard in shards)
+
+    def run():
+        records = []
+        for shard in shards:
+            records.extend(aggregate_shard(shard, 'bench'))
+        output = os.path.join(paths['work'], 'aggregated_shards.json')
+        with open(output, 'w') as f:
+            json.dump(records, f, separators=(',', ':'))
+        return {'records': lines, 'inputBytes': sum(os.path.getsize(shard) for shard in shards),
+                'outputBytes': os.path.getsize(output)}
+    return run
+
+
+def _stage_aggregate(paths: dict):
+    from mrf_aggregate import StreamingAggregator
+    from mrf_split import iter_rate_lines, probe_rate
+
+    def run():
+        stats = {}
+        target_cpts = set(DEFAULT_TARGET_CODES)
+        aggregator = StreamingAggregator(os.path.join(paths['work'], 'spill'))
+        for cpt, npi, plan, line in iter_rate_lines(paths['jsonl'], stats):
+            if cpt in target_cpts:
+                aggregator.add(cpt, npi, plan, probe_rate(line))
+        records = [record for _, cpt_records in aggregator.results('bench') for record in cpt_records]
+        output = os.path.join(paths['work'], 'aggregated.json')
+        with open(output, 'w') as f:
+            json.dump(records, f, separators=(',', ':'))
+        return {'records': stats['records'], 'inputBytes': os.path.getsize(paths['jsonl']),
+                'outputBytes': os.path.getsize(output)}
+    return run
+
+
+def run_stage(stage: str, paths: dict, variant: str = None, gc_mode: str = 'default') -> dict:
+    """Set up and time one stage under `gc_mode`. Runs inside its own worker process."""
+    baseline_rss = peak_rss_mb()
+    if stage == 'extract':
+        run = _stage_extract(paths, paths[variant])
+    else:
+        run = {'probe': _stage_probe, 'join': _stage_join, 'split': _stage_split,
+               'pass2': _stage_pass2, 'aggregate': _stage_aggregate}[stage](paths)
+    gc_timer = GcTimer()
+    gc_timer.install()
+    with managed_gc(gc_mode):
+        gc_snapshot = gc_timer.snapshot()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        gc_stats = gc_timer.since(gc_snapshot)
+    gc_timer.uninstall()
+    return {
+        'stage': stage,
+        'variant': variant,
+        'gcMode': gc_mode,
+        'seconds': round(wall, 3),
+        'cpuSeconds': round(cpu, 3),
+        'records': result['records'],
+        'recordsPerSec': round(result['records'] / wall, 1) if wall else None,
+        'inputMB': round(result['inputBytes'] / (1024 * 1024), 2),
+        'mbPerSec': round(result['inputBytes'] / (1024 * 1024) / wall, 2) if wall and result['inputBytes'] else None,
+        'outputBytes': result['outputBytes'],
+        'peakRssMB': peak_rss_mb(),
+        'setupRssMB': baseline_rss,
+        **gc_stats,
+    }
+
+
+def _isolated(stage: str, paths: dict, variant: str = None, gc_mode: str = 'default') -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(run_stage, stage, paths, variant, gc_mode).result()
+
+
+def gc_savings(results: list) -> list:
+    """GC and wall seconds the managed mode saved over the default one, per stage and variant."""
+    by_key = {(r['stage'], r['variant'], r['gcMode']): r for r in results}
+    savings = []
+    for (stage, variant, gc_mode), managed in by_key.items():
+        default = by_key.get((stage, variant, 'default'))
+        if gc_mode != 'managed' or default is None:
+            continue
+        savings.append({'stage': stage, 'variant': variant,
+                        'gcSecondsDefault': default['gcSeconds'], 'gcSecondsManaged': managed['gcSeconds'],
+                        'gcSecondsSaved': round(default['gcSeconds'] - managed['gcSeconds'], 4),
+                        'secondsSaved': round(default['seconds'] - managed['seconds'], 3)})
+    return savings
+
+
+def write_raw_extract(dataset_dir: str, path: str, plan_slug: str = 'bench-plan') -> int:
+    """Write a columnar dataset as the raw-extract JSON array (one record per line) PASS 1 reads."""
+    from mrf_columnar import iter_rate_records
+
+    count = 0
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for record in iter_rate_records(dataset_dir, ['procedureCpt', 'providerNpi', 'negotiatedRate']):
+            record['planSlug'] = plan_slug
+            f.write((',\n' if count else '') + json.dumps(record))
+            count += 1
+        f.write('\n]\n')
+    return count
+
+
+def run_suite(sizes=DEFAULT_SIZES, stages=STAGES, work_dir: str = None, gc_modes=GC_MODES) -> dict:
+    """Generate each size, run every stage on it and return the JSON-ready report."""
+    report = {
+        'generatedAt': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sizes': [],
+    }
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for n_items in sizes:
+            size_dir = os.path.join(tmp, str(n_items))
+            os.makedirs(size_dir)
+            paths = {
+                'work': size_dir,
+                'gz': os.path.join(size_dir, 'synthetic.json.gz'),
+                'json': os.path.join(size_dir, 'synthetic.json'),
+                'jsonl': os.path.join(size_dir, 'negotiated_rates.json'),
+            }
+            synthetic = write_synthetic_mrf(paths['gz'], n_items=n_items)
+            write_synthetic_mrf(paths['json'], n_items=n_items)
+            print(f"\n📂 {n_items:,} items: {os.path.getsize(paths['gz']) / (1024 * 1024):.1f} MB gz, "
+                  f"{os.path.getsize(paths['json']) / (1024 * 1024):.1f} MB json")
+
+            results = []
+            for stage in stages:
+                variants = ('gz', 'json') if stage == 'extract' else (None,)
+                for variant in variants:
+                    if stage in ('split', 'pass2', 'aggregate') and not os.path.exists(paths['jsonl']):
+                        # PASS 1/2 input (not timed): the raw extract the extractor would have written
+                        if 'extract' not in stages:
+                            _isolated('extract', paths, 'gz')
+                        write_raw_extract(os.path.join(size_dir, 'extract-synthetic.json.gz'), paths['jsonl'])
+                    if stage == 'pass2' and 'split' not in stages:
+                        _isolated('split', paths)
+                    for gc_mode in gc_modes:
+                        result = _isolated(stage, paths, variant, gc_mode)
+                        results.append(result)
+                        name = stage + (f"/{variant}" if variant else '') + f" [{gc_mode}]"
+                        print(f"  {name:<24} {result['seconds']:8.2f}s  {result['recordsPerSec'] or 0:>12,.0f} rec/s  "
+                              f"{result['mbPerSec'] or 0:8.1f} MB/s  peak {result['peakRssMB']:7.1f} MB  "
+                              f"out {result['outputBytes'] / (1024 * 1024):7.1f} MB  "
+                              f"gc {result['gcSeconds']:6.3f}s / {sum(result['gcCollections']):,}")
+            savings = gc_savings(results)
+            for saved in savings:
+                name = saved['stage'] + (f"/{saved['variant']}" if saved['variant'] else '')
+                print(f"  ♻️  {name:<21} GC {saved['gcSecondsDefault']:.3f}s → {saved['gcSecondsManaged']:.3f}s "
+                      f"(saved {saved['gcSecondsSaved']:.3f}s GC, {saved['secondsSaved']:+.3f}s wall)")
+            report['sizes'].append({'synthetic': {**synthetic, 'path': None,
+                                                  'gzBytes': os.path.getsize(paths['gz']),
+                                                  'jsonBytes': os.path.getsize(paths['json'])},
+                                    'stages': results,
+                                    'gcSavings': savings})
+    return report
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """Stages (per size, variant and GC mode) whose records/s dropped by more than `threshold`."""
+    def rates(report):
+        return {(size['synthetic']['inNetworkItems'], stage['stage'], stage['variant'], stage.get('gcMode', 'default')):
+                stage['recordsPerSec'] for size in report['sizes'] for stage in size['stages']}
+
+    before = rates(baseline)
+    regressions = []
+    for key, now in rates(current).items():
+        then = before.get(key)
+        if then and now is not None and now < then * (1 - threshold):
+            regressions.append({'inNetworkItems': key[0], 'stage': key[1], 'variant': key[2], 'gcMode': key[3],
+                                'baselineRecordsPerSec': then, 'recordsPerSec': now,
+                                'change': round(now / then - 1, 3)})
+    return regressions
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_SIZES
+    output_json = sys.argv[2] if len(sys.argv) > 2 else None
+    baseline_json = sys.argv[3] if len(sys.argv) > 3 else None
+
+    report = run_suite(sizes)
+    if baseline_json:
+        with open(baseline_json, 'r') as f:
+            report['regressions'] = compare_reports(json.load(f), report)
+        for regression in report['regressions']:
+            print(f"❌ {regression['stage']} @ {regression['inNetworkItems']:,} items: "
+                  f"{regression['change']:+.0%} records/s vs baseline")
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results: {output_json}")
+    sys.exit(1 if report.get('regressions') else 0)
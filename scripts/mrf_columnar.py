@@ -0,0 +1,256 @@
+"""
+Streaming columnar storage for extracted rate records.
+
+Records are buffered in a RateStore (mrf_store.py) and flushed to disk in
+bounded-size batches, so memory stays flat no matter how many rates an MRF
+contains. Each batch becomes one part of a dataset directory:
+
+    <dataset>/
+    ├── _meta.json            # format, schema, row/batch counts, run metadata
+    ├── part-00000.parquet    # format='parquet' (pyarrow)
+    └── part-00001/           # format='npy' (NumPy), one .npy per column
+        ├── procedureCpt.npy          # int32 codes
+        ├── procedureCpt.values.npy   # string dictionary for those codes
+        └── ...
+
+A writer can checkpoint after a flush (`_checkpoint.json`: rows and parts
+written so far plus the caller's resume state, e.g.
+`mrf_stream.checkpoint_state`). Created with `resume=True`, it keeps the
+checkpointed parts, drops any written after the checkpoint, and hands the
+state back as `resume_state`. `close()` removes the checkpoint.
+
+String columns stay dictionary-encoded on disk (Parquet dictionary columns,
+or codes + values arrays for npy). Parquet is used when pyarrow is installed
+(Colab default); otherwise each batch is written as `.npy` files.
+
+Usage:
+    with ColumnarRateWriter(out_dir, metadata={...}) as writer:
+        for batch in extract_resolved_batches(path, TARGET_CPTS):
+            writer.write_batch(batch)
+
+    store = load_rate_store(out_dir, ['procedureCpt', 'providerNpi', 'negotiatedRate'])
+"""
+
+import json
+import os
+import shutil
+
+from mrf_store import COLUMN_TYPES, RateStore, decode_service_codes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+BATCH_ROWS = 500_000
+META_FILE = '_meta.json'
+CHECKPOINT_FILE = '_checkpoint.json'
+
+
+def default_format() -> str:
+    if pa is not None:
+        return 'parquet'
+    if np is not None:
+        return 'npy'
+    raise ImportError("Columnar output needs pyarrow (parquet) or numpy (npy)")
+
+
+class ColumnarRateWriter:
+    """Buffer rate rows in a RateStore and flush them as batch parts."""
+
+    def __init__(self, output_dir: str, batch_rows: int = BATCH_ROWS,
+                 fmt: str = None, metadata: dict = None, resume: bool = False):
+        self.output_dir = output_dir
+        self.batch_rows = batch_rows
+        self.format = fmt or default_format()
+        self.metadata = dict(metadata or {})
+        self.store = RateStore()
+        self.rows = 0
+        self.batches = 0
+        self.resume_state = None
+
+        checkpoint = None
+        checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        # A checkpoint written with other metadata belongs to another extraction
+        if checkpoint is not None and checkpoint['metadata'] == self.metadata:
+            self.format = checkpoint['format']
+            self.rows = checkpoint['rows']
+            self.batches = checkpoint['batches']
+            self.resume_state = checkpoint['state']
+            # Parts flushed after the checkpoint are written again on resume
+            for name in os.listdir(output_dir):
+                if name.startswith('part-') and int(name[5:10]) >= self.batches:
+                    path = os.path.join(output_dir, name)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+            return
+
+        # Start from an empty dataset so stale parts never mix with new ones
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir)
+
+    def write_row(self, row):
+        """Append one RATE_FIELDS tuple from `mrf_stream.extract_resolved_rows`."""
+        self.store.append_row(row)
+        if len(self.store) >= self.batch_rows:
+            self.flush()
+
+    def write_batch(self, batch: dict):
+        """Append one encoded batch from `mrf_stream.extract_resolved_batches`."""
+        self.store.extend_encoded(batch)
+        if len(self.store) >= self.batch_rows:
+            self.flush()
+
+    def write(self, record: dict):
+        """Append one record dict from `mrf_stream.extract_resolved_rates`."""
+        self.store.append_record(record)
+        if len(self.store) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        store = self.store
+        if not len(store):
+            return
+        part = os.path.join(self.output_dir, f"part-{self.batches:05d}")
+        if self.format == 'parquet':
+            arrays = {}
+            for name in store.names:
+                values = store.column(name)
+                if name in store.dictionaries:
+                    arrays[name] = pa.DictionaryArray.from_arrays(
+                        pa.array(values), pa.array(store.dictionaries[name].values, type=pa.string()))
+                else:
+                    arrays[name] = pa.array(values)
+            pq.write_table(pa.table(arrays), part + '.parquet', compression='zstd')
+        else:
+            os.makedirs(part)
+            for name in store.names:
+                np.save(os.path.join(part, f"{name}.npy"), store.column(name))
+                if name in store.dictionaries:
+                    np.save(os.path.join(part, f"{name}.values.npy"),
+                            np.array(store.dictionaries[name].values, dtype=str))
+
+        self.rows += len(store)
+        self.batches += 1
+        self.store = RateStore()
+
+    def checkpoint(self, state: dict):
+        """
+        Flush, then record the parts written so far with `state`.
+
+        Call it right after a flush (when `batches` went up) to keep part
+        boundaries the same as in an uninterrupted run.
+        """
+        self.flush()
+        path = os.path.join(self.output_dir, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'format': self.format, 'rows': self.rows, 'batches': self.batches,
+                       'metadata': self.metadata, 'state': state}, f)
+        os.replace(path + '.tmp', path)
+
+    def close(self) -> dict:
+        """Flush the last batch and write `_meta.json`. Returns the metadata."""
+        self.flush()
+        meta = {
+            **self.metadata,
+            'format': self.format,
+            'schema': [[name, COLUMN_TYPES[name]] for name in self.store.names],
+            'rows': self.rows,
+            'batches': self.batches,
+        }
+        with open(os.path.join(self.output_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+        if os.path.exists(os.path.join(self.output_dir, CHECKPOINT_FILE)):
+            os.remove(os.path.join(self.output_dir, CHECKPOINT_FILE))
+        return meta
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+
+
+def read_meta(dataset_dir: str) -> dict:
+    with open(os.path.join(dataset_dir, META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def iter_encoded_batches(dataset_dir: str, columns=None):
+    """
+    Yield one batch per stored part without decoding string columns.
+
+    Dictionary columns come back as (int32 codes, values) pairs, the rest as
+    NumPy arrays — the shape `RateStore.extend_encoded` expects.
+    """
+    meta = read_meta(dataset_dir)
+    columns = list(columns or [name for name, _ in meta['schema']])
+    dict_columns = {name for name, kind in meta['schema'] if kind == 'i'}
+    for index in range(meta['batches']):
+        part = os.path.join(dataset_dir, f"part-{index:05d}")
+        batch = {}
+        if meta['format'] == 'parquet':
+            table = pq.read_table(part + '.parquet', columns=columns)
+            for name in columns:
+                column = table.column(name).combine_chunks()
+                if name in dict_columns:
+                    batch[name] = (column.indices.to_numpy(zero_copy_only=False),
+                                   column.dictionary.to_pylist())
+                else:
+                    batch[name] = column.to_numpy()
+        else:
+            for name in columns:
+                values = np.load(os.path.join(part, f"{name}.npy"))
+                if name in dict_columns:
+                    values = (values, np.load(os.path.join(part, f"{name}.values.npy")).tolist())
+                batch[name] = values
+        yield batch
+
+
+def iter_column_batches(dataset_dir: str, columns=None):
+    """Yield one {column: decoded numpy array} dict per stored part."""
+    for batch in iter_encoded_batches(dataset_dir, columns):
+        decoded = {}
+        for name, column in batch.items():
+            if isinstance(column, tuple):
+                codes, values = column
+                column = np.array(values, dtype=object)[codes] if len(codes) else np.empty(0, dtype=object)
+            decoded[name] = column
+        yield decoded
+
+
+def load_rate_store(dataset_dir: str, columns=None) -> RateStore:
+    """Load a dataset (or selected columns) into one compact RateStore."""
+    meta = read_meta(dataset_dir)
+    store = RateStore(columns or [name for name, _ in meta['schema']])
+    for batch in iter_encoded_batches(dataset_dir, store.names):
+        store.extend_encoded(batch)
+    return store
+
+
+def iter_rate_records(dataset_dir: str, columns=None):
+    """Yield stored rates as record dicts in the original extractor format."""
+    for batch in iter_column_batches(dataset_dir, columns):
+        names = list(batch)
+        for values in zip(*(batch[name].tolist() for name in names)):
+            record = dict(zip(names, values))
+            if 'providerNpi' in record:
+                record['providerNpi'] = str(record['providerNpi'])
+            if 'serviceCodes' in record:
+                record['serviceCodes'] = decode_service_codes(record['serviceCodes'])
+            if record.get('providerRef') == '':
+                record['providerRef'] = None
+            yield record
@@ -0,0 +1,317 @@
+"""
+Parallel, ranged, resumable MRF downloader.
+
+Payer MRFs are multi-GB blobs. `download_file` fetches one with HTTP Range
+requests in parallel segments when the server supports them (blob stores
+do), writing each segment in place into `<name>.part`. Progress per segment
+is saved to `<name>.part.json`, so an interrupted download resumes where
+each segment stopped instead of starting over; a failed request is retried
+with backoff from the byte it reached. The file is renamed to its final
+name only after its size (and checksum, when one is known) checks out, so a
+partial download never looks complete. A file that fails those checks is
+discarded along with its progress, so the next run downloads it again.
+
+`download_files` runs several files at once on a thread pool, so onboarding
+a payer's 20+ files is bounded by bandwidth rather than by one request at a
+time.
+
+Usage:
+    results = download_files([(url, 'uhc-ny-choice-plus-medical.json.gz'), ...], OUTPUT_DIR)
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024                   # Bytes per read from the response
+SEGMENT_BYTES = 64 * 1024 * 1024           # Range size per parallel segment
+MAX_SEGMENTS = 8                           # Concurrent ranges per file
+MAX_FILES = 4                              # Concurrent files
+RETRIES = 5
+BACKOFF_SECONDS = 2.0
+TIMEOUT = (10, 60)                         # (connect, read) seconds
+STATE_EVERY_BYTES = 16 * 1024 * 1024       # Save segment progress this often
+
+
+class DownloadError(Exception):
+    pass
+
+
+def probe_remote(url: str, session: requests.Session) -> dict:
+    """
+    Size, range support, ETag, Last-Modified and Content-MD5 of a remote file.
+
+    Asked with HEAD; servers that refuse it (presigned S3/GCS GET URLs answer
+    403, some CDNs 405) are asked with a one-byte ranged GET instead. If that
+    fails too, size and range support are reported unknown, and the file is
+    fetched with a single plain GET.
+    """
+    try:
+        response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException:
+        return _probe_ranged_get(url, session)
+    headers = response.headers
+    size = _int_header(headers.get('Content-Length'))
+    return {
+        'url': response.url,
+        'size': size,
+        'ranges': headers.get('Accept-Ranges', '').lower() == 'bytes' and bool(size),
+        'etag': headers.get('ETag'),
+        'modified': headers.get('Last-Modified'),
+        'md5': headers.get('Content-MD5'),
+    }
+
+
+def _int_header(value):
+    return int(value) if value and value.strip().isdigit() else None
+
+
+def _probe_ranged_get(url: str, session: requests.Session) -> dict:
+    """`probe_remote` from a `Range: bytes=0-0` GET (a 206 answer means ranges work)."""
+    try:
+        with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            headers = response.headers
+            ranged = response.status_code == 206
+            if ranged:
+                # Content-Range: bytes 0-0/<total>
+                size = _int_header(headers.get('Content-Range', '').rpartition('/')[2])
+            else:
+                size = _int_header(headers.get('Content-Length'))
+            return {
+                'url': response.url,
+                'size': size,
+                'ranges': ranged and bool(size),
+                'etag': headers.get('ETag'),
+                'modified': headers.get('Last-Modified'),
+                # Content-MD5 of a 206 covers the one byte, not the file
+                'md5': None if ranged else headers.get('Content-MD5'),
+            }
+    except requests.RequestException:
+        return {'url': url, 'size': None, 'ranges': False, 'etag': None, 'modified': None, 'md5': None}
+
+
+def file_digest(path: str, algorithm: str) -> bytes:
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(8 * CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def verify_file(path: str, size: int = None, md5_b64: str = None, sha256: str = None):
+    """Raise DownloadError unless `path` has the expected size / checksums."""
+    actual = os.path.getsize(path)
+    if size is not None and actual != size:
+        raise DownloadError(f"{os.path.basename(path)}: {actual:,} bytes, expected {size:,}")
+    if md5_b64 and base64.b64encode(file_digest(path, 'md5')).decode() != md5_b64:
+        raise DownloadError(f"{os.path.basename(path)}: Content-MD5 mismatch")
+    if sha256 and file_digest(path, 'sha256').hex() != sha256.lower():
+        raise DownloadError(f"{os.path.basename(path)}: SHA-256 mismatch")
+
+
+class _Segments:
+    """Byte ranges of one download and how far each has got, persisted as JSON."""
+
+    def __init__(self, state_path: str, remote: dict, segment_bytes: int):
+        self.state_path = state_path
+        self.remote = remote
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.saved_at = 0
+        state = None
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        # A partial file of another version of the blob is useless; without an
+        # ETag or Last-Modified there is no telling, so start over
+        if (state and state['size'] == remote['size'] and (remote['etag'] or remote['modified'])
+                and state['etag'] == remote['etag'] and state.get('modified') == remote['modified']):
+            self.segments = state['segments']
+        else:
+            self.reset()
+        self.resumed = self.done()
+
+    def reset(self):
+        size = self.remote['size']
+        self.segments = [[start, min(start + self.segment_bytes, size), 0]
+                         for start in range(0, size, self.segment_bytes)]
+
+    def done(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+    def advance(self, index: int, nbytes: int):
+        with self.lock:
+            self.segments[index][2] += nbytes
+            if self.done() - self.saved_at >= STATE_EVERY_BYTES:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        self.saved_at = self.done()
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'url': self.remote['url'], 'size': self.remote['size'],
+                       'etag': self.remote['etag'], 'modified': self.remote['modified'],
+                       'segments': self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def _fetch_segment(session, url: str, part_path: str, segments: _Segments, index: int,
+                   retries: int, progress):
+    """Download one byte range into its place in the .part file, retrying from where it stopped."""
+    start, end, _ = segments.segments[index]
+    for attempt in range(retries + 1):
+        offset = start + segments.segments[index][2]
+        if offset >= end:
+            return
+        try:
+            headers = {'Range': f"bytes={offset}-{end - 1}"}
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code != 206:
+                    raise DownloadError(f"Range request answered with HTTP {response.status_code}")
+                with open(part_path, 'r+b', buffering=0) as f:
+                    f.seek(offset)
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        chunk = chunk[:end - offset]
+                        f.write(chunk)
+                        offset += len(chunk)
+                        segments.advance(index, len(chunk))
+                        if progress:
+                            progress(len(chunk))
+                        if offset >= end:
+                            break
+            if offset >= end:
+                return
+        except (requests.RequestException, DownloadError) as e:
+            if attempt == retries:
+                raise DownloadError(f"bytes {start}-{end - 1}: {e}") from e
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+    raise DownloadError(f"bytes {start}-{end - 1}: incomplete after {retries + 1} attempts")
+
+
+def _fetch_whole(session, url: str, part_path: str, retries: int, progress) -> int:
+    """Single-stream download for servers without Range support (restarts on failure)."""
+    for attempt in range(retries + 1):
+        written = 0
+        try:
+            with session.get(url, stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                        if progress:
+                            progress(len(chunk))
+            return written
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise DownloadError(str(e)) from e
+            if progress:
+                progress(-written)
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+
+def download_file(url: str, output_path: str, session: requests.Session = None,
+                  segment_bytes: int = SEGMENT_BYTES, max_segments: int = MAX_SEGMENTS,
+                  retries: int = RETRIES, sha256: str = None, progress=None) -> dict:
+    """
+    Download `url` to `output_path` (see module docstring). Returns a summary dict.
+
+    An existing `output_path` is kept as is. `sha256` is checked when given;
+    the server's Content-MD5 is checked when it sends one. `progress(nbytes)`
+    is called as bytes arrive (from several threads).
+    """
+    if os.path.exists(output_path):
+        return {'path': output_path, 'bytes': os.path.getsize(output_path), 'skipped': True}
+    session = session or requests.Session()
+    part_path = output_path + '.part'
+    state_path = part_path + '.json'
+    start_time = time.time()
+    remote = probe_remote(url, session)
+
+    if remote['ranges']:
+        segments = _Segments(state_path, remote, segment_bytes)
+        if not segments.resumed or not os.path.exists(part_path):
+            segments.reset()
+            segments.resumed = 0
+            with open(part_path, 'wb') as f:
+                f.truncate(remote['size'])
+        segments.save()
+        if progress and segments.resumed:
+            progress(segments.resumed)
+        pending = [i for i, (start, end, done) in enumerate(segments.segments) if start + done < end]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_segments, len(pending)))) as pool:
+            futures = [pool.submit(_fetch_segment, session, remote['url'], part_path, segments, i,
+                                   retries, progress) for i in pending]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            finally:
+                segments.save()
+        resumed = segments.resumed
+    else:
+        _fetch_whole(session, remote['url'], part_path, retries, progress)
+        resumed = 0
+
+    try:
+        verify_file(part_path, remote['size'], remote['md5'], sha256)
+    except DownloadError as e:
+        # Resuming would only re-verify the same bad bytes: start over next time
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise DownloadError(f"{e} (partial download discarded)") from e
+    os.replace(part_path, output_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    seconds = time.time() - start_time
+    size = os.path.getsize(output_path)
+    return {
+        'path': output_path,
+        'bytes': size,
+        'resumedBytes': resumed,
+        'seconds': round(seconds, 2),
+        'MBps': round((size - resumed) / seconds / (1024 * 1024), 2) if seconds else None,
+        'ranged': remote['ranges'],
+        'checked': [name for name, value in (('size', remote['size']), ('md5', remote['md5']),
+                                             ('sha256', sha256)) if value],
+    }
+
+
+def download_files(files, output_dir: str, max_files: int = MAX_FILES, progress=None, **kwargs) -> list:
+    """
+    Download `(url, name)` pairs into `output_dir`, `max_files` at a time.
+
+    Returns one summary per file, in input order; failures carry an 'error'
+    instead of raising, and 'partialKept' tells whether a resumable `.part`
+    was left behind (one that failed verification is deleted).
+    `progress(name, nbytes)` is called as bytes arrive.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_files * kwargs.get('max_segments', MAX_SEGMENTS))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    def run(url, name):
+        file_progress = (lambda nbytes: progress(name, nbytes)) if progress else None
+        try:
+            return {'name': name, **download_file(url, os.path.join(output_dir, name), session,
+                                                  progress=file_progress, **kwargs)}
+        except (requests.RequestException, DownloadError, OSError) as e:
+            return {'name': name, 'error': str(e),
+                    'partialKept': os.path.exists(os.path.join(output_dir, name) + '.part')}
+
+    with ThreadPoolExecutor(max_workers=max_files) as pool:
+        return list(pool.map(lambda pair: run(*pair), files))
@@ -0,0 +1,366 @@
+"""
+Incremental re-aggregation for monthly MRF refreshes.
+
+MRFs are republished every month and most of their rates do not change. A
+refresh with this module keeps, per (source stream, plan), the state of the
+previous run and only redoes the work for what changed:
+
+    - every target in_network item is fingerprinted (BLAKE2 of its JSON) and
+      keyed by billing code type, billing code and occurrence;
+    - items whose fingerprint is new, or whose provider references now map
+      to different NPIs, are resolved again; unchanged items are not;
+    - per-key price runs (the resolved (item, npi, price) rows) of removed
+      and changed items are replaced, and priceStats are recomputed only for
+      the (CPT, NPI) keys those rows touch;
+    - aggregated_rates_75.json is updated in place as a delta: untouched
+      records keep their stats and aggregatedAt.
+
+The new file still has to be read once to fingerprint it (the events reader
+skips non-target items at the parser level), but resolution, fan-out,
+aggregation and output scale with the changed items. Stats of updated keys
+are exact: each key is recomputed from all of its price rows with
+`group_prices`, so a refresh produces the same priceStats as a full run.
+
+State directory:
+
+    <state_dir>/
+    ├── state.json          plan, item fingerprints, digests of the references they use
+    ├── raw_rows.jsonl      raw rate rows per item (re-resolved when only a reference changed)
+    └── rows.npz            resolved price rows: item code, NPI, price
+
+Usage:
+    python mrf_incremental.py <state_dir> <output_json> <plan_slug>=<mrf_path> [data_source]
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from mrf_aggregate import group_prices, iter_price_stats
+from mrf_io import open_mrf
+from mrf_refs import ProviderRefIndex, RefIndexCache
+from mrf_stream import (BILLING_CODE_TYPES, READ_CHUNK_SIZE, SECTION_READERS, add_provider_reference,
+                        get_ijson_backend, iter_raw_rates, new_stats, resolve_batches)
+
+STATE_FILE = 'state.json'
+RAW_ROWS_FILE = 'raw_rows.jsonl'
+ROWS_FILE = 'rows.npz'
+
+
+def item_fingerprint(item: dict) -> str:
+    """Content hash of one in_network item (key order independent)."""
+    data = json.dumps(item, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def _item_refs(rows) -> set:
+    return {ref_id for row in rows for ref_id in row[1]}
+
+
+class IncrementalState:
+    """Fingerprints, raw rows and resolved price rows of the previous run."""
+
+    def __init__(self, plan_slug: str = None):
+        self.plan_slug = plan_slug
+        self.fingerprints = {}      # item key -> fingerprint
+        self.ref_digests = {}       # provider reference id -> ProviderRefIndex.digest
+        self.raw_rows = {}          # item key -> raw rate rows (see mrf_stream.iter_raw_rates)
+        self.item_keys = []         # item code -> item key
+        self.item_codes = np.empty(0, dtype=np.int32)
+        self.npis = np.empty(0, dtype=np.int64)
+        self.prices = np.empty(0, dtype=np.float64)
+
+    @classmethod
+    def load(cls, state_dir: str) -> 'IncrementalState':
+        """State saved in `state_dir`, or an empty state if there is none."""
+        state = cls()
+        state_file = os.path.join(state_dir, STATE_FILE)
+        if not os.path.exists(state_file):
+            return state
+        with open(state_file, 'r') as f:
+            meta = json.load(f)
+        state.plan_slug = meta['planSlug']
+        state.fingerprints = meta['fingerprints']
+        state.ref_digests = meta['refDigests']
+        state.item_keys = meta['itemKeys']
+        with open(os.path.join(state_dir, RAW_ROWS_FILE), 'r') as f:
+            for line in f:
+                key, rows = json.loads(line)
+                state.raw_rows[key] = rows
+        arrays = np.load(os.path.join(state_dir, ROWS_FILE))
+        state.item_codes, state.npis, state.prices = arrays['item_codes'], arrays['npis'], arrays['prices']
+        return state
+
+    def save(self, state_dir: str):
+        """Write the state to `state_dir`; the directory is replaced as a whole."""
+        tmp_dir = f"{state_dir}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, RAW_ROWS_FILE), 'w') as f:
+            for key, rows in self.raw_rows.items():
+                f.write(json.dumps([key, rows], separators=(',', ':')) + '\n')
+        np.savez(os.path.join(tmp_dir, ROWS_FILE), item_codes=self.item_codes, npis=self.npis,
+                 prices=self.prices)
+        with open(os.path.join(tmp_dir, STATE_FILE), 'w') as f:
+            json.dump({
+                'planSlug': self.plan_slug,
+                'savedAt': datetime.now().isoformat(timespec='seconds'),
+                'fingerprints': self.fingerprints,
+                'refDigests': self.ref_digests,
+                'itemKeys': self.item_keys,
+            }, f, separators=(',', ':'))
+        if os.path.exists(state_dir):
+            shutil.rmtree(state_dir)
+        os.replace(tmp_dir, state_dir)
+
+
+def scan_items(source, state: IncrementalState, target_cpts=None, stats: dict = None,
+               billing_code_types=BILLING_CODE_TYPES, chunk_size: int = READ_CHUNK_SIZE,
+               mode: str = 'events', backend: str = None, decompress: str = 'inline',
+               refs_cache: RefIndexCache = None):
+    """
+    Read an MRF once; fingerprint its target items against `state`.
+
+    Returns (fingerprints, changed, refs): the fingerprint of every target
+    item by key, the raw rows of items whose fingerprint is not in `state`,
+    and the file's provider reference index.
+    """
+    stats = new_stats() if stats is None else stats
+    parser_backend = get_ijson_backend(backend)
+    refs = refs_cache.get(source) if refs_cache is not None and isinstance(source, str) else None
+    prebuilt = refs is not None
+    if prebuilt:
+        stats['providerReferences'] = len(refs)
+        stats['refsCached'] = True
+    else:
+        refs = ProviderRefIndex()
+
+    fingerprints = {}
+    changed = {}
+    occurrences = {}
+    f = open_mrf(source, decompress) if isinstance(source, str) else source
+    try:
+        sections = SECTION_READERS[mode](
+            f, parser_backend, chunk_size=chunk_size, target_cpts=target_cpts,
+            billing_code_types=billing_code_types, skip_refs=prebuilt)
+        for section, item in sections:
+            if section == 'ref':
+                add_provider_reference(refs, item, stats['providerReferences'], stats)
+                stats['providerReferences'] += 1
+                continue
+            if section == 'order':
+                continue
+
+            code_type = item.get('billing_code_type', '')
+            if code_type not in billing_code_types:
+                continue
+            stats['codesScanned'] += 1
+            billing_code = str(item.get('billing_code', ''))
+            if target_cpts and billing_code not in target_cpts:
+                continue
+            stats['targetCodesFound'] += 1
+
+            # Items repeat per billing code (one per negotiation arrangement)
+            base = f"{code_type}|{billing_code}"
+            occurrence = occurrences[base] = occurrences.get(base, -1) + 1
+            key = f"{base}|{occurrence}"
+            fingerprint = fingerprints[key] = item_fingerprint(item)
+            if state.fingerprints.get(key) != fingerprint:
+                changed[key] = list(iter_raw_rates(item, stats=stats))
+    finally:
+        if isinstance(source, str):
+            f.close()
+
+    if refs_cache is not None and not prebuilt and isinstance(source, str):
+        refs_cache.put(source, refs)
+    return fingerprints, changed, refs
+
+
+def resolve_items(changed: dict, refs: ProviderRefIndex, stats: dict):
+    """
+    Yield (item keys, npis, prices) per resolved batch of the changed items' rows.
+
+    Each raw row's billing code is swapped for its item key, so the batch's
+    procedureCpt column says which item every fanned-out price came from.
+    Non-positive prices are dropped.
+    """
+    rows = ((key,) + tuple(row[1:]) for key, item_rows in changed.items() for row in item_rows)
+    for batch in resolve_batches(rows, refs, stats):
+        codes, keys = batch['procedureCpt']
+        keep = batch['negotiatedRate'] > 0
+        yield np.array(keys, dtype=object)[codes[keep]], batch['providerNpi'][keep], batch['negotiatedRate'][keep]
+
+
+def _item_cpt(key: str) -> str:
+    return key.split('|')[1]
+
+
+def apply_delta(records: list, plan_slug: str, stats_by_key: dict, removed_keys: set,
+                aggregated_at: str, data_source: str) -> list:
+    """
+    Update aggregated records in place for one plan.
+
+    `stats_by_key` maps (cpt, npi) to new priceStats; `removed_keys` are keys
+    with no prices left. Other plans' records and untouched keys are kept
+    as they are. Output stays sorted by CPT.
+    """
+    pending = dict(stats_by_key)
+    updated = []
+    for record in records:
+        key = (record['procedureCpt'], record['providerNpi'])
+        if record['planSlug'] == plan_slug:
+            if key in removed_keys:
+                continue
+            if key in pending:
+                record = {**record, 'priceStats': pending.pop(key), 'aggregatedAt': aggregated_at,
+                          'dataSource': data_source}
+        updated.append(record)
+    for (cpt, npi), price_stats in pending.items():
+        updated.append({
+            "procedureCpt": cpt,
+            "providerNpi": npi,
+            "planSlug": plan_slug,
+            "priceStats": price_stats,
+            "aggregatedAt": aggregated_at,
+            "dataSource": data_source
+        })
+    updated.sort(key=lambda record: record['procedureCpt'])
+    return updated
+
+
+def refresh_aggregates(source: str, plan_slug: str, state_dir: str, output_path: str,
+                       data_source: str, target_cpts=None, **scan_kwargs) -> dict:
+    """
+    Bring `output_path` up to date with a new release of one plan's MRF.
+
+    Only items that changed since the run recorded in `state_dir` are
+    resolved, and only their (CPT, NPI) keys get new stats (see the module
+    docstring). The first run, with no state, aggregates everything.
+    Returns a summary of what changed.
+    """
+    state = IncrementalState.load(state_dir)
+    if state.plan_slug not in (None, plan_slug):
+        raise ValueError(f"State in {state_dir} belongs to plan {state.plan_slug!r}, not {plan_slug!r}")
+    stats = new_stats()
+    fingerprints, changed, refs = scan_items(source, state, target_cpts, stats, **scan_kwargs)
+
+    # Unchanged items still need new rows if a reference they use now
+    # resolves to different providers
+    digests = {}
+
+    def digest(ref_id):
+        if ref_id not in digests:
+            digests[ref_id] = refs.digest(ref_id)
+        return digests[ref_id]
+
+    ref_changed = 0
+    for key in fingerprints:
+        if key in changed:
+            continue
+        rows = state.raw_rows[key]
+        if any(digest(ref_id) != state.ref_digests.get(ref_id) for ref_id in _item_refs(rows)):
+            changed[key] = rows
+            ref_changed += 1
+    removed = set(state.fingerprints) - set(fingerprints)
+
+    # Drop the price rows of removed and changed items, resolve the changed ones
+    item_codes = {key: code for code, key in enumerate(state.item_keys)}
+    stale = np.array(sorted(item_codes[key] for key in removed | set(changed) if key in item_codes),
+                     dtype=np.int32)
+    drop = np.isin(state.item_codes, stale)
+    old_cpts = np.array([_item_cpt(key) for key in state.item_keys], dtype=object)
+    touched = set(zip(old_cpts[state.item_codes[drop]].tolist(), state.npis[drop].tolist())) \
+        if drop.any() else set()
+
+    keys = [key for key in state.item_keys if key not in removed]
+    item_codes = {key: code for code, key in enumerate(keys)}
+    remap = np.array([item_codes.get(key, -1) for key in state.item_keys], dtype=np.int32)
+    parts_items = [remap[state.item_codes[~drop]]]
+    parts_npis = [state.npis[~drop]]
+    parts_prices = [state.prices[~drop]]
+    for key in changed:
+        if key not in item_codes:
+            item_codes[key] = len(keys)
+            keys.append(key)
+    for batch_keys, npis, prices in resolve_items(changed, refs, stats):
+        codes = np.fromiter((item_codes[key] for key in batch_keys.tolist()), dtype=np.int32,
+                            count=len(batch_keys))
+        parts_items.append(codes)
+        parts_npis.append(npis)
+        parts_prices.append(prices)
+        touched.update(zip((_item_cpt(key) for key in batch_keys.tolist()), npis.tolist()))
+
+    state.item_keys = keys
+    state.item_codes = np.concatenate(parts_items).astype(np.int32)
+    state.npis = np.concatenate(parts_npis).astype(np.int64)
+    state.prices = np.concatenate(parts_prices).astype(np.float64)
+
+    # Recompute stats for the touched (CPT, NPI) keys from all their rows
+    row_cpts = np.array([_item_cpt(key) for key in keys], dtype=object)[state.item_codes] \
+        if len(keys) else np.empty(0, dtype=object)
+    touched_npis = np.array(sorted({npi for _, npi in touched}), dtype=np.int64)
+    candidate = np.flatnonzero(np.isin(state.npis, touched_npis))
+    in_touched = np.fromiter(((cpt, npi) in touched for cpt, npi in
+                              zip(row_cpts[candidate].tolist(), state.npis[candidate].tolist())),
+                             dtype=bool, count=len(candidate))
+    rows = candidate[in_touched]
+    cpts, npis = row_cpts[rows], state.npis[rows]
+    groups = group_prices([cpts, npis], state.prices[rows], positive_only=False)
+    stats_by_key = {(cpts[row], str(npis[row])): price_stats for row, price_stats in iter_price_stats(groups)}
+    removed_keys = {(cpt, str(npi)) for cpt, npi in touched} - set(stats_by_key)
+
+    records = []
+    if os.path.exists(output_path):
+        with open(output_path, 'r') as f:
+            records = json.load(f)
+    previous = len(records)
+    aggregated_at = datetime.now().strftime("%Y-%m-%d")
+    records = apply_delta(records, plan_slug, stats_by_key, removed_keys, aggregated_at, data_source)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(records, f, separators=(',', ':'))
+    os.replace(tmp_path, output_path)
+
+    state.plan_slug = plan_slug
+    state.fingerprints = fingerprints
+    for key, rows in changed.items():
+        state.raw_rows[key] = rows
+    for key in removed:
+        state.raw_rows.pop(key, None)
+    state.ref_digests = {ref_id: digest(ref_id)
+                         for rows in state.raw_rows.values() for ref_id in _item_refs(rows)}
+    state.save(state_dir)
+
+    return {
+        'sourceFile': source,
+        'planSlug': plan_slug,
+        'items': len(fingerprints),
+        'itemsChanged': len(changed) - ref_changed,
+        'itemsRefChanged': ref_changed,
+        'itemsRemoved': len(removed),
+        'itemsUnchanged': len(fingerprints) - len(changed),
+        'keysUpdated': len(stats_by_key),
+        'keysRemoved': len(removed_keys),
+        'records': len(records),
+        'previousRecords': previous,
+        'rateRecordsResolved': stats['rateRecords'],
+        'unresolvedRefs': stats['unresolvedRefs'],
+        'providerReferences': stats['providerReferences'],
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python mrf_incremental.py <state_dir> <output_json> <plan_slug>=<mrf_path> [data_source]")
+        sys.exit(1)
+
+    plan, path = sys.argv[3].split('=', 1)
+    summary = refresh_aggregates(path, plan, sys.argv[1], sys.argv[2],
+                                 sys.argv[4] if len(sys.argv) > 4 else 'cms-mrf')
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,285 @@
+"""
+Table-of-contents driven MRF ingestion across payers.
+
+Every payer publishes a CMS table-of-contents (index) file that lists its
+reporting plans and the in-network rate files covering each one. Thousands
+of plans typically point at the same handful of network files, so this
+module works per unique file rather than per plan:
+
+    - `discover_files` streams the TOC into one entry per in-network file
+      URL, carrying every plan that references it (so which plan a 7 GB
+      file belongs to is known up front);
+    - `run_ingestion` schedules each file through download (thread pool,
+      mrf_download.py) and extraction (process pool, mrf_parallel.py), each
+      file moving to extraction as soon as its download finishes;
+    - a manifest keyed by URL (`ingest_manifest.json`) records each file's
+      stage, so a file shared by many plans, or finished by an earlier run,
+      is downloaded and extracted once;
+    - aggregation runs per plan over the shards of that plan's files. Plans
+      covered by exactly the same files are aggregated once and the records
+      copied to each.
+
+Work directory:
+
+    <work_dir>/
+    ├── ingest_manifest.json     url -> name, plans, stage, shard, stats
+    ├── downloads/<name>         downloaded MRFs
+    ├── shards/<name>/           columnar rates per file (+ .stats.json)
+    └── aggregated_rates.json    priceStats per (CPT, NPI, plan)
+
+Usage:
+    python mrf_ingest.py <work_dir> <toc_path_or_url> [data_source]
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+
+from mrf_aggregate import aggregate_shards
+from mrf_download import MAX_SEGMENTS, download_file
+from mrf_io import open_mrf
+from mrf_parallel import extract_to_shard, shard_name
+from mrf_refs import MAX_CACHE_ENTRIES
+from mrf_sketch import DEFAULT_K, sketch_metadata
+from mrf_stream import get_ijson_backend
+
+MANIFEST_FILE = 'ingest_manifest.json'
+MAX_DOWNLOADS = 4                      # Files downloading at once
+
+
+def plan_slug(plan: dict) -> str:
+    """Stable slug for a TOC reporting plan: its name plus its id."""
+    text = f"{plan.get('plan_name', '')} {plan.get('plan_id', '')}".lower()
+    return re.sub(r'[^a-z0-9]+', '-', text).strip('-')
+
+
+def iter_reporting_structures(source: str, backend: str = None):
+    """Stream the `reporting_structure` entries of a TOC file (path or URL, gzipped or not)."""
+    parser = get_ijson_backend(backend)
+    with open_mrf(source, 'thread') as f:
+        yield from parser.items(f, 'reporting_structure.item')
+
+
+def discover_files(source: str, include=None) -> list:
+    """
+    Unique in-network files of a TOC, in first-seen order.
+
+    Each entry is {'url', 'description', 'plans'}, where `plans` holds every
+    reporting plan (slug, name, id, id type, market type) that lists the
+    file. `include(plan, file)` (raw TOC dicts) can drop plan/file pairs,
+    e.g. to keep one market type; files left without plans are dropped.
+    """
+    files = {}
+    for structure in iter_reporting_structures(source):
+        plans = [{
+            'planSlug': plan_slug(plan),
+            'planName': plan.get('plan_name'),
+            'planId': plan.get('plan_id'),
+            'planIdType': plan.get('plan_id_type'),
+            'planMarketType': plan.get('plan_market_type'),
+        } for plan in structure.get('reporting_plans', [])]
+        for in_network in structure.get('in_network_files', []):
+            url = in_network.get('location')
+            if not url:
+                continue
+            kept = [p for p, raw in zip(plans, structure.get('reporting_plans', []))
+                    if include is None or include(raw, in_network)]
+            if not kept:
+                continue
+            entry = files.setdefault(url, {'url': url, 'description': in_network.get('description'),
+                                           'plans': []})
+            seen = {p['planSlug'] for p in entry['plans']}
+            entry['plans'].extend(p for p in kept if p['planSlug'] not in seen)
+    return list(files.values())
+
+
+def load_manifest(work_dir: str) -> dict:
+    path = os.path.join(work_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(work_dir: str, manifest: dict):
+    path = os.path.join(work_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def file_name(url: str, taken: set) -> str:
+    """Local file name for `url`: its basename, prefixed with a URL hash if already taken."""
+    name = os.path.basename(urlparse(url).path) or 'mrf.json.gz'
+    if name in taken:
+        name = f"{hashlib.sha1(url.encode()).hexdigest()[:8]}-{name}"
+    return name
+
+
+def _register(manifest: dict, files: list):
+    """Add newly discovered files to the manifest and refresh the plans of known ones."""
+    taken = {entry['name'] for entry in manifest.values()}
+    for file in files:
+        entry = manifest.get(file['url'])
+        if entry is None:
+            name = file_name(file['url'], taken)
+            taken.add(name)
+            entry = manifest[file['url']] = {'name': name, 'stage': 'discovered'}
+        entry['description'] = file['description']
+        entry['plans'] = file['plans']
+
+
+def aggregate_plans(entries: list, data_source: str, target_cpts=None,
+                    stats_mode: str = 'exact', sketch_k: int = DEFAULT_K) -> list:
+    """
+    Aggregated records for every plan of the extracted manifest `entries`.
+
+    A plan's rates are those of all the files that list it. Plans with the
+    same set of files share one aggregation.
+    """
+    shards_by_plan = {}
+    for entry in entries:
+        for plan in entry['plans']:
+            shards_by_plan.setdefault(plan['planSlug'], set()).add(entry['shardFile'])
+    plans_by_shards = {}
+    for slug, shards in shards_by_plan.items():
+        plans_by_shards.setdefault(frozenset(shards), []).append(slug)
+
+    aggregated = []
+    for shards, slugs in plans_by_shards.items():
+        slugs.sort()
+        records = aggregate_shards(sorted(shards), data_source, target_cpts, stats_mode, sketch_k,
+                                   plan_slug=slugs[0])
+        for slug in slugs:
+            aggregated.extend(dict(record, planSlug=slug) for record in records)
+    return sorted(aggregated, key=lambda record: record['procedureCpt'])
+
+
+def run_ingestion(toc_source: str, work_dir: str, target_cpts=None, data_source: str = 'cms-mrf',
+                  include=None, max_downloads: int = MAX_DOWNLOADS, max_workers: int = None,
+                  mode: str = 'events', refs_cache_dir: str = None, stats_mode: str = 'exact',
+                  sketch_k: int = DEFAULT_K, keep_downloads: bool = True) -> dict:
+    """
+    Discover, download, extract and aggregate every in-network file of a TOC.
+
+    Downloads run `max_downloads` at a time on threads, extractions
+    `max_workers` at a time in processes, and a file is handed to extraction
+    the moment its download completes. Files already extracted (per the
+    manifest) are skipped; failed ones are reported, left out of the
+    aggregation and retried on the next run (downloads resume from their
+    `.part`). With `keep_downloads=False` a raw MRF is deleted once its
+    shard is written. Returns a summary dict.
+    """
+    download_dir = os.path.join(work_dir, 'downloads')
+    shard_dir = os.path.join(work_dir, 'shards')
+    os.makedirs(download_dir, exist_ok=True)
+    os.makedirs(shard_dir, exist_ok=True)
+    start = time.time()
+
+    print(f"📑 Reading table of contents: {toc_source}")
+    files = discover_files(toc_source, include)
+    plan_refs = sum(len(file['plans']) for file in files)
+    print(f"   {len(files):,} unique in-network files for "
+          f"{len({p['planSlug'] for file in files for p in file['plans']}):,} plans "
+          f"({plan_refs:,} plan/file references)")
+
+    manifest = load_manifest(work_dir)
+    _register(manifest, files)
+    save_manifest(work_dir, manifest)
+    entries = [manifest[file['url']] for file in files]
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_downloads * MAX_SEGMENTS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    cached = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_downloads) as downloads, \
+            ProcessPoolExecutor(max_workers=max_workers) as workers:
+        running = {}
+
+        def extract(url, entry):
+            future = workers.submit(extract_to_shard, entry['path'], shard_name(entry['path']), shard_dir,
+                                    target_cpts, mode, refs_cache_dir, max(MAX_CACHE_ENTRIES, len(files)))
+            running[future] = ('extract', url)
+
+        for file in files:
+            url, entry = file['url'], manifest[file['url']]
+            if entry['stage'] == 'extracted' and os.path.exists(entry.get('shardFile', '')):
+                cached += 1
+            elif entry['stage'] == 'downloaded' and os.path.exists(entry.get('path', '')):
+                extract(url, entry)
+            else:
+                path = os.path.join(download_dir, entry['name'])
+                running[downloads.submit(download_file, url, path, session)] = ('download', url)
+        if cached:
+            print(f"   ♻️  {cached:,} files already extracted by an earlier run")
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, url = running.pop(future)
+                entry = manifest[url]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    entry.update({'stage': 'failed', 'error': f"{stage}: {e}"})
+                    failed.append({'url': url, 'name': entry['name'], 'error': entry['error']})
+                    print(f"  ❌ {entry['name']}: {entry['error']}")
+                    save_manifest(work_dir, manifest)
+                    continue
+                entry.pop('error', None)
+                if stage == 'download':
+                    entry.update({'stage': 'downloaded', 'path': result['path'], 'bytes': result['bytes']})
+                    print(f"  📥 {entry['name']}: {result['bytes'] / (1024 * 1024):,.1f} MB")
+                    extract(url, entry)
+                else:
+                    entry.update({'stage': 'extracted', 'shardFile': result['shardFile'],
+                                  'rateRecords': result['rateRecords'], 'extractSeconds': result['seconds']})
+                    print(f"  ✓ {entry['name']}: {result['rateRecords']:,} records "
+                          f"in {result['seconds']:.1f}s ({len(entry['plans']):,} plans)")
+                    if not keep_downloads and os.path.exists(entry['path']):
+                        os.remove(entry['path'])
+                save_manifest(work_dir, manifest)
+
+    extracted = [entry for entry in entries if entry['stage'] == 'extracted']
+    print(f"\n🔄 Aggregating {len(extracted):,} files...")
+    aggregated = aggregate_plans(extracted, data_source, target_cpts, stats_mode, sketch_k)
+    output_path = os.path.join(work_dir, 'aggregated_rates.json')
+    with open(output_path, 'w') as f:
+        json.dump(aggregated, f, separators=(',', ':'))
+    if stats_mode == 'sketch':
+        with open(os.path.join(work_dir, 'aggregated_rates.meta.json'), 'w') as f:
+            json.dump(sketch_metadata(sketch_k), f, indent=2)
+    print(f"✅ {len(aggregated):,} aggregated records → {output_path}")
+
+    return {
+        'files': len(files),
+        'planFileReferences': plan_refs,
+        'extracted': len(extracted),
+        'cached': cached,
+        'failed': failed,
+        'aggregatedRecords': len(aggregated),
+        'outputFile': output_path,
+        'seconds': round(time.time() - start, 2),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python mrf_ingest.py <work_dir> <toc_path_or_url> [data_source]")
+        sys.exit(1)
+
+    summary = run_ingestion(sys.argv[2], sys.argv[1],
+                            data_source=sys.argv[3] if len(sys.argv) > 3 else 'cms-mrf')
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary['failed'] else 0)
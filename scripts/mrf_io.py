@@ -0,0 +1,314 @@
+"""
+MRF input streams with pipelined gzip decompression.
+
+`gzip.open` + ijson runs decompression and parsing on the same core. The
+readers here move decompression to its own stage so one file can use two
+cores:
+
+    - inline:   plain gzip.open (single core, the original behaviour)
+    - thread:   a decompressor thread feeds a bounded queue of raw byte chunks
+                to the parser (zlib releases the GIL while inflating)
+    - external: an external `pigz -dc` / `gzip -dc` process, read via a pipe;
+                falls back to `thread` when neither tool is installed
+
+An http(s) URL is streamed straight from the response (`HttpGzipReader`):
+the download and inflate run on the background thread while the parser
+consumes, so extraction overlaps the download instead of following it, and
+the compressed bytes can be teed to disk as the archive copy.
+
+Every reader exposes `stage_stats()` with per-stage throughput and wait
+times so the bottleneck stage is visible: the stage that waits least is the
+one limiting the pipeline.
+"""
+
+import gzip
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import zlib
+
+DECOMPRESS_MODES = ('inline', 'thread', 'external')
+COMPRESSED_READ_SIZE = 256 * 1024      # Bytes of gzip read per inflate call
+QUEUE_CHUNKS = 32                      # Decompressed chunks buffered between stages
+EXTERNAL_GUNZIP = ('pigz', 'gzip')
+HTTP_TIMEOUT = (10, 300)               # (connect, read) seconds for streamed URLs
+
+
+def is_url(source) -> bool:
+    return isinstance(source, str) and source.startswith(('http://', 'https://'))
+
+
+def open_mrf(path: str, decompress: str = 'inline', tee_path: str = None):
+    """
+    Open an MRF for binary streaming.
+
+    Plain `.json` files are opened directly; `.gz` files use the requested
+    decompression mode (see module docstring). An http(s) URL is streamed
+    from the response, with its compressed bytes also written to `tee_path`
+    when given.
+    """
+    if decompress not in DECOMPRESS_MODES:
+        raise ValueError(f"Unknown decompress mode {decompress!r}; expected one of {DECOMPRESS_MODES}")
+    if is_url(path):
+        return HttpGzipReader(path, tee_path=tee_path)
+    if not path.endswith('.gz'):
+        return open(path, 'rb')
+    if decompress == 'external' and find_external_gunzip():
+        return ExternalGunzipReader(path)
+    if decompress in ('thread', 'external'):
+        return ThreadedGzipReader(path)
+    return gzip.open(path, 'rb')
+
+
+def find_external_gunzip():
+    """Path of the first available external gunzip tool, or None."""
+    for tool in EXTERNAL_GUNZIP:
+        found = shutil.which(tool)
+        if found:
+            return found
+    return None
+
+
+def _mb_per_sec(num_bytes: int, seconds: float) -> float:
+    return round(num_bytes / (1024 * 1024) / seconds, 2) if seconds > 0 else 0.0
+
+
+class ThreadedGzipReader:
+    """
+    File-like reader whose gzip inflate runs on a background thread.
+
+    The decompressor thread pushes decompressed chunks into a bounded queue;
+    `read()` pulls from it. Handles multi-member gzip files.
+    """
+
+    def __init__(self, path: str, read_size: int = COMPRESSED_READ_SIZE,
+                 queue_chunks: int = QUEUE_CHUNKS, tee_path: str = None, gzipped: bool = True):
+        self.path = path
+        self.tee_path = tee_path
+        self.gzipped = gzipped
+        self.read_size = read_size
+        self.queue = queue.Queue(maxsize=queue_chunks)
+        self.pending = b''
+        self.pending_pos = 0              # Bytes of `pending` already returned
+        self.eof = False
+        self.closed = False
+        self.error = None
+
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.decompress_seconds = 0.0
+        self.producer_wait = 0.0          # Decompressor blocked on a full queue
+        self.consumer_wait = 0.0          # Parser blocked on an empty queue
+        self.started = time.perf_counter()
+        self.finished = None
+
+        self.thread = threading.Thread(target=self._run, name='mrf-gunzip', daemon=True)
+        self.thread.start()
+
+    def _put(self, chunk):
+        start = time.perf_counter()
+        while not self.closed:
+            try:
+                self.queue.put(chunk, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.producer_wait += time.perf_counter() - start
+
+    def _open_raw(self):
+        return open(self.path, 'rb')
+
+    def _run(self):
+        tee = open(self.tee_path + '.part', 'wb') if self.tee_path else None
+        try:
+            with self._open_raw() as raw:
+                inflater = zlib.decompressobj(wbits=31)
+                while not self.closed:
+                    start = time.perf_counter()
+                    data = raw.read(self.read_size)
+                    if not data:
+                        break
+                    self.compressed_bytes += len(data)
+                    if tee is not None:
+                        tee.write(data)
+                    if not self.gzipped:
+                        out = data
+                    else:
+                        out = inflater.decompress(data)
+                        # Concatenated gzip members: restart on the leftover bytes
+                        while inflater.eof and inflater.unused_data:
+                            data = inflater.unused_data
+                            inflater = zlib.decompressobj(wbits=31)
+                            out += inflater.decompress(data)
+                    self.decompress_seconds += time.perf_counter() - start
+                    if out:
+                        self.decompressed_bytes += len(out)
+                        self._put(out)
+                if not self.closed and self.gzipped and not inflater.eof:
+                    raise EOFError(f"Compressed file ended before the end-of-stream marker: {self.path}")
+            if tee is not None and not self.closed:
+                # The archive copy gets its final name only once complete
+                tee.close()
+                os.replace(self.tee_path + '.part', self.tee_path)
+        except BaseException as e:
+            self.error = e
+        finally:
+            if tee is not None:
+                tee.close()
+            self.finished = time.perf_counter()
+            self._put(None)
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b''
+        if size is None or size < 0:
+            chunks = [self.pending[self.pending_pos:]]
+            self.pending, self.pending_pos = b'', 0
+            while True:
+                chunk = self._next_chunk()
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if self.pending_pos >= len(self.pending):
+            self.pending, self.pending_pos = self._next_chunk(), 0
+        # Advance an offset rather than re-slicing the rest of a multi-MB chunk per read
+        start = self.pending_pos
+        self.pending_pos = min(start + size, len(self.pending))
+        if start == 0 and self.pending_pos == len(self.pending):
+            return self.pending
+        return self.pending[start:self.pending_pos]
+
+    def _next_chunk(self) -> bytes:
+        if self.eof:
+            return b''
+        start = time.perf_counter()
+        chunk = self.queue.get()
+        self.consumer_wait += time.perf_counter() - start
+        if chunk is None:
+            self.eof = True
+            if self.error is not None:
+                raise self.error
+            return b''
+        return chunk
+
+    def stage_stats(self) -> dict:
+        wall = time.perf_counter() - self.started
+        parse_busy = max(wall - self.consumer_wait, 0.0)
+        return {
+            'decompressMode': 'thread',
+            'compressedBytes': self.compressed_bytes,
+            'decompressedBytes': self.decompressed_bytes,
+            'wallSeconds': round(wall, 3),
+            'decompressSeconds': round(self.decompress_seconds, 3),
+            'decompressMBps': _mb_per_sec(self.decompressed_bytes, self.decompress_seconds),
+            'decompressorWaitSeconds': round(self.producer_wait, 3),
+            'parserWaitSeconds': round(self.consumer_wait, 3),
+            'parseMBps': _mb_per_sec(self.decompressed_bytes, parse_busy),
+        }
+
+    def close(self):
+        self.closed = True
+        # Unblock the producer if it is waiting on a full queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.thread.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HttpGzipReader(ThreadedGzipReader):
+    """
+    ThreadedGzipReader over an HTTP response instead of a local file.
+
+    The background thread downloads and inflates while the parser reads, so
+    total time is about max(download, parse) rather than their sum. URLs
+    not ending in `.gz` are passed through undecompressed. With `tee_path`
+    the compressed bytes are also saved there (as `<tee_path>.part` until
+    the stream completes).
+    """
+
+    def __init__(self, url: str, session=None, tee_path: str = None, **kwargs):
+        import requests
+        self.session = session or requests.Session()
+        self.response = None
+        super().__init__(url, tee_path=tee_path, gzipped=url.split('?')[0].endswith('.gz'), **kwargs)
+
+    def _open_raw(self):
+        self.response = self.session.get(self.path, stream=True, timeout=HTTP_TIMEOUT)
+        self.response.raise_for_status()
+        # Blob .gz files are the payload, not a transfer encoding: read them as stored
+        self.response.raw.decode_content = False
+        return self.response.raw
+
+    def stage_stats(self) -> dict:
+        stats = super().stage_stats()
+        stats['decompressMode'] = 'http'
+        stats['downloadMBps'] = _mb_per_sec(self.compressed_bytes, stats['wallSeconds'])
+        return stats
+
+    def close(self):
+        self.closed = True
+        if self.response is not None:
+            self.response.close()       # unblocks a read waiting on the network
+        super().close()
+
+
+class ExternalGunzipReader:
+    """File-like reader over the stdout of an external `pigz -dc` / `gzip -dc`."""
+
+    def __init__(self, path: str, tool: str = None):
+        self.tool = tool or find_external_gunzip()
+        self.process = subprocess.Popen([self.tool, '-dc', path], stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, bufsize=1024 * 1024)
+        self.compressed_bytes = os.path.getsize(path)
+        self.decompressed_bytes = 0
+        self.consumer_wait = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        chunk = self.process.stdout.read(size)
+        self.consumer_wait += time.perf_counter() - start
+        self.decompressed_bytes += len(chunk)
+        if size and not chunk and self.finished is None:
+            self.finished = time.perf_counter()
+            if self.process.wait() != 0:
+                raise OSError(f"{self.tool} failed: {self.process.stderr.read().decode(errors='replace')}")
+        return chunk
+
+    def stage_stats(self) -> dict:
+        wall = time.perf_counter() - self.started
+        parse_busy = max(wall - self.consumer_wait, 0.0)
+        return {
+            'decompressMode': f"external:{self.tool}",
+            'compressedBytes': self.compressed_bytes,
+            'decompressedBytes': self.decompressed_bytes,
+            'wallSeconds': round(wall, 3),
+            'parserWaitSeconds': round(self.consumer_wait, 3),
+            'parseMBps': _mb_per_sec(self.decompressed_bytes, parse_busy),
+        }
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
@@ -0,0 +1,84 @@
+"""
+Garbage-collector mode for the pipeline's record loops.
+
+CPython's cyclic GC runs a young collection every 700 container
+allocations, and every so often a full one that walks every tracked object
+in the heap. The record loops allocate a container or two per record while
+holding millions of long-lived ones (aggregated records, ijson-built items,
+the provider reference list), so with the default settings collections fire
+constantly and full ones grow slower as the run goes on, almost never
+finding garbage: records are freed by reference counting the moment the
+last reference goes. Forced `gc.collect()` calls only add more heap walks.
+
+The 'managed' mode:
+
+    - freezes (gc.freeze) everything alive when it is switched on, and again
+      whenever `freeze_long_lived()` is called after a long-lived structure
+      is built (provider references resolved, a CPT's records kept), so
+      collections stop walking them
+    - raises the collection thresholds to GC_THRESHOLDS, so record loops
+      trigger far fewer collections
+    - never collects by hand: `del` the big structures instead
+
+`restore_gc()` puts the previous thresholds back and unfreezes. In 'default'
+mode both calls are no-ops, which is how mrf_bench_suite.py measures the GC
+time the managed mode saves.
+
+Usage:
+    configure_gc('managed')
+    ...build the provider map...
+    freeze_long_lived()
+    ...
+    restore_gc()
+
+    with managed_gc():
+        run()
+"""
+
+import gc
+from contextlib import contextmanager
+
+GC_MODES = ('managed', 'default')
+GC_THRESHOLDS = (100_000, 50, 100)     # Young allocations per collection, then older-generation ratios
+
+_saved_thresholds = None               # Thresholds to restore while the managed mode is on
+
+
+def configure_gc(mode: str = 'managed', thresholds=GC_THRESHOLDS) -> bool:
+    """Switch the process to `mode` (see module docstring); True if this call changed it."""
+    global _saved_thresholds
+    if mode not in GC_MODES:
+        raise ValueError(f"Unknown GC mode {mode!r}; expected one of {GC_MODES}")
+    if mode == 'default' or _saved_thresholds is not None:
+        return False
+    _saved_thresholds = gc.get_threshold()
+    gc.freeze()
+    gc.set_threshold(*thresholds)
+    return True
+
+
+def freeze_long_lived():
+    """In managed mode, move every object alive now out of future collections."""
+    if _saved_thresholds is not None:
+        gc.freeze()
+
+
+def restore_gc():
+    """Undo `configure_gc`: previous thresholds, frozen objects collectable again."""
+    global _saved_thresholds
+    if _saved_thresholds is None:
+        return
+    gc.set_threshold(*_saved_thresholds)
+    gc.unfreeze()
+    _saved_thresholds = None
+
+
+@contextmanager
+def managed_gc(mode: str = 'managed', thresholds=GC_THRESHOLDS):
+    """`configure_gc(mode)` for the enclosed block, restored on exit."""
+    changed = configure_gc(mode, thresholds)
+    try:
+        yield
+    finally:
+        if changed:
+            restore_gc()
@@ -0,0 +1,173 @@
+"""
+Parallel Multi-File MRF Extraction
+
+Runs the single-pass streaming extractor (mrf_stream.py) over many MRF files
+at once, one worker process per file. Each worker writes its own shard of
+resolved rate records; the shards are then merged into the aggregated
+output. Throughput scales with cores because every MRF is an independent,
+CPU-bound decompress+parse.
+
+Usage:
+    python mrf_parallel.py <output_dir> <plan_slug>=<mrf_path> [<plan_slug>=<mrf_path> ...]
+
+Output:
+    - shards/<file>/: columnar dataset of resolved rates per source file
+    - shards/<file>.stats.json: extraction counters per source file
+    - aggregated_rates.json: priceStats per (CPT, NPI, plan) across all shards
+    - aggregated_rates.meta.json: stats mode and error bound (stats_mode='sketch')
+
+With stats_mode='sketch', each worker also reduces its shard to per-key KLL
+sketches (mrf_sketch.py); only those are sent back and merged, never the
+shard's prices.
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mrf_aggregate import aggregate_shards, merge_sketches, sketch_records, sketch_shard
+from mrf_columnar import ColumnarRateWriter
+from mrf_refs import MAX_CACHE_ENTRIES, RefIndexCache
+from mrf_sketch import DEFAULT_K, sketch_metadata
+from mrf_stream import checkpoint_state, extract_resolved_batches, new_stats
+
+
+def shard_name(mrf_path: str) -> str:
+    """Shard file stem for an MRF path (`foo.json.gz` -> `foo`)."""
+    name = os.path.basename(mrf_path)
+    for suffix in ('.gz', '.json'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def extract_to_shard(mrf_path: str, plan_slug: str, shard_dir: str,
+                     target_cpts=None, mode: str = 'events', refs_cache_dir: str = None,
+                     refs_cache_entries: int = MAX_CACHE_ENTRIES) -> dict:
+    """
+    Worker: extract one MRF into the columnar dataset `<shard_dir>/<name>/`.
+
+    The shard is written under a temp name and renamed on success, so a
+    crashed worker never leaves a shard that looks complete; the temp shard
+    is checkpointed at every flushed batch, and a rerun resumes it. With
+    `refs_cache_dir`, the file's provider_references index is reused from
+    (or saved to) a RefIndexCache there, keeping up to `refs_cache_entries`
+    entries. Returns the stats dict.
+    """
+    name = shard_name(mrf_path)
+    shard_path = os.path.join(shard_dir, name)
+    tmp_path = shard_path + '.tmp'
+    stats = new_stats()
+    start = time.time()
+
+    writer = ColumnarRateWriter(tmp_path, metadata={'sourceFile': mrf_path, 'planSlug': plan_slug},
+                                resume=True)
+    refs_cache = RefIndexCache(refs_cache_dir, max_entries=refs_cache_entries) if refs_cache_dir else None
+    for batch in extract_resolved_batches(mrf_path, target_cpts, stats=stats, mode=mode,
+                                          refs_cache=refs_cache, resume=writer.resume_state):
+        flushed = writer.batches
+        writer.write_batch(batch)
+        if writer.batches > flushed and checkpoint_state(stats):
+            writer.checkpoint(checkpoint_state(stats))
+    writer.close()
+    if os.path.exists(shard_path):
+        shutil.rmtree(shard_path)
+    os.replace(tmp_path, shard_path)
+
+    stats.update({
+        'sourceFile': mrf_path,
+        'planSlug': plan_slug,
+        'shardFile': shard_path,
+        'seconds': round(time.time() - start, 2),
+    })
+    with open(os.path.join(shard_dir, f"{name}.stats.json"), 'w') as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+
+def run_parallel_extraction(mrf_files, output_dir: str, target_cpts=None,
+                            data_source: str = 'cms-mrf', max_workers: int = None,
+                            mode: str = 'events', refs_cache_dir: str = None,
+                            stats_mode: str = 'exact', sketch_k: int = DEFAULT_K) -> dict:
+    """
+    Extract every `(plan_slug, mrf_path)` in `mrf_files` in parallel, then merge.
+
+    Returns a summary dict with per-file stats and the aggregated output path.
+    Files whose worker fails are reported and left out of the merge. With
+    `stats_mode='sketch'` every finished shard is sketched in the pool and
+    the driver merges the sketches (median + p10/p25/p75/p90, approximate).
+    """
+    shard_dir = os.path.join(output_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+    max_workers = max_workers or max(1, min(len(mrf_files), os.cpu_count() or 1))
+
+    print(f"🚀 Extracting {len(mrf_files)} MRF files with {max_workers} worker processes...")
+    start = time.time()
+    file_stats = []
+    failed = []
+    sketches = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(extract_to_shard, mrf_path, plan_slug, shard_dir, target_cpts, mode,
+                        refs_cache_dir, max(MAX_CACHE_ENTRIES, len(mrf_files))): mrf_path
+            for plan_slug, mrf_path in mrf_files
+        }
+        for future in as_completed(futures):
+            mrf_path = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"  ❌ {os.path.basename(mrf_path)}: {e}")
+                failed.append({'sourceFile': mrf_path, 'error': str(e)})
+                continue
+            file_stats.append(stats)
+            print(f"  ✓ {os.path.basename(mrf_path)}: {stats['rateRecords']:,} records "
+                  f"in {stats['seconds']:.1f}s")
+
+        if stats_mode == 'sketch':
+            sketch_futures = [pool.submit(sketch_shard, s['shardFile'], target_cpts, sketch_k)
+                              for s in file_stats]
+            for future in as_completed(sketch_futures):
+                merge_sketches(sketches, future.result())
+
+    extract_seconds = time.time() - start
+    print(f"\n🔄 Merging {len(file_stats)} shards...")
+    if stats_mode == 'sketch':
+        aggregated = sketch_records(sketches, data_source)
+    else:
+        aggregated = aggregate_shards([s['shardFile'] for s in file_stats], data_source, target_cpts)
+
+    output_path = os.path.join(output_dir, 'aggregated_rates.json')
+    with open(output_path, 'w') as f:
+        json.dump(aggregated, f, separators=(',', ':'))
+    if stats_mode == 'sketch':
+        with open(os.path.join(output_dir, 'aggregated_rates.meta.json'), 'w') as f:
+            json.dump(sketch_metadata(sketch_k), f, indent=2)
+
+    print(f"✅ {len(aggregated):,} aggregated records → {output_path}")
+    print(f"   Extraction wall time: {extract_seconds:.1f}s "
+          f"(sum of per-file times: {sum(s['seconds'] for s in file_stats):.1f}s)")
+
+    return {
+        'files': file_stats,
+        'failed': failed,
+        'aggregatedRecords': len(aggregated),
+        'outputFile': output_path,
+        'extractSeconds': round(extract_seconds, 2),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python mrf_parallel.py <output_dir> <plan_slug>=<mrf_path> [...]")
+        print("Example: python mrf_parallel.py ./out uhc-choice-plus-ny=choice-plus.json.gz "
+              "uhc-choice-epo-ny=choice-epo.json.gz")
+        sys.exit(1)
+
+    files = [tuple(arg.split('=', 1)) for arg in sys.argv[2:]]
+    summary = run_parallel_extraction(files, sys.argv[1])
+    sys.exit(1 if summary['failed'] else 0)
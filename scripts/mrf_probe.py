@@ -0,0 +1,135 @@
+"""
+Header-only MRF metadata probe.
+
+Identifies an MRF (who published it, for which plan, schema version, what
+kind of file) from its header without reading the file: the JSON is parsed
+as a stream and the parse stops at the first bulk section key
+(`in_network`, `provider_references`, `reporting_structure`,
+`out_of_network`). The read is also capped at `max_bytes` of decompressed
+input, so a file without a recognisable header costs no more than that. A
+probe touches a few KB, so hundreds of files take seconds.
+
+Usage:
+    python mrf_probe.py <mrf_path_or_url> [...]
+
+    from mrf_probe import probe_metadata
+    meta = probe_metadata(path)    # {'reportingEntityName': ..., 'kind': 'in-network', ...}
+"""
+
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import ijson
+
+from mrf_io import open_mrf
+from mrf_stream import get_ijson_backend
+
+PROBE_BYTES = 1024 * 1024              # Most decompressed bytes read per file
+PARSE_BUFFER = 16 * 1024               # ijson read size, kept small so little is read past the header
+MAX_PROBE_WORKERS = 16
+
+# First bulk section key -> kind of file
+SECTION_KINDS = {
+    'in_network': 'in-network',
+    'provider_references': 'in-network',
+    'reporting_structure': 'table-of-contents',
+    'out_of_network': 'allowed-amounts',
+}
+
+# Header fields -> result keys
+HEADER_FIELDS = {
+    'reporting_entity_name': 'reportingEntityName',
+    'reporting_entity_type': 'reportingEntityType',
+    'plan_name': 'planName',
+    'plan_id_type': 'planIdType',
+    'plan_id': 'planId',
+    'plan_market_type': 'planMarketType',
+    'last_updated_on': 'lastUpdatedOn',
+    'version': 'version',
+}
+
+SCALAR_EVENTS = ('string', 'number', 'boolean', 'null')
+
+
+class _BoundedReader:
+    """File wrapper that reports EOF after `limit` bytes."""
+
+    def __init__(self, f, limit: int):
+        self.f = f
+        self.limit = limit
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.limit - self.bytes_read
+        if remaining <= 0:
+            return b''
+        data = self.f.read(remaining if size is None or size < 0 else min(size, remaining))
+        self.bytes_read += len(data)
+        return data
+
+
+def probe_metadata(source: str, max_bytes: int = PROBE_BYTES, backend: str = None) -> dict:
+    """
+    Header metadata of one MRF (path or URL, gzipped or plain).
+
+    Returns the HEADER_FIELDS values (None when absent from the header),
+    other top-level scalars under 'otherFields', the first bulk section and
+    the file kind it implies, and 'bytesRead'. 'complete' is False when the
+    parse hit `max_bytes` (or the end of a truncated file) before a section
+    key, in which case fields after that point were not seen.
+    """
+    parser = get_ijson_backend(backend)
+    result = {'source': source, **{name: None for name in HEADER_FIELDS.values()},
+              'otherFields': {}, 'firstSection': None, 'kind': None, 'complete': False}
+    with open_mrf(source) as f:
+        reader = _BoundedReader(f, max_bytes)
+        key = None
+        try:
+            for prefix, event, value in parser.parse(reader, buf_size=PARSE_BUFFER):
+                if prefix == '' and event == 'map_key':
+                    if value in SECTION_KINDS:
+                        result.update({'firstSection': value, 'kind': SECTION_KINDS[value], 'complete': True})
+                        break
+                    key = value
+                elif prefix == '' and event != 'start_map':
+                    # Whole (small) object read, or not a JSON object at all
+                    result['complete'] = event == 'end_map'
+                    break
+                elif prefix == key and event in SCALAR_EVENTS:
+                    if isinstance(value, Decimal):
+                        value = str(value)
+                    if key in HEADER_FIELDS:
+                        result[HEADER_FIELDS[key]] = value
+                    else:
+                        result['otherFields'][key] = value
+        except ijson.JSONError:
+            pass    # Read cap or truncated file: keep what the header gave
+    result['bytesRead'] = reader.bytes_read
+    return result
+
+
+def probe_files(sources, max_workers: int = MAX_PROBE_WORKERS, **kwargs) -> list:
+    """
+    `probe_metadata` for many files at once, in input order.
+
+    A file that cannot be read gets {'source', 'error'} instead of raising.
+    """
+    def probe(source):
+        try:
+            return probe_metadata(source, **kwargs)
+        except (OSError, EOFError, ValueError) as e:
+            return {'source': source, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(probe, sources))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python mrf_probe.py <mrf_path_or_url> [...]")
+        sys.exit(1)
+
+    for result in probe_files(sys.argv[1:]):
+        print(json.dumps(result))
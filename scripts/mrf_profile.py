@@ -0,0 +1,304 @@
+"""
+Stage-level instrumentation for the pipeline scripts.
+
+Each PHASE / PASS block runs inside `profiler.stage(name)`, which records:
+
+    - wall and CPU seconds (CPU is process-wide, so it includes the
+      decompressor thread; CPU > wall means more than one core was busy)
+    - records and records/s, compressed and decompressed bytes in, and MB/s
+      (set by the block on the stage object, from counters it already keeps)
+    - peak RSS during the stage (Linux VmHWM, reset at stage start; elsewhere
+      the process peak so far)
+    - GC pauses: collections per generation and seconds spent in them,
+      timed with gc.callbacks
+
+`profiler.save()` writes them all as a JSON run report. With `sample`, every
+stage is also profiled:
+
+    - 'cprofile': a pstats file per stage (`{report}.{stage}.prof`, open with
+      snakeviz or pstats)
+    - 'stack':    a sampling profiler on the main thread writing collapsed
+      stacks (`{report}.{stage}.folded`, the format of `py-spy record -f raw`)
+      for flamegraph.pl / speedscope
+
+For a whole-process profile of a Colab run, `py-spy record --pid <pid>` from a
+terminal works too; the report records the pid.
+
+Usage:
+    profiler = RunProfiler('extract', report_path='run_report.json')
+    with profiler.stage('extract') as stage:
+        for ...:
+            ...
+        stage.records = stats['rateRecords']
+        stage.io(stats.get('io'))
+    profiler.save()
+"""
+
+import cProfile
+import gc
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+SAMPLE_MODES = ('cprofile', 'stack')
+SAMPLE_INTERVAL = 0.005                # Seconds between stack samples
+
+
+def current_rss_mb() -> float:
+    """Resident set size now, in MB (0.0 where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS since the last `reset_peak_rss` (Linux) or process start, in MB."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def reset_peak_rss() -> bool:
+    """Restart the VmHWM peak from the current RSS; False where unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class GcTimer:
+    """Collections and pause seconds per generation, from gc.callbacks."""
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.seconds = [0.0, 0.0, 0.0]
+        self.collected = 0
+        self._start = None
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            generation = info['generation']
+            self.collections[generation] += 1
+            self.seconds[generation] += time.perf_counter() - self._start
+            self.collected += info['collected']
+            self._start = None
+
+    def install(self):
+        if self._callback not in gc.callbacks:
+            gc.callbacks.append(self._callback)
+
+    def uninstall(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+    def snapshot(self) -> tuple:
+        return list(self.collections), list(self.seconds), self.collected
+
+    def since(self, snapshot: tuple) -> dict:
+        collections, seconds, collected = snapshot
+        return {
+            'gcSeconds': round(sum(self.seconds) - sum(seconds), 4),
+            'gcCollections': [now - then for now, then in zip(self.collections, collections)],
+            'gcGen2Seconds': round(self.seconds[2] - seconds[2], 4),
+            'gcCollected': self.collected - collected,
+        }
+
+
+class StackSampler:
+    """Sample one thread's Python stack on a timer into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int = None, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mrf-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _mb_per_sec(num_bytes: int, seconds: float):
+    return round(num_bytes / (1024 * 1024) / seconds, 2) if num_bytes and seconds > 0 else None
+
+
+class Stage:
+    """Counters of one running stage; the block sets `records` and bytes on it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.extra = {}
+        self.started = time.perf_counter()
+
+    def io(self, io_stats: dict):
+        """Take bytes in from a reader's `stage_stats()` (mrf_io.py), if any."""
+        if io_stats:
+            self.compressed_bytes = io_stats.get('compressedBytes', 0)
+            self.decompressed_bytes = io_stats.get('decompressedBytes', 0)
+            self.extra['io'] = io_stats
+
+    def progress(self, records: int) -> str:
+        """Rate and memory so far, for the block's progress lines."""
+        elapsed = time.perf_counter() - self.started
+        rate = records / elapsed if elapsed > 0 else 0.0
+        return f"{rate:,.0f} rec/s, {elapsed:,.0f}s, {current_rss_mb():,.0f} MB RSS"
+
+
+class RunProfiler:
+    """
+    Per-stage wall/CPU time, throughput, peak RSS and GC pauses for one run.
+
+    `sample` is None, 'cprofile' or 'stack' (see module docstring); sample
+    files are written next to `report_path` (or to the working directory).
+    """
+
+    def __init__(self, run: str, report_path: str = None, sample: str = None,
+                 sample_interval: float = SAMPLE_INTERVAL):
+        if sample is not None and sample not in SAMPLE_MODES:
+            raise ValueError(f"Unknown sample mode {sample!r}; expected one of {SAMPLE_MODES}")
+        self.run = run
+        self.report_path = report_path
+        self.sample = sample
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.started_at = datetime.now().isoformat()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.gc_timer = GcTimer()
+        self.gc_timer.install()
+        self.gc_snapshot = self.gc_timer.snapshot()
+
+    def _sample_path(self, stage: str, suffix: str) -> str:
+        base = self.report_path[:-5] if self.report_path and self.report_path.endswith('.json') \
+            else (self.report_path or self.run)
+        return f"{base}.{re.sub(r'[^A-Za-z0-9_-]+', '-', stage).strip('-').lower()}{suffix}"
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as one stage; yields its `Stage`."""
+        stage = Stage(name)
+        rss_scope = 'stage' if reset_peak_rss() else 'process'
+        rss_start = current_rss_mb()
+        gc_snapshot = self.gc_timer.snapshot()
+        profile = sampler = None
+        if self.sample == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+        elif self.sample == 'stack':
+            sampler = StackSampler(interval=self.sample_interval)
+            sampler.start()
+        cpu = time.process_time()
+        stage.started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            wall = time.perf_counter() - stage.started
+            cpu = time.process_time() - cpu
+            result = {
+                'stage': name,
+                'seconds': round(wall, 3),
+                'cpuSeconds': round(cpu, 3),
+                'records': stage.records,
+                'recordsPerSec': round(stage.records / wall, 1) if stage.records and wall > 0 else None,
+                'compressedBytes': stage.compressed_bytes,
+                'decompressedBytes': stage.decompressed_bytes,
+                'compressedMBps': _mb_per_sec(stage.compressed_bytes, wall),
+                'decompressedMBps': _mb_per_sec(stage.decompressed_bytes, wall),
+                'rssStartMB': rss_start,
+                'rssEndMB': current_rss_mb(),
+                'peakRssMB': peak_rss_mb(),
+                'peakRssScope': rss_scope,
+                **self.gc_timer.since(gc_snapshot),
+                **stage.extra,
+            }
+            if profile is not None:
+                profile.disable()
+                result['profile'] = self._sample_path(name, '.prof')
+                profile.dump_stats(result['profile'])
+            elif sampler is not None:
+                sampler.stop()
+                result['profile'] = self._sample_path(name, '.folded')
+                sampler.save(result['profile'])
+            self.stages.append(result)
+
+    def report(self) -> dict:
+        wall = time.perf_counter() - self.started
+        return {
+            'run': self.run,
+            'startedAt': self.started_at,
+            'pid': os.getpid(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seconds': round(wall, 3),
+            'cpuSeconds': round(time.process_time() - self.cpu_started, 3),
+            'peakRssMB': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                               / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+            **self.gc_timer.since(self.gc_snapshot),
+            'gcThresholds': list(gc.get_threshold()),
+            'gcFrozenObjects': gc.get_freeze_count(),
+            'stages': self.stages,
+        }
+
+    def summary_lines(self) -> list:
+        lines = []
+        for s in self.stages:
+            rate = f"{s['recordsPerSec']:>12,.0f} rec/s" if s['recordsPerSec'] else ' ' * 18
+            lines.append(f"{s['stage'][:28]:<28} {s['seconds']:9.1f}s  cpu {s['cpuSeconds']:9.1f}s  {rate}  "
+                         f"peak {s['peakRssMB']:8,.0f} MB  gc {s['gcSeconds']:6.2f}s")
+        return lines
+
+    def save(self, path: str = None) -> dict:
+        """Write the JSON run report (to `path` or `report_path`) and return it."""
+        report = self.report()
+        path = path or self.report_path
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+
+    def close(self):
+        self.gc_timer.uninstall()
@@ -0,0 +1,326 @@
+"""
+Compact provider_references index.
+
+Maps every provider reference id to its (NPI, TIN) pairs in CSR form:
+
+    offsets     int64[n_rows + 1]   pairs of row r are offsets[r]:offsets[r + 1]
+    npis        int64[n_pairs]
+    tin_codes   int32[n_pairs]      codes into the interned `tins` string table
+
+A dict of lists of (npi, tin) string tuples costs 150+ bytes per pair; the
+index costs 12. It is built once while streaming provider_references, can be
+saved as .npy files, and loaded back memory-mapped, so a reused index costs
+no parse and only the pages actually touched.
+
+Fanning rates out to NPIs is a gather over index rows (`segment_positions`),
+done with one np.repeat per batch instead of a Python loop per NPI.
+
+Usage:
+    index = ProviderRefIndex()
+    index.add('123', [('1003000126', '12-3456789'), ...])
+    index.save(path)
+    index = ProviderRefIndex.load(path)       # memory-mapped
+
+`RefIndexCache` keeps saved indexes per source MRF (keyed by size + mtime or
+a content hash), so re-running an extraction over an unchanged file skips
+building its provider_references.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from array import array
+
+import numpy as np
+
+from mrf_store import StringInterner
+
+INDEX_FILE = 'index.json'
+
+
+def segment_positions(starts, lengths) -> np.ndarray:
+    """Concatenation of arange(start, start + length) for every segment."""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    shifts = starts - (np.cumsum(lengths) - lengths)
+    return np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(shifts, lengths)
+
+
+def parse_npi(npi):
+    """NPI as a positive int, or None if it isn't one ('N/A', '', 1234567890.5, ...)."""
+    if isinstance(npi, bool):
+        return None
+    if isinstance(npi, str):
+        npi = npi.strip()
+        try:
+            npi = int(npi)
+        except ValueError:
+            try:
+                npi = float(npi)
+            except ValueError:
+                return None
+    if isinstance(npi, float):
+        if not npi.is_integer():
+            return None
+        npi = int(npi)
+    if not isinstance(npi, int) or npi <= 0:
+        return None
+    return npi
+
+
+class ProviderRefIndex:
+    """provider_references as CSR arrays (see module docstring)."""
+
+    def __init__(self):
+        self.ref_rows = {}          # ref id -> row (a re-added id points at its latest row)
+        self.ref_ids = []           # row -> ref id
+        self.tins = StringInterner()
+        self._offsets = array('q', [0])
+        self._npis = array('q')
+        self._tin_codes = array('i')
+
+    def __len__(self):
+        return len(self.ref_rows)
+
+    def __contains__(self, ref_id):
+        return ref_id in self.ref_rows
+
+    def add(self, ref_id: str, pairs) -> int:
+        """Append the (npi, tin) pairs of one provider reference; returns how many bad NPIs were skipped."""
+        if not isinstance(self._npis, array):
+            raise ValueError("A loaded ProviderRefIndex is read-only")
+        skipped = 0
+        for npi, tin in pairs:
+            npi = parse_npi(npi)
+            if npi is None:
+                skipped += 1
+                continue
+            self._npis.append(npi)
+            self._tin_codes.append(self.tins.intern(tin))
+        self._offsets.append(len(self._npis))
+        self.ref_rows[ref_id] = len(self.ref_ids)
+        self.ref_ids.append(ref_id)
+        return skipped
+
+    def row(self, ref_id: str) -> int:
+        """Index row of `ref_id`, or -1 if it is unknown."""
+        return self.ref_rows.get(ref_id, -1)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return np.asarray(self._offsets, dtype=np.int64)
+
+    @property
+    def npis(self) -> np.ndarray:
+        return np.asarray(self._npis, dtype=np.int64)
+
+    @property
+    def tin_codes(self) -> np.ndarray:
+        return np.asarray(self._tin_codes, dtype=np.int32)
+
+    def lengths(self, rows) -> np.ndarray:
+        """Number of pairs in each of `rows`."""
+        offsets = self.offsets
+        return offsets[rows + 1] - offsets[rows]
+
+    def pairs(self, ref_id: str) -> list:
+        """(npi, tin) string pairs of one reference, like `provider_pairs`."""
+        row = self.row(ref_id)
+        if row < 0:
+            return None
+        start, end = self._offsets[row], self._offsets[row + 1]
+        tins = self.tins.values
+        return [(str(npi), tins[code])
+                for npi, code in zip(self._npis[start:end], self._tin_codes[start:end])]
+
+    def digest(self, ref_id: str) -> str:
+        """Hash of the (npi, tin) pairs of one reference ('' if unknown), to detect changes."""
+        row = self.row(ref_id)
+        if row < 0:
+            return ''
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        tins = self.tins.values
+        digest = hashlib.blake2b(np.asarray(self._npis[start:end], dtype=np.int64).tobytes(), digest_size=16)
+        digest.update('\0'.join(tins[code] for code in self._tin_codes[start:end]).encode())
+        return digest.hexdigest()
+
+    def nbytes(self) -> int:
+        """Approximate bytes held by the CSR arrays and string tables."""
+        total = 8 * len(self._offsets) + 8 * len(self._npis) + 4 * len(self._tin_codes)
+        total += sum(len(ref_id) + 49 for ref_id in self.ref_ids)   # str object overhead
+        total += sum(len(tin) + 49 for tin in self.tins.values)
+        return total
+
+    def save(self, path: str):
+        """Write the index to directory `path` (.npy arrays + string tables)."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'npis.npy'), self.npis)
+        np.save(os.path.join(path, 'tin_codes.npy'), self.tin_codes)
+        with open(os.path.join(path, INDEX_FILE), 'w') as f:
+            json.dump({'refIds': self.ref_ids, 'tins': self.tins.values}, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ProviderRefIndex':
+        """Load an index written by `save`, memory-mapping the arrays by default."""
+        mmap_mode = 'r' if mmap else None
+        index = cls()
+        index._offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode)
+        index._npis = np.load(os.path.join(path, 'npis.npy'), mmap_mode=mmap_mode)
+        index._tin_codes = np.load(os.path.join(path, 'tin_codes.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(path, INDEX_FILE), 'r') as f:
+            tables = json.load(f)
+        index.ref_ids = tables['refIds']
+        index.ref_rows = {ref_id: row for row, ref_id in enumerate(index.ref_ids)}
+        index.tins = StringInterner(tables['tins'])
+        return index
+
+
+# ============================================================================
+# ON-DISK CACHE
+# ============================================================================
+
+ENTRY_FILE = 'entry.json'
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CACHE_ENTRIES = 12                 # Default entries kept; multi-file runs pass their file count
+
+
+def source_key(path: str, content_hash: bool = False) -> str:
+    """
+    Cache key for an MRF file.
+
+    By default the key is the file's name, size and mtime, which is free to
+    compute. `content_hash=True` streams the file through BLAKE2 instead, for
+    copies whose mtime changes without the content changing.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if content_hash:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        info = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{info.st_size}:{info.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def _read_entry(entry_dir: str):
+    """Metadata of a cache entry, or None if it is missing, partial or unreadable."""
+    try:
+        with open(os.path.join(entry_dir, ENTRY_FILE), 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get('lastUsed'), (int, float)):
+        return None
+    return entry
+
+
+def _write_entry(entry_dir: str, entry: dict):
+    """Replace an entry's metadata atomically (readers see the old or new file, never half)."""
+    tmp_file = os.path.join(entry_dir, f"{ENTRY_FILE}.tmp-{os.getpid()}")
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_file, os.path.join(entry_dir, ENTRY_FILE))
+    except OSError:
+        pass                        # Entry removed meanwhile; lastUsed is only a hint
+
+
+class RefIndexCache:
+    """
+    Directory of saved ProviderRefIndexes, one per source MRF.
+
+    Entries are keyed by `source_key`, so an MRF that has not changed maps to
+    the same entry on every run and its provider_references are never indexed
+    twice. Each MRF covers one reporting period; `evict` drops entries not
+    used for `max_age_days` and, beyond that, the least recently used ones
+    until at most `max_entries` remain (no count limit if None). A run over
+    many files should allow at least one entry per file, or each `put`
+    evicts an entry the same run still needs.
+
+    Several processes may share one cache directory: entries are written
+    to a temp name and renamed into place, and an entry another process
+    removes or is still replacing is treated as a miss.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = MAX_CACHE_ENTRIES, max_age_days: float = 90,
+                 content_hash: bool = False):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.content_hash = content_hash
+        self._keys = {}             # path -> key, so a content hash is computed once per run
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, path: str) -> str:
+        if path not in self._keys:
+            self._keys[path] = source_key(path, self.content_hash)
+        return os.path.join(self.cache_dir, self._keys[path])
+
+    def get(self, path: str, mmap: bool = True):
+        """The cached index for `path`, or None. Marks the entry as used."""
+        entry_dir = self._entry_dir(path)
+        entry = _read_entry(entry_dir)
+        if entry is None:
+            return None
+        try:
+            index = ProviderRefIndex.load(entry_dir, mmap=mmap)
+        except (OSError, ValueError):
+            return None             # Removed or replaced by another process meanwhile
+        entry['lastUsed'] = time.time()
+        _write_entry(entry_dir, entry)
+        return index
+
+    def put(self, path: str, index: ProviderRefIndex):
+        """Save `index` as the entry for `path`, then evict old entries."""
+        entry_dir = self._entry_dir(path)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        index.save(tmp_dir)
+
+        now = time.time()
+        with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as f:
+            json.dump({
+                'sourceFile': path,
+                'sourceBytes': os.path.getsize(path),
+                'references': len(index),
+                'indexBytes': index.nbytes(),
+                'created': now,
+                'lastUsed': now,
+            }, f, indent=2)
+
+        # The entry appears complete or not at all
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another process saved the same entry first; keep theirs
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> list:
+        """(entry_dir, entry metadata) for every complete entry, newest use first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if '.tmp-' in name:
+                continue            # Another process's entry being written
+            entry_dir = os.path.join(self.cache_dir, name)
+            entry = _read_entry(entry_dir)
+            if entry is not None:
+                entries.append((entry_dir, entry))
+        entries.sort(key=lambda e: e[1]['lastUsed'], reverse=True)
+        return entries
+
+    def evict(self) -> list:
+        """Remove stale and excess entries. Returns the removed source files."""
+        cutoff = time.time() - self.max_age_days * 86400
+        removed = []
+        for rank, (entry_dir, entry) in enumerate(self.entries()):
+            if (self.max_entries is not None and rank >= self.max_entries) or entry['lastUsed'] < cutoff:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed.append(entry.get('sourceFile', entry_dir))
+        return removed
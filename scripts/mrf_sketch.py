@@ -0,0 +1,186 @@
+"""
+Mergeable quantile sketch (KLL) for approximate price statistics.
+
+A KLL sketch keeps a bounded sample of a price stream in levels of
+compactors: level h holds items of weight 2**h, and when a level fills up it
+is sorted and every other item (random offset) is promoted to the next
+level. Memory per key stays around 3k floats however many prices arrive,
+and two sketches merge by concatenating their levels and compacting, so
+partial results from different files or workers combine without the raw
+prices.
+
+min/max/count/mean are tracked exactly; median and p10/p25/p75/p90 carry a
+normalized rank error of about `rank_error(k)` (99% confidence). Until a
+sketch first compacts it holds every price, and its quantiles are exact.
+
+Usage:
+    sketch = KllSketch()
+    sketch.update_many(prices)
+    sketch.merge(other_sketch)
+    stats = sketch_price_stats(sketch)
+"""
+
+import math
+import random
+
+import numpy as np
+
+DEFAULT_K = 200
+MIN_LEVEL_WIDTH = 8
+LEVEL_DECAY = 2 / 3
+PERCENTILES = (('p10', 0.10), ('p25', 0.25), ('p75', 0.75), ('p90', 0.90))
+
+
+def rank_error(k: int = DEFAULT_K) -> float:
+    """Normalized rank error of one quantile query at 99% confidence (KLL, c = 2/3)."""
+    return 2.296 / k ** 0.9723
+
+
+class KllSketch:
+    """KLL quantile sketch with exact min/max/count/sum (see module docstring)."""
+
+    def __init__(self, k: int = DEFAULT_K, seed: int = 0):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return self.count
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(MIN_LEVEL_WIDTH, int(math.ceil(self.k * LEVEL_DECAY ** depth)))
+
+    def _size(self) -> int:
+        return sum(len(level) for level in self.levels)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    level.sort()
+                    # An odd item stays behind so the promoted half is exact
+                    keep = [level.pop()] if len(level) % 2 else []
+                    offset = self._random.randint(0, 1)
+                    self.levels[h + 1].extend(level[offset::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, value: float):
+        self.update_many((value,))
+
+    def update_many(self, values):
+        """Add a batch of values (any iterable or NumPy array)."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(np.add.accumulate(values)[-1])
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        step = self.k
+        for start in range(0, len(values), step):
+            self.levels[0].extend(values[start:start + step].tolist())
+            self._compress()
+
+    def merge(self, other: 'KllSketch'):
+        """Fold `other` into this sketch (in place)."""
+        if not other.count:
+            return
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def is_exact(self) -> bool:
+        """True while the sketch still holds every value it was given."""
+        return len(self.levels) == 1
+
+    def quantiles(self, fractions) -> list:
+        """Values at the given rank fractions (0..1)."""
+        if not self.count:
+            return [None for _ in fractions]
+        if self.is_exact():
+            values = np.sort(np.asarray(self.levels[0], dtype=np.float64))
+            n = len(values)
+            results = []
+            for q in fractions:
+                position = q * (n - 1)
+                low = int(math.floor(position))
+                high = min(low + 1, n - 1)
+                if position == low:
+                    results.append(float(values[low]))
+                elif q == 0.5:
+                    results.append(float((values[low] + values[high]) / 2))   # statistics.median
+                else:
+                    results.append(float(values[low] + (values[high] - values[low]) * (position - low)))
+            return results
+
+        values = np.concatenate([np.asarray(level, dtype=np.float64) for level in self.levels])
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.float64)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, cumulative = values[order], np.cumsum(weights[order])
+        total = cumulative[-1]
+        results = []
+        for q in fractions:
+            index = int(np.searchsorted(cumulative, q * total, side='left'))
+            results.append(float(values[min(index, len(values) - 1)]))
+        return results
+
+    def to_dict(self) -> dict:
+        """JSON-serializable state (for shipping sketches between processes)."""
+        return {'k': self.k, 'levels': self.levels, 'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'KllSketch':
+        sketch = cls(state['k'])
+        sketch.levels = [list(level) for level in state['levels']]
+        sketch.count = state['count']
+        sketch.total = state['total']
+        sketch.min = state['min']
+        sketch.max = state['max']
+        return sketch
+
+
+def sketch_price_stats(sketch: KllSketch) -> dict:
+    """priceStats from a sketch: exact min/max/mean/count, sketched median and percentiles."""
+    quantiles = sketch.quantiles([0.5] + [q for _, q in PERCENTILES])
+    stats = {
+        "min": round(sketch.min, 2),
+        "max": round(sketch.max, 2),
+        "median": round(quantiles[0], 2),
+        "mean": round(sketch.total / sketch.count, 2),
+        "count": sketch.count
+    }
+    for (name, _), value in zip(PERCENTILES, quantiles[1:]):
+        stats[name] = round(value, 2)
+    return stats
+
+
+def sketch_metadata(k: int = DEFAULT_K) -> dict:
+    """Output metadata describing sketch-mode stats and their error bound."""
+    return {
+        'statsMode': 'sketch',
+        'sketch': 'kll',
+        'k': k,
+        'rankError': round(rank_error(k), 5),
+        'rankErrorConfidence': 0.99,
+        'exactFields': ['min', 'max', 'mean', 'count'],
+        'approximateFields': ['median'] + [name for name, _ in PERCENTILES],
+    }
@@ -0,0 +1,537 @@
+"""
+Per-CPT splitter for raw rate JSONL, with a byte-offset index per shard.
+
+Splits a stream of rate record lines into one `{cpt}.jsonl` file per CPT
+(the raw-by-cpt/ layout of colab_two_tier_extraction.py). Alongside each
+shard it writes `{cpt}.idx.npz`, recording where every line starts, grouped
+by (providerNpi, planSlug):
+
+    npis, plans     one entry per (NPI, plan) group
+    group_starts    int64[n_groups + 1], group g owns offsets[group_starts[g]:group_starts[g + 1]]
+    offsets         int64 byte offset of each line, file order within a group
+    lengths         int32 byte length of each line (newline excluded)
+
+With the index, one provider/plan's rates are read with a few seeks instead
+of a json.loads over the whole CPT file.
+
+Lines are buffered per CPT and written in large blocks through a bounded
+LRU pool of file handles, so a split over 10k+ codes never runs out of file
+descriptors.
+
+`iter_rate_lines` reads the input JSON array in large binary blocks and
+pulls procedureCpt / providerNpi / planSlug out of each raw line with
+compiled regexes, so lines are routed without a json.loads/json.dumps round
+trip and written out byte-for-byte. Only lines the probes can't read are
+parsed (with orjson when installed).
+
+A split can be checkpointed and resumed: `CptSplitter.checkpoint(state)`
+flushes every shard, appends the index entries added since the last
+checkpoint to a journal, and records shard sizes plus the caller's state
+(e.g. the input byte offset from `iter_rate_lines`). `CptSplitter(...,
+resume=True)` truncates shards back to the checkpoint, rebuilds the index
+builders from the journal and returns the state as `resume_state`, so the
+resumed split writes the same bytes as an uninterrupted one.
+
+Usage:
+    splitter = CptSplitter(RAW_BY_CPT_DIR)
+    for cpt, npi, plan, line in iter_rate_lines(INPUT_FILE, stats):
+        splitter.write(cpt, npi, plan, line)
+    counts = splitter.close()
+
+    index = ShardIndex.load(f"{RAW_BY_CPT_DIR}/27130.jsonl")
+    records = list(index.iter_records('1234567890', 'uhc-choice-plus-ny'))
+
+    records = aggregate_shard(f"{RAW_BY_CPT_DIR}/27130.jsonl", "cms-mrf-uhc-ny")
+"""
+
+import json
+import mmap
+import os
+import re
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from mrf_aggregate import aggregate_columns, group_prices, iter_price_stats, take_groups
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+MAX_OPEN_FILES = 256                   # Shard handles kept open at once (LRU)
+FLUSH_BYTES = 1024 * 1024              # Per-CPT buffer size written as one block
+MAX_BUFFERED_BYTES = 256 * 1024 * 1024 # All per-CPT buffers together
+READ_BLOCK_SIZE = 16 * 1024 * 1024     # Input bytes split into lines at a time
+
+CHECKPOINT_FILE = '_checkpoint.json'
+JOURNAL_FILE = '_checkpoint.idx.bin'           # Index entries: offset, length, group
+JOURNAL_KEYS_FILE = '_checkpoint.keys.jsonl'   # [cpt, entries, new (npi, plan) groups] per flush
+JOURNAL_DTYPE = np.dtype([('offset', '<i8'), ('length', '<i4'), ('group', '<i4')])
+
+# Fast-path probes for the keys the splitter files a line under. Values with
+# escapes (or of an unexpected type) don't match and fall back to a full parse.
+CPT_PATTERN = re.compile(rb'"procedureCpt"\s*:\s*"([^"\\]*)"')
+NPI_PATTERN = re.compile(rb'"providerNpi"\s*:\s*(?:"([^"\\]*)"|(-?\d+)[,}\s])')
+PLAN_PATTERN = re.compile(rb'"planSlug"\s*:\s*"([^"\\]*)"')
+RATE_PATTERN = re.compile(rb'"negotiatedRate"\s*:\s*(-?[0-9][0-9.eE+-]*)')
+
+
+def index_path(shard_path: str) -> str:
+    """Sidecar index path for a shard (`27130.jsonl` -> `27130.idx.npz`)."""
+    root, _ = os.path.splitext(shard_path)
+    return root + '.idx.npz'
+
+
+class ShardIndexBuilder:
+    """Collect (offset, length, group) per line of one shard while it is written."""
+
+    def __init__(self):
+        self.group_codes = {}       # (npi, plan) -> group code
+        self.offsets = array('q')
+        self.lengths = array('i')
+        self.groups = array('i')
+
+    def add(self, npi, plan: str, offset: int, length: int):
+        key = (str(npi), plan)
+        code = self.group_codes.get(key)
+        if code is None:
+            code = self.group_codes[key] = len(self.group_codes)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.groups.append(code)
+
+    def save(self, path: str):
+        groups = np.asarray(self.groups, dtype=np.int32)
+        order = np.argsort(groups, kind='stable')      # group lines together, keep file order
+        counts = np.bincount(groups, minlength=len(self.group_codes))
+        keys = list(self.group_codes)
+        np.savez(
+            path,
+            npis=np.array([npi for npi, _ in keys], dtype=str),
+            plans=np.array([plan for _, plan in keys], dtype=str),
+            group_starts=np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            offsets=np.asarray(self.offsets, dtype=np.int64)[order],
+            lengths=np.asarray(self.lengths, dtype=np.int32)[order],
+        )
+
+
+class ShardIndex:
+    """Loaded `{cpt}.idx.npz` for one shard (see module docstring)."""
+
+    def __init__(self, shard_path: str, npis, plans, group_starts, offsets, lengths):
+        self.shard_path = shard_path
+        self.group_rows = {(npi, plan): row for row, (npi, plan) in enumerate(zip(npis, plans))}
+        self.group_starts = group_starts
+        self.offsets = offsets
+        self.lengths = lengths
+
+    @classmethod
+    def load(cls, shard_path: str) -> 'ShardIndex':
+        with np.load(index_path(shard_path)) as data:
+            return cls(shard_path, data['npis'].tolist(), data['plans'].tolist(),
+                       data['group_starts'], data['offsets'], data['lengths'])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def groups(self) -> list:
+        """(npi, plan, record count) for every group in the shard."""
+        counts = np.diff(self.group_starts).tolist()
+        return [(npi, plan, counts[row]) for (npi, plan), row in self.group_rows.items()]
+
+    def locate(self, npi: str, plan: str):
+        """(offsets, lengths) of one group's lines; empty if the group is absent."""
+        row = self.group_rows.get((npi, plan))
+        if row is None:
+            return self.offsets[:0], self.lengths[:0]
+        start, end = self.group_starts[row], self.group_starts[row + 1]
+        return self.offsets[start:end], self.lengths[start:end]
+
+    def iter_lines(self, npi: str, plan: str):
+        """Raw line bytes of one group, read through mmap (no full scan)."""
+        offsets, lengths = self.locate(npi, plan)
+        if not len(offsets):
+            return
+        with open(self.shard_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for offset, length in zip(offsets.tolist(), lengths.tolist()):
+                yield m[offset:offset + length]
+
+    def iter_records(self, npi: str, plan: str):
+        for line in self.iter_lines(npi, plan):
+            yield json.loads(line)
+
+
+def iter_raw_lines(path: str, block_size: int = READ_BLOCK_SIZE, start: int = 0, cursor: dict = None):
+    """
+    Yield stripped record lines of a one-record-per-line JSON array, as bytes.
+
+    Reading starts at byte `start` (a line start). If `cursor` is given,
+    cursor['offset'] is the byte offset just past each line when it is
+    yielded, i.e. where to restart after it.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        tail = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines = (tail + block).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                position += len(line) + 1
+                line = line.strip().rstrip(b',')
+                if line and line != b'[' and line != b']':
+                    if cursor is not None:
+                        cursor['offset'] = position
+                    yield line
+        position += len(tail)
+        line = tail.strip().rstrip(b',')
+        if line and line != b'[' and line != b']':
+            if cursor is not None:
+                cursor['offset'] = position
+            yield line
+
+
+def _probe_npi(match):
+    """providerNpi of an NPI_PATTERN match, with its JSON type (str or int)."""
+    return match.group(1).decode() if match.group(2) is None else int(match.group(2))
+
+
+def probe_keys(line: bytes):
+    """(cpt, npi, plan) read straight from a raw line, or None if a probe misses."""
+    cpt = CPT_PATTERN.search(line)
+    npi = NPI_PATTERN.search(line)
+    plan = PLAN_PATTERN.search(line)
+    if cpt is None or npi is None or plan is None:
+        return None
+    return (cpt.group(1).decode(), _probe_npi(npi), plan.group(1).decode())
+
+
+def _match_rate(line: bytes):
+    """negotiatedRate read by RATE_PATTERN, or None if the probe misses."""
+    match = RATE_PATTERN.search(line)
+    if match is not None:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            pass
+    return None
+
+
+def probe_rate(line: bytes) -> float:
+    """negotiatedRate of a raw line (0 if absent or unreadable), parsing the line only if needed."""
+    rate = _match_rate(line)
+    if rate is not None:
+        return rate
+    try:
+        rate = _loads(line).get('negotiatedRate', 0)
+    except (ValueError, AttributeError):
+        return 0
+    return rate if isinstance(rate, (int, float)) else 0
+
+
+def iter_rate_lines(path: str, stats: dict = None, block_size: int = READ_BLOCK_SIZE):
+    """
+    Yield (cpt, npi, plan, line bytes) for every rate record line of `path`.
+
+    Keys come from `probe_keys`; lines it can't read are parsed in full
+    (counted in stats['fallbacks']), as are lines whose rate the probe
+    misses, and lines that aren't a valid JSON object are skipped
+    (stats['errors']), as are records without a providerNpi or planSlug
+    (stats['missingKeys']). `npi` keeps its JSON type (str or int), as
+    json.loads would give it. `line` is the record exactly as it
+    appears in the input, without the separating comma. stats['offset'] is
+    the input offset just past the current line; passing back a `stats`
+    saved at a checkpoint resumes from there with its counters.
+    """
+    if stats is None:
+        stats = {}
+    for key in ('records', 'fallbacks', 'errors', 'missingKeys', 'offset'):
+        stats.setdefault(key, 0)
+    for line in iter_raw_lines(path, block_size, start=stats['offset'], cursor=stats):
+        keys = probe_keys(line)
+        if keys is None or _match_rate(line) is None:
+            try:
+                record = _loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError:
+                stats['errors'] += 1
+                continue
+        if keys is None:
+            npi, plan = record.get('providerNpi'), record.get('planSlug')
+            if npi is None or plan is None:
+                stats['missingKeys'] += 1
+                continue
+            stats['fallbacks'] += 1
+            keys = (str(record.get('procedureCpt', 'UNKNOWN')), npi if isinstance(npi, (str, int)) else str(npi),
+                    str(plan))
+        stats['records'] += 1
+        yield keys[0], keys[1], keys[2], line
+
+
+def reaggregate_groups(shard_path: str, keys, data_source: str) -> list:
+    """
+    Aggregated records for selected (npi, plan) groups of one CPT shard.
+
+    Only those groups' lines are read (via the shard index), so refreshing a
+    few providers does not rescan the CPT file.
+    """
+    index = ShardIndex.load(shard_path)
+    cpts, npis, plans, prices = [], [], [], []
+    for npi, plan in keys:
+        for record in index.iter_records(npi, plan):
+            cpts.append(record['procedureCpt'])
+            npis.append(record['providerNpi'])
+            plans.append(record['planSlug'])
+            prices.append(record.get('negotiatedRate', 0))
+    return aggregate_columns(cpts, npis, plans, prices, data_source)
+
+
+def aggregate_shard(shard_path: str, data_source: str, aggregated_at: str = None) -> list:
+    """
+    Aggregated records for every (npi, plan) group of one CPT shard.
+
+    Same records, in the same order, as `aggregate_columns` over the shard's
+    parsed lines, without a record dict or key strings per line: keys are
+    the shard index's group codes, and each rate is probed from the raw line
+    bytes. providerNpi keeps the JSON type it has in the shard.
+    """
+    index = ShardIndex.load(shard_path)
+    if not len(index):
+        return []
+    cpt = os.path.basename(shard_path)[:-len('.jsonl')]
+    keys = list(index.group_rows)
+    group_codes = np.repeat(np.arange(len(keys)), np.diff(index.group_starts))
+    aggregated_at = aggregated_at or datetime.now().strftime("%Y-%m-%d")
+    records = []
+    with open(shard_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        rates = np.fromiter(
+            (probe_rate(m[offset:offset + length])
+             for offset, length in zip(index.offsets.tolist(), index.lengths.tolist())),
+            dtype=np.float64, count=len(index))
+        groups = group_prices([group_codes], rates)
+        # Rows here are in group order; first appearance is by file offset
+        groups = take_groups(groups, np.argsort(index.offsets[groups['rows']], kind='stable'))
+        for row, stats in iter_price_stats(groups):
+            npi, plan = keys[group_codes[row]]
+            # The index keys NPIs as text; the group's first line has the JSON type
+            offset = int(index.offsets[row])
+            match = NPI_PATTERN.search(m[offset:offset + int(index.lengths[row])])
+            if match is not None and match.group(2) is not None:
+                npi = int(match.group(2))
+            records.append({
+                "procedureCpt": cpt,
+                "providerNpi": npi,
+                "planSlug": plan,
+                "priceStats": stats,
+                "aggregatedAt": aggregated_at,
+                "dataSource": data_source
+            })
+    return records
+
+
+class CptSplitter:
+    """
+    Route raw rate lines into `{output_dir}/{cpt}.jsonl`, indexing each shard.
+
+    `write` takes the line as bytes (no trailing newline) plus the keys it
+    is filed under. Lines are buffered per CPT and written in blocks of
+    `flush_bytes`; all buffers together stay under `max_buffered_bytes` (the
+    largest are flushed first). Shards are written through an LRU pool of at
+    most `max_open` file handles, reopened in append mode when needed, so
+    10k+ CPTs never hit the fd limit. `close` finishes every shard, writes
+    the sidecar indexes (unless `index=False`) and returns per-CPT record
+    counts; `stats()` reports handle, flush and throughput counters.
+    `checkpoint` / `resume=True` save and restore a split in progress (see
+    the module docstring).
+    """
+
+    def __init__(self, output_dir: str, index: bool = True, max_open: int = MAX_OPEN_FILES,
+                 flush_bytes: int = FLUSH_BYTES, max_buffered_bytes: int = MAX_BUFFERED_BYTES,
+                 resume: bool = False):
+        self.output_dir = output_dir
+        self.index = index
+        self.max_open = max_open
+        self.flush_bytes = flush_bytes
+        self.max_buffered_bytes = max_buffered_bytes
+        self.handles = OrderedDict()    # cpt -> open binary file, least recently used first
+        self.buffers = {}               # cpt -> [line bytes, ...] not yet written
+        self.buffered = {}              # cpt -> bytes held in its buffer
+        self.total_buffered = 0
+        self.positions = {}             # cpt -> bytes written so far (flushed or not)
+        self.on_disk = {}               # cpt -> bytes already flushed to its shard
+        self.indexes = {}               # cpt -> ShardIndexBuilder
+        self.counts = {}
+        self.counters = {'fileOpens': 0, 'maxOpenFiles': 0, 'flushes': 0,
+                         'bytesWritten': 0, 'writeSeconds': 0.0}
+        self.journaled = {}             # cpt -> (index entries, groups) already in the journal
+        self.resume_state = None
+        os.makedirs(output_dir, exist_ok=True)
+        if resume and os.path.exists(self._checkpoint_path(CHECKPOINT_FILE)):
+            self._restore()
+
+    def shard_path(self, cpt: str) -> str:
+        return os.path.join(self.output_dir, f"{cpt}.jsonl")
+
+    def write(self, cpt: str, npi: str, plan: str, line: bytes):
+        buffer = self.buffers.get(cpt)
+        if buffer is None:
+            buffer = self.buffers[cpt] = []
+            self.buffered[cpt] = 0
+            if cpt not in self.counts:
+                self.positions[cpt] = 0
+                self.counts[cpt] = 0
+                if self.index:
+                    self.indexes[cpt] = ShardIndexBuilder()
+        buffer.append(line)
+        buffer.append(b'\n')
+        size = len(line) + 1
+        self.buffered[cpt] += size
+        self.total_buffered += size
+        if self.index:
+            self.indexes[cpt].add(npi, plan, self.positions[cpt], len(line))
+        self.positions[cpt] += size
+        self.counts[cpt] += 1
+
+        if self.buffered[cpt] >= self.flush_bytes:
+            self._flush(cpt)
+        elif self.total_buffered > self.max_buffered_bytes:
+            # Too much held across many small CPTs: write out the biggest half
+            for big in sorted(self.buffered, key=self.buffered.get, reverse=True):
+                if self.total_buffered <= self.max_buffered_bytes // 2:
+                    break
+                self._flush(big)
+
+    def _handle(self, cpt: str):
+        f = self.handles.get(cpt)
+        if f is not None:
+            self.handles.move_to_end(cpt)
+            return f
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        # First open truncates a stale shard from an earlier run; reopens append
+        f = open(self.shard_path(cpt), 'ab' if self.on_disk.get(cpt) else 'wb')
+        self.handles[cpt] = f
+        self.counters['fileOpens'] += 1
+        self.counters['maxOpenFiles'] = max(self.counters['maxOpenFiles'], len(self.handles))
+        return f
+
+    def _flush(self, cpt: str):
+        size = self.buffered.pop(cpt)
+        block = b''.join(self.buffers.pop(cpt))
+        start = time.perf_counter()
+        self._handle(cpt).write(block)
+        self.counters['writeSeconds'] += time.perf_counter() - start
+        self.on_disk[cpt] = self.on_disk.get(cpt, 0) + size
+        self.counters['bytesWritten'] += size
+        self.counters['flushes'] += 1
+        self.total_buffered -= size
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def checkpoint(self, state: dict):
+        """Flush every shard and journal the index, then record `state` as the resume point."""
+        for cpt in list(self.buffers):
+            self._flush(cpt)
+        for f in self.handles.values():
+            f.flush()
+
+        with open(self._checkpoint_path(JOURNAL_FILE), 'ab') as entries, \
+                open(self._checkpoint_path(JOURNAL_KEYS_FILE), 'a') as keys:
+            for cpt, builder in self.indexes.items():
+                done_entries, done_groups = self.journaled.get(cpt, (0, 0))
+                if len(builder.offsets) == done_entries:
+                    continue
+                rows = np.empty(len(builder.offsets) - done_entries, dtype=JOURNAL_DTYPE)
+                rows['offset'] = builder.offsets[done_entries:]
+                rows['length'] = builder.lengths[done_entries:]
+                rows['group'] = builder.groups[done_entries:]
+                rows.tofile(entries)
+                new_groups = list(builder.group_codes)[done_groups:]
+                keys.write(json.dumps([cpt, len(rows), new_groups], separators=(',', ':')) + '\n')
+                self.journaled[cpt] = (len(builder.offsets), len(builder.group_codes))
+            journal_bytes, keys_bytes = entries.tell(), keys.tell()
+
+        path = self._checkpoint_path(CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'state': state,
+                'counts': self.counts,
+                'shardBytes': self.on_disk,
+                'counters': self.counters,
+                'journalBytes': journal_bytes,
+                'journalKeysBytes': keys_bytes,
+            }, f)
+        os.replace(path + '.tmp', path)
+
+    def _restore(self):
+        """Reset shards and index builders to the last checkpoint."""
+        with open(self._checkpoint_path(CHECKPOINT_FILE), 'r') as f:
+            checkpoint = json.load(f)
+        self.resume_state = checkpoint['state']
+        self.counts = checkpoint['counts']
+        self.on_disk = checkpoint['shardBytes']
+        self.positions = dict(self.on_disk)
+        self.counters.update(checkpoint['counters'])
+
+        # Anything written after the checkpoint is written again
+        for cpt, size in self.on_disk.items():
+            os.truncate(self.shard_path(cpt), size)
+        os.truncate(self._checkpoint_path(JOURNAL_FILE), checkpoint['journalBytes'])
+        os.truncate(self._checkpoint_path(JOURNAL_KEYS_FILE), checkpoint['journalKeysBytes'])
+        if not self.index:
+            return
+
+        entries = np.fromfile(self._checkpoint_path(JOURNAL_FILE), dtype=JOURNAL_DTYPE)
+        position = 0
+        with open(self._checkpoint_path(JOURNAL_KEYS_FILE), 'r') as f:
+            for line in f:
+                cpt, n_entries, new_groups = json.loads(line)
+                builder = self.indexes.get(cpt)
+                if builder is None:
+                    builder = self.indexes[cpt] = ShardIndexBuilder()
+                for npi, plan in new_groups:
+                    builder.group_codes[(npi, plan)] = len(builder.group_codes)
+                rows = entries[position:position + n_entries]
+                position += n_entries
+                builder.offsets.extend(rows['offset'].tolist())
+                builder.lengths.extend(rows['length'].tolist())
+                builder.groups.extend(rows['group'].tolist())
+                self.journaled[cpt] = (len(builder.offsets), len(builder.group_codes))
+
+    def stats(self) -> dict:
+        """Handle/flush counters plus write throughput (MB/s of block writes)."""
+        seconds = self.counters['writeSeconds']
+        return {
+            **self.counters,
+            'openFiles': len(self.handles),
+            'writeSeconds': round(seconds, 3),
+            'writeMBps': round(self.counters['bytesWritten'] / seconds / (1024 * 1024), 2) if seconds else None,
+        }
+
+    def close(self) -> dict:
+        for cpt in list(self.buffers):
+            self._flush(cpt)
+        start = time.perf_counter()
+        for f in self.handles.values():
+            f.close()
+        self.counters['writeSeconds'] += time.perf_counter() - start
+        self.handles.clear()
+        if self.index:
+            for cpt, builder in self.indexes.items():
+                builder.save(index_path(self.shard_path(cpt)))
+        self.indexes = {}
+        for name in (CHECKPOINT_FILE, JOURNAL_FILE, JOURNAL_KEYS_FILE):
+            if os.path.exists(self._checkpoint_path(name)):
+                os.remove(self._checkpoint_path(name))
+        return self.counts
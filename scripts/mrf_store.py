@@ -0,0 +1,179 @@
+"""
+Compact, array-backed storage for rate records.
+
+A rate record as a Python dict (CPT string, NPI string, rate float, billing
+class, service-code list, ...) costs several hundred bytes. RateStore keeps
+the same data as typed columns instead:
+
+    procedureCpt, providerTin, providerRef,   -> int32 codes into a per-column
+    billingClass, serviceCodes                   string dictionary (interned)
+    providerNpi                               -> int64
+    negotiatedRate                            -> float64
+
+so a record costs ~36 bytes plus the (small) dictionaries. Columns are
+`array.array`s, exposed to NumPy without copying via `column()`.
+
+Usage:
+    store = RateStore()
+    for row in extract_resolved_rows(path, TARGET_CPTS):
+        store.append_row(row)
+    cpts = store.decoded('procedureCpt')
+"""
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Row tuple order produced by mrf_stream.extract_resolved_rows
+RATE_FIELDS = ('procedureCpt', 'providerRef', 'providerNpi', 'providerTin',
+               'negotiatedRate', 'billingClass', 'serviceCodes')
+
+# Column -> array typecode; 'i' columns are dictionary-encoded strings
+COLUMN_TYPES = {
+    'procedureCpt': 'i',
+    'providerRef': 'i',
+    'providerNpi': 'q',
+    'providerTin': 'i',
+    'negotiatedRate': 'd',
+    'billingClass': 'i',
+    'serviceCodes': 'i',
+}
+DICT_COLUMNS = tuple(name for name, code in COLUMN_TYPES.items() if code == 'i')
+
+
+class StringInterner:
+    """Map strings to dense int codes (and back)."""
+
+    def __init__(self, values=()):
+        self.codes = {}
+        self.values = []
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def encode_service_codes(service_codes) -> str:
+    return ','.join(service_codes or [])
+
+
+def decode_service_codes(value: str) -> list:
+    return value.split(',') if value else []
+
+
+def iter_batch_rows(batch: dict):
+    """
+    Yield RATE_FIELDS tuples from an encoded batch (see `RateStore.extend_encoded`).
+
+    Values come back in the extractor's row format: NPI as a string, service
+    codes as a list, and None for a rate with no provider reference.
+    """
+    columns = []
+    for name in RATE_FIELDS:
+        column = batch[name]
+        if isinstance(column, tuple):
+            codes, values = column
+            if name == 'serviceCodes':
+                values = [decode_service_codes(v) for v in values]
+            elif name == 'providerRef':
+                values = [v or None for v in values]
+            column = [values[code] for code in codes.tolist()]
+        elif name == 'providerNpi':
+            column = [str(npi) for npi in column.tolist()]
+        else:
+            column = column.tolist()
+        columns.append(column)
+    return zip(*columns)
+
+
+class RateStore:
+    """Columnar, dictionary-encoded rate records (see module docstring)."""
+
+    def __init__(self, columns=None):
+        self.names = tuple(columns or COLUMN_TYPES)
+        self.columns = {name: array(COLUMN_TYPES[name]) for name in self.names}
+        self.dictionaries = {name: StringInterner() for name in self.names if name in DICT_COLUMNS}
+        self._row_plan = [(RATE_FIELDS.index(name), name) for name in self.names]
+
+    def __len__(self):
+        return len(self.columns[self.names[0]])
+
+    def append_record(self, record: dict):
+        """Append one record dict (strings for dict columns, NPI as str or int)."""
+        for name in self.names:
+            self._append_value(name, record.get(name))
+
+    def append_row(self, row):
+        """Append one RATE_FIELDS-ordered tuple (the extractor's native row)."""
+        for index, name in self._row_plan:
+            self._append_value(name, row[index])
+
+    def _append_value(self, name: str, value):
+        interner = self.dictionaries.get(name)
+        if interner is not None:
+            if name == 'serviceCodes':
+                value = encode_service_codes(value)
+            value = interner.intern('' if value is None else value)
+        elif name == 'providerNpi':
+            value = int(value)
+        self.columns[name].append(value)
+
+    def extend_encoded(self, batch: dict):
+        """
+        Append a batch of already-encoded columns.
+
+        `batch` maps each column to a NumPy array, or for dictionary columns to
+        a (codes, values) pair whose codes index into `values`. Batch-local
+        codes are remapped onto this store's dictionaries in one vectorized
+        step, so no per-row Python work is done.
+        """
+        for name in self.names:
+            column = batch[name]
+            if name in self.dictionaries:
+                codes, values = column
+                interner = self.dictionaries[name]
+                remap = np.fromiter((interner.intern(v) for v in values), dtype=np.int32, count=len(values))
+                column = remap[codes] if len(codes) else np.empty(0, dtype=np.int32)
+            self.columns[name].frombytes(np.ascontiguousarray(column, dtype=COLUMN_TYPES[name]).tobytes())
+
+    def column(self, name: str):
+        """Zero-copy NumPy view of a stored column (codes for dict columns)."""
+        return np.frombuffer(self.columns[name], dtype=COLUMN_TYPES[name])
+
+    def decoded(self, name: str) -> list:
+        """Column values as Python objects (strings for dict columns)."""
+        if name not in self.dictionaries:
+            return self.columns[name].tolist()
+        values = self.dictionaries[name].values
+        if name == 'serviceCodes':
+            values = [decode_service_codes(v) for v in values]
+        return [values[code] for code in self.columns[name]]
+
+    def iter_records(self):
+        """Yield stored rates as record dicts in the original extractor format."""
+        columns = [self.decoded(name) for name in self.names]
+        for values in zip(*columns):
+            record = dict(zip(self.names, values))
+            if 'providerNpi' in record:
+                record['providerNpi'] = str(record['providerNpi'])
+            if record.get('providerRef') == '':
+                record['providerRef'] = None
+            yield record
+
+    def nbytes(self) -> int:
+        """Approximate bytes held by columns plus dictionary strings."""
+        total = sum(col.itemsize * len(col) for col in self.columns.values())
+        for interner in self.dictionaries.values():
+            total += sum(len(v) + 49 for v in interner.values)   # str object overhead
+        return total
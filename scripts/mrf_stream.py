@@ -0,0 +1,679 @@
+"""
+Single-pass MRF streaming engine.
+
+Reads a CMS in-network machine-readable file (gzipped or plain JSON) exactly
+once and resolves every negotiated rate against `provider_references` in the
+same pass.
+
+The top-level sections of an MRF can appear in either order:
+
+    - provider_references before in_network: the reference map is complete by
+      the time the first in_network item arrives, so rates are resolved and
+      emitted as they stream past.
+    - in_network before provider_references (or refs missing entirely): target
+      rates are buffered (and spilled to a temp file once the buffer fills)
+      and resolved when the scan finishes.
+
+Two section readers are available (`mode=`):
+
+    - events: walks the ijson event stream and skips the negotiated_rates
+      subtree of non-target items without building any Python objects.
+    - items:  builds every in_network item with the C `items` generator.
+
+Both use the fastest installed ijson backend (yajl2_c first) unless one is
+forced with `backend=`. Run mrf_bench.py to compare them.
+
+provider_references are held in a CSR `ProviderRefIndex` (mrf_refs.py), and
+rates are fanned out to NPIs a batch at a time with vectorized gathers.
+
+Usage:
+    from mrf_stream import extract_resolved_rows
+
+    stats = {}
+    for row in extract_resolved_rows(path, TARGET_CPTS, stats=stats):
+        ...   # (procedureCpt, providerRef, providerNpi, providerTin, rate, ...)
+
+`extract_resolved_batches` yields the same data as encoded column batches
+(for `ColumnarRateWriter.write_batch`), `extract_resolved_rates` as record
+dicts.
+"""
+
+import io
+import json
+import os
+import tempfile
+from array import array
+
+import ijson
+import numpy as np
+
+from mrf_io import is_url, open_mrf
+from mrf_refs import ProviderRefIndex, RefIndexCache, parse_npi, segment_positions
+from mrf_store import RATE_FIELDS, StringInterner, encode_service_codes, iter_batch_rows
+
+READ_CHUNK_SIZE = 1024 * 1024          # 1 MB of decompressed JSON per parser feed
+SPILL_BUFFER_ROWS = 200_000            # Rows held in RAM before spilling to disk
+RESOLVE_BATCH_ROWS = 4096              # Raw rate rows fanned out per vectorized join
+BILLING_CODE_TYPES = ('CPT', 'HCPCS')
+
+
+# ============================================================================
+# PROVIDER REFERENCES
+# ============================================================================
+
+def provider_pairs(provider_groups, stats: dict = None) -> list:
+    """
+    Flatten `provider_groups` into unique (npi, tin) pairs, first TIN wins.
+
+    NPIs that aren't a positive integer ('N/A', '', 1234567890.5) are
+    skipped and counted in stats['badNpis']; 1234567890.0 reads as
+    '1234567890'.
+    """
+    pairs = []
+    seen = set()
+    bad = 0
+    for group in provider_groups or []:
+        tin = (group.get('tin') or {}).get('value', '')
+        for npi in group.get('npi') or []:
+            npi = parse_npi(npi)
+            if npi is None:
+                bad += 1
+                continue
+            npi = str(npi)
+            if npi not in seen:
+                seen.add(npi)
+                pairs.append((npi, tin))
+    if bad and stats is not None:
+        stats['badNpis'] = stats.get('badNpis', 0) + bad
+    return pairs
+
+
+def add_provider_reference(refs: ProviderRefIndex, ref_item: dict, index: int, stats: dict = None):
+    """Add one `provider_references` item to the `refs` index."""
+    # UHC uses provider_group_id; fall back to the array index otherwise
+    ref_id = str(ref_item.get('provider_group_id', index))
+    pairs = provider_pairs(ref_item.get('provider_groups'), stats)
+    if pairs:
+        refs.add(ref_id, pairs)
+
+
+# ============================================================================
+# IN-NETWORK ITEMS
+# ============================================================================
+
+def iter_raw_rates(item: dict, negotiated_types=None, stats: dict = None):
+    """
+    Yield raw rate rows for one in_network item.
+
+    Rows are (billing_code, ref_ids, inline_pairs, rate, billing_class,
+    service_codes). `ref_ids` is a list of provider reference ids to resolve
+    later; `inline_pairs` holds already-resolved (npi, tin) pairs for files
+    that embed `provider_groups` directly in the rate object. With
+    `negotiated_types`, prices of other types (e.g. 'percentage') are skipped.
+    Bad inline NPIs are counted in `stats` (see `provider_pairs`).
+    """
+    billing_code = str(item.get('billing_code', ''))
+    for rate_obj in item.get('negotiated_rates', []):
+        ref_ids = [str(ref) for ref in rate_obj.get('provider_references', [])]
+        inline_pairs = provider_pairs(rate_obj.get('provider_groups'), stats)
+        for price_obj in rate_obj.get('negotiated_prices', []):
+            if negotiated_types and price_obj.get('negotiated_type') not in negotiated_types:
+                continue
+            yield (
+                billing_code,
+                ref_ids,
+                inline_pairs,
+                float(price_obj.get('negotiated_rate', 0)),
+                price_obj.get('billing_class', 'unknown'),
+                price_obj.get('service_code', []),
+            )
+
+
+def resolve_batch(rows, refs: ProviderRefIndex, stats: dict) -> dict:
+    """
+    Fan raw rate rows out to one record per resolved NPI, as an encoded batch.
+
+    Every (raw row, provider reference) pair is one segment of the CSR index,
+    and all segments' NPIs/TINs are gathered at once with `segment_positions`
+    instead of a Python loop per NPI. Inline provider_groups become segments
+    of a small batch-local index. Output order matches resolving row by row.
+    The batch format is the one `RateStore.extend_encoded` takes.
+    """
+    inline = ProviderRefIndex()
+    cpts, ref_names, classes, services = StringInterner(), StringInterner(['']), StringInterner(), StringInterner()
+    raw_cpt, raw_rate, raw_class, raw_service = array('i'), array('d'), array('i'), array('i')
+    seg_raw, seg_row, seg_ref = array('q'), array('q'), array('i')
+
+    for i, (billing_code, ref_ids, inline_pairs, rate, billing_class, service_codes) in enumerate(rows):
+        raw_cpt.append(cpts.intern(billing_code))
+        raw_rate.append(rate)
+        raw_class.append(classes.intern(billing_class))
+        raw_service.append(services.intern(encode_service_codes(service_codes)))
+        if inline_pairs:
+            inline.add(str(i), inline_pairs)
+            seg_raw.append(i)
+            seg_row.append(-len(inline))        # inline row k is stored as -(k + 1)
+            seg_ref.append(0)
+        for ref_id in ref_ids:
+            row = refs.row(ref_id)
+            if row < 0:
+                stats['unresolvedRefs'] += 1
+                continue
+            seg_raw.append(i)
+            seg_row.append(row)
+            seg_ref.append(ref_names.intern(ref_id))
+
+    seg_raw = np.array(seg_raw, dtype=np.int64)
+    seg_row = np.array(seg_row, dtype=np.int64)
+    is_inline = seg_row < 0
+    lengths = np.empty(len(seg_row), dtype=np.int64)
+    lengths[~is_inline] = refs.lengths(seg_row[~is_inline])
+    lengths[is_inline] = inline.lengths(-seg_row[is_inline] - 1)
+    out_starts = np.cumsum(lengths) - lengths
+    total = int(lengths.sum())
+
+    # TIN codes of inline pairs are shifted past the shared index's TIN table
+    npis = np.empty(total, dtype=np.int64)
+    tin_codes = np.empty(total, dtype=np.int64)
+    for index, mask, index_rows, tin_shift in ((refs, ~is_inline, seg_row[~is_inline], 0),
+                                               (inline, is_inline, -seg_row[is_inline] - 1, len(refs.tins))):
+        if not mask.any():
+            continue
+        src = segment_positions(index.offsets[index_rows], lengths[mask])
+        dst = segment_positions(out_starts[mask], lengths[mask])
+        npis[dst] = index.npis[src]
+        tin_codes[dst] = index.tin_codes[src] + tin_shift
+
+    # Keep only the TINs this batch uses in its dictionary
+    used_tins, tin_codes = np.unique(tin_codes, return_inverse=True)
+    shared_tins, n_shared = refs.tins.values, len(refs.tins)
+    tin_values = [shared_tins[code] if code < n_shared else inline.tins.values[code - n_shared]
+                  for code in used_tins.tolist()]
+
+    raw_of_out = np.repeat(seg_raw, lengths)
+    stats['rateRecords'] += total
+    return {
+        'procedureCpt': (np.array(raw_cpt, dtype=np.int32)[raw_of_out], cpts.values),
+        'providerRef': (np.repeat(np.array(seg_ref, dtype=np.int32), lengths), ref_names.values),
+        'providerNpi': npis,
+        'providerTin': (tin_codes.reshape(-1), tin_values),
+        'negotiatedRate': np.array(raw_rate, dtype=np.float64)[raw_of_out],
+        'billingClass': (np.array(raw_class, dtype=np.int32)[raw_of_out], classes.values),
+        'serviceCodes': (np.array(raw_service, dtype=np.int32)[raw_of_out], services.values),
+    }
+
+
+def resolve_batches(rows, refs: ProviderRefIndex, stats: dict, batch_rows: int = RESOLVE_BATCH_ROWS):
+    """Resolve an iterable of raw rows in `batch_rows`-sized batches."""
+    pending = []
+    for row in rows:
+        pending.append(row)
+        if len(pending) >= batch_rows:
+            yield resolve_batch(pending, refs, stats)
+            pending = []
+    if pending:
+        yield resolve_batch(pending, refs, stats)
+
+
+class RateSpill:
+    """Buffer raw rate rows in memory, spilling to a temp JSONL file when full."""
+
+    def __init__(self, spill_dir: str = None, max_rows: int = SPILL_BUFFER_ROWS):
+        self.spill_dir = spill_dir
+        self.max_rows = max_rows
+        self.buffer = []
+        self.file = None
+        self.spilled = 0
+
+    def append(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.max_rows:
+            self._flush()
+
+    def _flush(self):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile('w+', dir=self.spill_dir)
+        for row in self.buffer:
+            self.file.write(json.dumps(row, separators=(',', ':')) + '\n')
+        self.spilled += len(self.buffer)
+        self.buffer = []
+
+    def __len__(self):
+        return self.spilled + len(self.buffer)
+
+    def drain(self):
+        """Yield every buffered row (spilled rows first), then release storage."""
+        if self.file is not None:
+            self.file.seek(0)
+            for line in self.file:
+                yield tuple(json.loads(line))
+            self.file.close()
+            self.file = None
+        yield from self.buffer
+        self.buffer = []
+
+
+# ============================================================================
+# SECTION READERS
+# ============================================================================
+# Both readers yield ('ref', item) and ('net', item) pairs in document order,
+# plus a single ('order', refs_complete) marker just before the first
+# in_network item telling the engine whether rates can be resolved inline.
+
+IJSON_BACKENDS = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+EXTRACT_MODES = ('items', 'events')
+
+REFS_ITEM = 'provider_references.item'
+NET_ITEM = 'in_network.item'
+NET_RATES = 'in_network.item.negotiated_rates'
+
+
+def get_ijson_backend(name: str = None):
+    """Return the requested ijson backend, or the fastest one installed."""
+    if name:
+        return ijson.get_backend(name)
+    for candidate in IJSON_BACKENDS:
+        try:
+            return ijson.get_backend(candidate)
+        except ImportError:
+            continue
+    raise ImportError("No ijson backend available")
+
+
+PROBE_WINDOW = 64 * 1024
+
+
+class _ReplayReader:
+    """File wrapper that replays already-peeked bytes before reading on."""
+
+    def __init__(self, head: bytes, f):
+        self.head = head
+        self.f = f
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.f.read(size)
+        if size is None or size < 0:
+            chunk, self.head = self.head + self.f.read(), b''
+        else:
+            chunk, self.head = self.head[:size], self.head[size:]
+        return chunk
+
+
+def peek_first_section(f, backend, window: int = PROBE_WINDOW):
+    """
+    Find which of provider_references / in_network comes first in the file.
+
+    Reads as little as possible from the head of `f` and returns
+    (section_key_or_None, reader), where `reader` replays the peeked bytes.
+    """
+    head = b''
+    while True:
+        more = f.read(window)
+        head += more
+        depth = 0
+        try:
+            for event, value in backend.basic_parse(io.BytesIO(head)):
+                if event == 'start_map' or event == 'start_array':
+                    depth += 1
+                elif event == 'end_map' or event == 'end_array':
+                    depth -= 1
+                elif depth == 1 and event == 'map_key' and value in ('provider_references', 'in_network'):
+                    return value, _ReplayReader(head, f)
+        except ijson.IncompleteJSONError:
+            pass
+        if not more:
+            return None, _ReplayReader(head, f)
+        window *= 2
+
+
+class _RefsTee:
+    """
+    File wrapper that feeds every chunk read to a provider_references parser.
+
+    in_network is parsed by the (fast) C `items` generator pulling from this
+    wrapper; refs ride along on a coroutine until in_network starts.
+    """
+
+    def __init__(self, f, backend, skip_refs: bool = False):
+        self.f = f
+        self.items = ijson.sendable_list()
+        self.coro = None if skip_refs else backend.items_coro(self.items, REFS_ITEM, use_float=True)
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.f.read(size)
+        if size and self.coro is not None:
+            if chunk:
+                self.coro.send(chunk)
+            else:
+                self.coro.close()
+                self.coro = None
+        return chunk
+
+    def stop(self):
+        if self.coro is not None:
+            _close_quietly(self.coro)
+            self.coro = None
+
+
+def iter_sections_items(f, backend, chunk_size: int = READ_CHUNK_SIZE,
+                        skip_refs: bool = False, **_):
+    """
+    Build every provider_references and in_network item with ijson `items`.
+
+    The file is read once, but non-target in_network items are still
+    materialized in full before the billing code check. `skip_refs` leaves
+    provider_references unparsed (the engine already has an index).
+    """
+    first_section, reader = peek_first_section(f, backend)
+    tee = _RefsTee(reader, backend, skip_refs)
+    order_sent = False
+
+    for item in backend.items(tee, NET_ITEM, use_float=True, buf_size=chunk_size):
+        for ref_item in tee.items:
+            yield 'ref', ref_item
+        del tee.items[:]
+
+        if not order_sent:
+            # Refs are a top-level array: if they precede in_network they are
+            # all parsed by now, so stop feeding the refs parser.
+            order_sent = True
+            refs_complete = first_section == 'provider_references'
+            if refs_complete:
+                tee.stop()
+            yield 'order', refs_complete
+        yield 'net', item
+
+    # in_network was empty, or refs came after it: drain the rest of the file
+    while tee.read(chunk_size):
+        pass
+    for ref_item in tee.items:
+        yield 'ref', ref_item
+
+
+def iter_sections_events(f, backend, target_cpts=None,
+                         billing_code_types=BILLING_CODE_TYPES, skip_refs: bool = False,
+                         skip_items: int = 0, **_):
+    """
+    Walk the ijson event stream once, skipping non-target rate subtrees.
+
+    Only `billing_code_type` and `billing_code` are kept from each in_network
+    header. When both are known by the time `negotiated_rates` starts and the
+    item is not a target, its events are consumed without building any
+    Python objects; the engine sees a header dict with no rates. Items whose
+    billing code arrives after `negotiated_rates` are built in full.
+    With `skip_refs`, provider_references items are consumed the same way
+    and never reach the engine. The first `skip_items` in_network items
+    (already extracted by a run being resumed) are consumed whole and
+    reach the engine as empty dicts.
+    """
+    events = backend.parse(f, use_float=True)
+    refs_seen = 0
+    items_seen = 0
+    order_sent = False
+    header = None
+
+    for prefix, event, value in events:
+        if header is not None:
+            if prefix == NET_ITEM:
+                if event == 'end_map':
+                    yield 'net', header
+                    header = None
+                elif event == 'map_key' and value == 'negotiated_rates':
+                    code_type = header.get('billing_code_type')
+                    code = header.get('billing_code')
+                    wanted = code_type is None or code is None or (
+                        code_type in billing_code_types
+                        and (not target_cpts or str(code) in target_cpts))
+                    if wanted:
+                        header['negotiated_rates'] = _build_value(events, NET_RATES)
+                    else:
+                        for prefix, event, value in events:
+                            if event == 'end_array' and prefix == NET_RATES:
+                                break
+            elif prefix == 'in_network.item.billing_code':
+                header['billing_code'] = value
+            elif prefix == 'in_network.item.billing_code_type':
+                header['billing_code_type'] = value
+            continue
+
+        if prefix == NET_ITEM and event == 'start_map':
+            if not order_sent:
+                order_sent = True
+                yield 'order', refs_seen > 0
+            items_seen += 1
+            if items_seen <= skip_items:
+                for prefix, event, value in events:
+                    if event == 'end_map' and prefix == NET_ITEM:
+                        break
+                yield 'net', {}
+                continue
+            header = {}
+        elif prefix == REFS_ITEM and event == 'start_map' and skip_refs:
+            for prefix, event, value in events:
+                if event == 'end_map' and prefix == REFS_ITEM:
+                    break
+        elif prefix == REFS_ITEM and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            depth = 1
+            for prefix, event, value in events:
+                builder.event(event, value)
+                if event == 'start_map' or event == 'start_array':
+                    depth += 1
+                elif event == 'end_map' or event == 'end_array':
+                    depth -= 1
+                    if not depth:
+                        break
+            refs_seen += 1
+            yield 'ref', builder.value
+
+
+def _build_value(events, prefix: str):
+    """Build the container that starts with the next event at `prefix`."""
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    for event_prefix, event, value in events:
+        builder.event(event, value)
+        if event == 'start_map' or event == 'start_array':
+            depth += 1
+        elif event == 'end_map' or event == 'end_array':
+            depth -= 1
+        if not depth:
+            break
+    return builder.value
+
+
+def _close_quietly(coro):
+    """Close a parser coroutine that was abandoned mid-document."""
+    try:
+        coro.close()
+    except ijson.IncompleteJSONError:
+        pass
+
+
+SECTION_READERS = {
+    'items': iter_sections_items,
+    'events': iter_sections_events,
+}
+
+
+# ============================================================================
+# SINGLE-PASS ENGINE
+# ============================================================================
+
+def new_stats() -> dict:
+    """Fresh counter dict filled in by `extract_resolved_rows`."""
+    return {
+        'providerReferences': 0,
+        'codesScanned': 0,
+        'targetCodesFound': 0,
+        'rateRecords': 0,
+        'unresolvedRefs': 0,
+        'badNpis': 0,
+        'spilledRows': 0,
+        'refsCached': False,
+        'cptCounts': {},
+        'netItems': 0,
+        'resumeItem': None,
+    }
+
+
+# Counters carried over when an extraction resumes from a checkpoint
+RESUME_COUNTERS = ('codesScanned', 'targetCodesFound', 'rateRecords', 'unresolvedRefs', 'cptCounts')
+
+
+def checkpoint_state(stats: dict) -> dict:
+    """
+    Resume point for the batches yielded so far, or None if there is none.
+
+    Valid right after a batch from `extract_resolved_batches` has been
+    consumed: every rate of the first `netItems` in_network items is in the
+    batches yielded up to then, and none of a later item. There is no resume
+    point while rows wait for provider_references (in_network first).
+    """
+    if stats.get('resumeItem') is None:
+        return None
+    state = {'netItems': stats['resumeItem']}
+    for key in RESUME_COUNTERS:
+        state[key] = dict(stats[key]) if isinstance(stats[key], dict) else stats[key]
+    return state
+
+
+def extract_resolved_batches(source, target_cpts=None, stats: dict = None,
+                             billing_code_types=BILLING_CODE_TYPES,
+                             spill_dir: str = None, chunk_size: int = READ_CHUNK_SIZE,
+                             mode: str = 'events', backend: str = None,
+                             decompress: str = 'inline', refs: ProviderRefIndex = None,
+                             refs_cache: RefIndexCache = None, resume: dict = None,
+                             tee_path: str = None, negotiated_types=None):
+    """
+    Stream NPI-resolved rates from an MRF in a single read, as encoded batches.
+
+    Each batch maps RATE_FIELDS to column arrays, with string columns as
+    (codes, values) pairs (see `resolve_batch`), so neither the join nor the
+    writer touches a Python object per record. `source` is a path, an
+    http(s) URL (streamed while it downloads; `tee_path` also saves the
+    compressed bytes there) or a binary file object. `target_cpts` limits extraction to a set of billing codes
+    (None keeps everything). `mode` picks the section reader: 'events' skips
+    non-target rate subtrees at the event level, 'items' builds every item
+    with ijson `items`. `backend` forces an ijson backend (default: fastest
+    installed, yajl2_c first). `decompress` picks the gzip stage for path
+    sources (see mrf_io.py); its per-stage throughput lands in `stats['io']`
+    when available. `refs` is a prebuilt index for this file (e.g. from
+    `ProviderRefIndex.load`): rates then resolve as they stream and the
+    file's provider_references are skipped instead of parsed. With
+    `refs_cache` (path sources only) the index is looked up in the cache
+    first, and saved to it after a scan that had to build it. `resume` is a
+    `checkpoint_state` from an interrupted run: its in_network items are
+    skipped (without building them in events mode) and its counters
+    restored, so the batches that follow are exactly the rest of an
+    uninterrupted run. `negotiated_types` keeps only prices of those types
+    (see `iter_raw_rates`). Counters are written into `stats` (see `new_stats`)
+    as the scan runs.
+    """
+    if mode not in SECTION_READERS:
+        raise ValueError(f"Unknown extract mode {mode!r}; expected one of {EXTRACT_MODES}")
+    if stats is None:
+        stats = {}
+    for key, value in new_stats().items():
+        stats.setdefault(key, value)
+    skip_items = 0
+    if resume:
+        skip_items = resume['netItems']
+        for key in RESUME_COUNTERS:
+            stats[key] = dict(resume[key]) if isinstance(resume[key], dict) else resume[key]
+    parser_backend = get_ijson_backend(backend)
+    stats['ijsonBackend'] = parser_backend.backend_name
+
+    local_path = isinstance(source, str) and not is_url(source)
+    if refs is None and refs_cache is not None and local_path:
+        refs = refs_cache.get(source)
+    prebuilt = refs is not None
+    if prebuilt:
+        stats['providerReferences'] = len(refs)
+        stats['refsCached'] = True
+    else:
+        refs = ProviderRefIndex()
+    refs_done = prebuilt
+    pending = []
+    spill = RateSpill(spill_dir)
+
+    f = open_mrf(source, decompress, tee_path) if isinstance(source, str) else source
+    try:
+        sections = SECTION_READERS[mode](
+            f, parser_backend, chunk_size=chunk_size, target_cpts=target_cpts,
+            billing_code_types=billing_code_types, skip_refs=prebuilt, skip_items=skip_items)
+
+        for section, item in sections:
+            if section == 'ref':
+                add_provider_reference(refs, item, stats['providerReferences'], stats)
+                stats['providerReferences'] += 1
+                continue
+            if section == 'order':
+                refs_done = refs_done or item
+                continue
+
+            stats['netItems'] += 1
+            if stats['netItems'] <= skip_items:
+                continue
+            if item.get('billing_code_type', '') not in billing_code_types:
+                continue
+            stats['codesScanned'] += 1
+
+            billing_code = str(item.get('billing_code', ''))
+            if target_cpts and billing_code not in target_cpts:
+                continue
+            stats['targetCodesFound'] += 1
+            stats['cptCounts'][billing_code] = stats['cptCounts'].get(billing_code, 0) + 1
+
+            rows = iter_raw_rates(item, negotiated_types, stats)
+            if refs_done:
+                pending.extend(rows)
+                if len(pending) >= RESOLVE_BATCH_ROWS:
+                    batch = resolve_batch(pending, refs, stats)
+                    pending = []
+                    stats['resumeItem'] = stats['netItems']
+                    yield batch
+            else:
+                for row in rows:
+                    spill.append(row)
+    finally:
+        if hasattr(f, 'stage_stats'):
+            stats['io'] = f.stage_stats()
+        if isinstance(source, str):
+            f.close()
+
+    if pending:
+        batch = resolve_batch(pending, refs, stats)
+        stats['resumeItem'] = stats['netItems']
+        yield batch
+    if refs_cache is not None and not prebuilt and isinstance(source, str):
+        # A streamed URL is cached against its archive copy, once complete
+        cache_path = source if local_path else tee_path
+        if cache_path and os.path.exists(cache_path):
+            refs_cache.put(cache_path, refs)
+
+    # in_network arrived first (or refs are absent): resolve the buffered rows now
+    stats['spilledRows'] = len(spill)
+    if len(spill):
+        stats['resumeItem'] = None
+    yield from resolve_batches(spill.drain(), refs, stats)
+
+
+def extract_resolved_rows(source, target_cpts=None, stats: dict = None, **kwargs):
+    """
+    Same as `extract_resolved_batches`, but yields one RATE_FIELDS tuple per rate.
+
+    Rows are plain tuples in RATE_FIELDS order (see mrf_store.py):
+    (procedureCpt, providerRef, providerNpi, providerTin, rate, billingClass,
+    serviceCodes).
+    """
+    for batch in extract_resolved_batches(source, target_cpts, stats=stats, **kwargs):
+        yield from iter_batch_rows(batch)
+
+
+def extract_resolved_rates(source, target_cpts=None, stats: dict = None, **kwargs):
+    """Same as `extract_resolved_rows`, but yields one record dict per rate."""
+    for row in extract_resolved_rows(source, target_cpts, stats=stats, **kwargs):
+        yield dict(zip(RATE_FIELDS, row))
@@ -0,0 +1,127 @@
+"""
+Synthetic CMS In-Network MRF Generator
+
+Writes a schema-shaped in-network rates file so the extraction pipeline can
+be exercised and benchmarked locally, without the real multi-GB UHC file or
+Google Drive. Output is written incrementally, so file size is not bounded
+by RAM.
+
+The shape is configurable: in_network items, provider_references groups,
+provider groups per reference, NPIs per group, negotiated rates per item and
+prices per rate.
+
+Usage:
+    python mrf_synth.py <output_path(.json|.json.gz)> [n_items] [n_refs] [npis_per_group] [rates_per_item]
+"""
+
+import gzip
+import json
+import random
+import sys
+
+# Billing codes used for "target" items; the rest are filler the extractor skips
+DEFAULT_TARGET_CODES = ('27130', '27447', '22612', '45378', '70551', '66984')
+
+
+def write_synthetic_mrf(path: str, n_items: int = 2000, n_refs: int = 500,
+                        npis_per_group: int = 4, rates_per_item: int = 8,
+                        prices_per_rate: int = 2, refs_per_rate: int = 3,
+                        target_share: float = 0.05, refs_first: bool = True,
+                        target_codes=DEFAULT_TARGET_CODES, seed: int = 7,
+                        groups_per_ref: int = 1) -> dict:
+    """
+    Write a synthetic in-network MRF to `path` (gzipped if it ends in `.gz`).
+
+    `target_share` is the fraction of in_network items that carry one of
+    `target_codes`; the rest get random filler CPT codes. Each provider
+    reference holds `groups_per_ref` groups (one TIN each) of
+    `npis_per_group` NPIs. Returns a summary dict with the counts written.
+    """
+    rng = random.Random(seed)
+    opener = gzip.open if path.endswith('.gz') else open
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    target_items = 0
+
+    def write_refs(f):
+        f.write('"provider_references":[')
+        for ref_id in range(n_refs):
+            if ref_id:
+                f.write(',')
+            first_npi = 1000000000 + ref_id * npis_per_group * groups_per_ref
+            f.write(dumps({
+                'provider_group_id': ref_id,
+                'provider_groups': [{
+                    'npi': list(range(first_npi + group * npis_per_group,
+                                      first_npi + (group + 1) * npis_per_group)),
+                    'tin': {'type': 'ein', 'value': f"{10000000 + ref_id * groups_per_ref + group:09d}"},
+                } for group in range(groups_per_ref)],
+            }))
+        f.write(']')
+
+    def write_items(f):
+        nonlocal target_items
+        f.write('"in_network":[')
+        for index in range(n_items):
+            if index:
+                f.write(',')
+            if rng.random() < target_share:
+                billing_code = rng.choice(target_codes)
+                target_items += 1
+            else:
+                billing_code = str(rng.randint(10000, 99999))
+            f.write(dumps({
+                'negotiation_arrangement': 'ffs',
+                'name': f"Procedure {billing_code}",
+                'billing_code_type': 'CPT',
+                'billing_code_type_version': '2026',
+                'billing_code': billing_code,
+                'description': f"Synthetic description for {billing_code}",
+                'negotiated_rates': [{
+                    'provider_references': rng.sample(range(n_refs), min(refs_per_rate, n_refs)),
+                    'negotiated_prices': [{
+                        'negotiated_type': 'negotiated',
+                        'negotiated_rate': round(rng.uniform(25, 25000), 2),
+                        'expiration_date': '9999-12-31',
+                        'service_code': rng.sample(['11', '19', '21', '22', '24'], 2),
+                        'billing_class': rng.choice(['professional', 'institutional']),
+                    } for _ in range(prices_per_rate)],
+                } for _ in range(rates_per_item)],
+            }))
+        f.write(']')
+
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('{"reporting_entity_name":"Synthetic Health Insurance Company",'
+                '"reporting_entity_type":"Health Insurance Issuer",'
+                '"last_updated_on":"2026-01-01","version":"1.0.0",')
+        sections = (write_refs, write_items) if refs_first else (write_items, write_refs)
+        sections[0](f)
+        f.write(',')
+        sections[1](f)
+        f.write('}')
+
+    return {
+        'path': path,
+        'inNetworkItems': n_items,
+        'targetItems': target_items,
+        'providerReferences': n_refs,
+        'groupsPerReference': groups_per_ref,
+        'npisPerGroup': npis_per_group,
+        'ratesPerItem': rates_per_item,
+        'pricesPerRate': prices_per_rate,
+        'targetCodes': list(target_codes),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python mrf_synth.py <output_path> [n_items] [n_refs] [npis_per_group] [rates_per_item]")
+        sys.exit(1)
+
+    summary = write_synthetic_mrf(
+        sys.argv[1],
+        n_items=int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+        n_refs=int(sys.argv[3]) if len(sys.argv) > 3 else 500,
+        npis_per_group=int(sys.argv[4]) if len(sys.argv) > 4 else 4,
+        rates_per_item=int(sys.argv[5]) if len(sys.argv) > 5 else 8,
+    )
+    print(json.dumps(summary, indent=2))